@@ -0,0 +1,99 @@
+"""
+    Сравнение времени сохранения и размера файлов PNG/TGA для каждого профиля сохранения.
+"""
+# pylint: disable=import-error, wrong-import-position
+import io
+import os
+import sys
+import random
+import argparse
+import timeit
+
+import PIL.Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src", "Pillow_PNG_TGA_Editor"))
+
+from helper_funcs import ENCODE_PROFILES, TARGET_OPAQUE_EXTENSION, TARGET_TRANSPARENT_EXTENSION, \
+    get_save_params, has_transparency
+
+
+def make_corpus(size: int, seed: int) -> list[PIL.Image.Image]:
+    """
+    Создание набора тестовых текстур: градиентов с шумом, с прозрачностью и без.
+    :param size: Ширина и высота изображений.
+    :param seed: Начальное значение генератора случайных чисел.
+    :return: Список изображений.
+    """
+    rng = random.Random(seed)
+    gradient = PIL.Image.linear_gradient("L").resize((size, size))
+    noise = PIL.Image.frombytes("L", (size, size), rng.randbytes(size * size))
+    detail = PIL.Image.blend(gradient, noise, 0.25)
+    opaque = PIL.Image.merge("RGB", (gradient, detail, gradient.rotate(90)))
+    alpha = PIL.Image.radial_gradient("L").resize((size, size))
+    transparent = PIL.Image.merge("RGBA", (*opaque.split(), alpha))
+    flat = PIL.Image.new("RGBA", (size, size), (255, 255, 255, 0))
+    flat.paste(opaque.crop((0, 0, size // 2, size // 2)), (size // 4, size // 4))
+    return [opaque, transparent, flat]
+
+
+def load_corpus(dir_path: str) -> list[PIL.Image.Image]:
+    """
+    Загрузка изображений из директории.
+    :param dir_path: Путь к директории.
+    :return: Список изображений.
+    """
+    images = []
+    for file in sorted(os.listdir(dir_path)):
+        try:
+            with PIL.Image.open(os.path.join(dir_path, file)) as img_object:
+                img_object.load()
+                images.append(img_object.copy())
+        except OSError:
+            continue
+    return images
+
+
+def main() -> int:
+    """
+    Запуск сравнения.
+    :return: Код ошибки.
+    """
+    parser = argparse.ArgumentParser(description="save_image encode profile benchmark")
+    parser.add_argument("--input", type=str, default="",
+                        help="Directory with sample images instead of the synthetic corpus")
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    images = load_corpus(args.input) if args.input != "" else make_corpus(args.size, args.seed)
+    targets = []  # Пары из изображения в целевом режиме и расширения, как в resave_img.
+    for img_object in images:
+        if has_transparency(img_object):
+            targets.append((img_object.convert("RGBA"), TARGET_TRANSPARENT_EXTENSION))
+        else:
+            targets.append((img_object.convert("RGB"), TARGET_OPAQUE_EXTENSION))
+    print(f"{'profile':>10} {'ext':>5} {'files':>6} {'encode, ms':>12} {'size, KiB':>12}")
+    for profile in ENCODE_PROFILES:
+        for target_ext in (TARGET_OPAQUE_EXTENSION, TARGET_TRANSPARENT_EXTENSION):
+            elapsed = 0.0
+            size = 0
+            count = 0
+            for img_object, ext in targets:
+                if ext != target_ext:
+                    continue
+                params = get_save_params(ext, profile)
+                fmt = PIL.Image.registered_extensions()[ext]
+                elapsed += min(timeit.repeat(lambda img=img_object, fmt=fmt, params=params:
+                                             img.save(io.BytesIO(), fmt, **params),
+                                             number=1, repeat=args.repeat))
+                buffer = io.BytesIO()
+                img_object.save(buffer, fmt, **params)
+                size += buffer.tell()
+                count += 1
+            print(f"{profile:>10} {target_ext:>5} {count:>6} {elapsed * 1000:>12.2f} "
+                  f"{size / 1024:>12.1f}")
+    return os.EX_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
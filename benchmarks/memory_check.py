@@ -0,0 +1,115 @@
+"""
+    Проверка того, что пиковая память и количество открытых дескрипторов файлов при обработке
+    большого набора изображений ограничены объёмом одновременно обрабатываемых изображений, а не
+    размером набора. Каждый инструмент запускается в отдельном процессе; при превышении границы
+    проверка завершается с ошибкой.
+"""
+# pylint: disable=import-error, wrong-import-position
+import os
+import sys
+import json
+import random
+import argparse
+import logging
+import subprocess
+import tempfile
+
+import PIL.Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src", "Pillow_PNG_TGA_Editor"))
+
+from general_funcs import init_i18n
+from stage_timing import get_resource_usage
+from executor_funcs import BACKEND_THREAD
+
+TOOLS = ("resave_img", "mirror_concat_img", "split_eyes_img")
+PIXEL_COPIES = 6  # Допустимое количество копий пикселей одного изображения в обработке.
+SLACK_BYTES = 64 << 20  # Запас на буферы кодеков, пулы и фрагментацию памяти.
+
+
+def generate_corpus(dir_path: str, count: int, size: int, seed: int):
+    """
+    Создание набора изображений: половина с прозрачностью, половина без.
+    :param dir_path: Путь к директории.
+    :param count: Количество изображений.
+    :param size: Ширина и высота изображений (кратная 4).
+    :param seed: Начальное значение генератора случайных чисел.
+    """
+    rng = random.Random(seed)
+    noise = PIL.Image.frombytes("RGB", (size, size), rng.randbytes(size * size * 3))
+    alpha = PIL.Image.radial_gradient("L").resize((size, size))
+    transparent = PIL.Image.merge("RGBA", (*noise.split(), alpha))
+    for i in range(count):
+        img_object = transparent if i % 2 == 0 else noise
+        img_object.save(os.path.join(dir_path, f"{i:05}.bmp" if i % 2 else f"{i:05}.png"),
+                        compress_level=1)
+
+
+def run_tool(tool: str, dir_path: str, jobs: int) -> dict:
+    """
+    Обработка директории одним инструментом в текущем процессе с замером памяти и дескрипторов.
+    :param tool: Название инструмента.
+    :param dir_path: Путь к директории.
+    :param jobs: Количество параллельных задач.
+    :return: Показатели до и после обработки.
+    """
+    from pillow_png_tga_editor import execute_convert, ConvertOptions  # pylint: disable=import-outside-toplevel
+    from mirror_concat_img import execute_mirror_concat  # pylint: disable=import-outside-toplevel
+    from split_eyes_img import execute_split_eyes_img  # pylint: disable=import-outside-toplevel
+    init_i18n()
+    logging.disable(logging.INFO)
+    file_paths = [os.path.join(dir_path, file) for file in sorted(os.listdir(dir_path))]
+    before = get_resource_usage()
+    if tool == "resave_img":
+        execute_convert([dir_path], ConvertOptions(backend=BACKEND_THREAD, jobs=jobs))
+    elif tool == "mirror_concat_img":
+        execute_mirror_concat(file_paths, BACKEND_THREAD, jobs)
+    else:
+        execute_split_eyes_img(file_paths, BACKEND_THREAD, jobs)
+    return {"before": before, "after": get_resource_usage()}
+
+
+def main() -> int:
+    """
+    Запуск проверки.
+    :return: Код ошибки.
+    """
+    parser = argparse.ArgumentParser(description="Bounded memory and file descriptor check")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--jobs", "-j", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tools", nargs="+", choices=TOOLS, default=list(TOOLS))
+    parser.add_argument("--run", nargs=2, metavar=("TOOL", "DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run is not None:
+        print(json.dumps(run_tool(args.run[0], args.run[1], args.jobs)))
+        return os.EX_OK
+    if args.size % 4 != 0 or args.size < 4:
+        parser.error("size must be a positive multiple of 4")
+    if get_resource_usage()["peak_rss"] is None:
+        print("Peak memory is not available on this platform.")
+        return os.EX_OK
+    # Изображение в обработке занимает до size * size * 4 байт в режиме RGBA.
+    bound = args.jobs * PIXEL_COPIES * args.size * args.size * 4 + SLACK_BYTES
+    failed = False
+    print(f"{'tool':>18} {'peak delta, MiB':>16} {'bound, MiB':>11} {'fds before':>11} "
+          f"{'fds after':>10}")
+    for tool in args.tools:
+        with tempfile.TemporaryDirectory() as temp_path:
+            generate_corpus(temp_path, args.count, args.size, args.seed)
+            output = subprocess.run([sys.executable, __file__, "--jobs", str(args.jobs), "--run",
+                                     tool, temp_path], check=True, capture_output=True,
+                                    text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        before, after = result["before"], result["after"]
+        delta = after["peak_rss"] - before["peak_rss"]
+        fds_ok = before["open_fds"] is None or after["open_fds"] <= before["open_fds"]
+        failed |= delta > bound or not fds_ok
+        print(f"{tool:>18} {delta / (1 << 20):>16.1f} {bound / (1 << 20):>11.1f} "
+              f"{str(before['open_fds']):>11} {str(after['open_fds']):>10}")
+    return 1 if failed else os.EX_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
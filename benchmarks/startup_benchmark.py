@@ -0,0 +1,77 @@
+"""
+    Измерение времени холодного запуска каждого инструмента в режиме --headless на одном маленьком
+    изображении. Завершается с ошибкой, если медианное время превышает заданный порог.
+"""
+import os
+import sys
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+import time
+
+import PIL.Image
+
+SCRIPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src",
+                            "Pillow_PNG_TGA_Editor")
+TOOLS = {"pillow_png_tga_editor": [], "mirror_concat_img": [], "split_eyes_img": [],
+         "pipeline_img": ["--ops", "normalize"]}
+TARGET_MS = 300.0  # Порог медианного времени запуска: измеренные медианы - около 210-260 мс.
+
+
+def measure_tool(tool: str, extra_args: list[str], sample_path: str, work_path: str,
+                 repeat: int) -> list[float]:
+    """
+    Многократный запуск инструмента в отдельном процессе на свежей копии изображения.
+    :param tool: Название скрипта без расширения.
+    :param extra_args: Дополнительные аргументы командной строки.
+    :param sample_path: Путь к исходному изображению.
+    :param work_path: Путь к рабочей директории.
+    :param repeat: Количество запусков.
+    :return: Время каждого запуска в миллисекундах.
+    """
+    env = dict(os.environ)
+    env.pop("DISPLAY", None)
+    timings = []
+    for _ in range(repeat):
+        shutil.rmtree(work_path, ignore_errors=True)
+        os.mkdir(work_path)
+        file_path = shutil.copy(sample_path, work_path)
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(SCRIPTS_PATH, tool + ".py"), file_path,
+                        "--headless", *extra_args], env=env, check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main() -> int:
+    """
+    Запуск измерения.
+    :return: Код ошибки.
+    """
+    parser = argparse.ArgumentParser(description="Headless cold-start benchmark")
+    parser.add_argument("--tools", nargs="+", choices=TOOLS, default=list(TOOLS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=TARGET_MS,
+                        help="Fail if a median start-up time exceeds this value (0 disables)")
+    args = parser.parse_args()
+    failed = False
+    print(f"{'tool':>22} {'median, ms':>12} {'min, ms':>10}")
+    with tempfile.TemporaryDirectory() as temp_path:
+        sample_path = os.path.join(temp_path, "sample.png")
+        PIL.Image.new("RGBA", (64, 32), (255, 255, 255, 128)).save(sample_path)
+        for tool in args.tools:
+            timings = measure_tool(tool, TOOLS[tool], sample_path, os.path.join(temp_path, tool),
+                                   args.repeat)
+            median = statistics.median(timings)
+            exceeded = 0 < args.target_ms < median
+            failed |= exceeded
+            print(f"{tool:>22} {median:>12.1f} {min(timings):>10.1f}"
+                  f"{' exceeds ' + str(args.target_ms) + ' ms' if exceeded else ''}")
+    return 1 if failed else os.EX_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+    Сравнение обработки большого изображения целиком и полосами (--strip-height) в mirror_concat_img
+    и split_eyes_img: пиковый объём резидентной памяти процесса (VmRSS) и отдельно её анонимной
+    части, страниц отображённых файлов и разделяемой памяти (tmpfs), время и побайтовое совпадение
+    результатов. Каждый запуск выполняется в отдельном процессе.
+"""
+# pylint: disable=import-error, wrong-import-position
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import logging
+import threading
+import subprocess
+import tempfile
+
+import PIL.Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src", "Pillow_PNG_TGA_Editor"))
+
+from general_funcs import init_i18n
+from helper_funcs import ENCODE_PROFILES, ENCODE_PROFILE_FAST, get_save_params
+
+TOOLS = ("mirror_concat_img", "split_eyes_img")
+STATUS_PATH = "/proc/self/status"  # Сведения о памяти процесса в Linux.
+SAMPLE_SECONDS = 0.002  # Интервал замера памяти.
+MEMORY_FIELDS = ("VmRSS", "RssAnon", "RssFile", "RssShmem")  # Вся резидентная память и её части:
+# анонимная, страницы файлов (в том числе отображённых) и разделяемая память (файлы в tmpfs).
+
+
+def get_memory() -> dict[str, int] | None:
+    """
+    Получение объёма резидентной памяти процесса и её частей.
+    :return: Объёмы в байтах по названиям полей MEMORY_FIELDS или None, если они недоступны на этой
+        платформе.
+    """
+    memory = {}
+    try:
+        with open(STATUS_PATH, encoding="utf-8") as f:
+            for line in f:
+                field = line.split(":", 1)[0]
+                if field in MEMORY_FIELDS:
+                    memory[field] = int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return memory if len(memory) == len(MEMORY_FIELDS) else None
+
+
+def run_tool(tool: str, file_path: str, profile: str, strip_height: int | None) -> dict:
+    """
+    Обработка изображения инструментом в текущем процессе с замером пиковой памяти.
+    :param tool: Название инструмента.
+    :param file_path: Путь к изображению.
+    :param profile: Название профиля сохранения.
+    :param strip_height: Высота полосы в строках или None.
+    :return: Прирост пиковой памяти по полям MEMORY_FIELDS и время обработки.
+    """
+    from mirror_concat_img import mirror_concat_file  # pylint: disable=import-outside-toplevel
+    from split_eyes_img import split_eyes_file  # pylint: disable=import-outside-toplevel
+    init_i18n()
+    logging.disable(logging.INFO)
+    before = get_memory() or {}  # Доступность проверяется до запуска процесса.
+    peak = dict(before)
+    stop_event = threading.Event()
+
+    def update_peak():
+        for field, value in get_memory().items():
+            peak[field] = max(peak[field], value)
+
+    def sample():
+        while not stop_event.wait(SAMPLE_SECONDS):
+            update_peak()
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    func = mirror_concat_file if tool == "mirror_concat_img" else split_eyes_file
+    func(file_path, profile, strip_height)
+    seconds = time.perf_counter() - start
+    stop_event.set()
+    sampler.join()
+    update_peak()
+    return {"peak_delta": {field: peak[field] - before[field] for field in MEMORY_FIELDS},
+            "seconds": seconds}
+
+
+def get_tree_hash(dir_path: str) -> str:
+    """
+    Вычисление хэша содержимого всех файлов директории.
+    :param dir_path: Путь к директории.
+    :return: Хэш в шестнадцатеричном виде.
+    """
+    tree_hash = hashlib.blake2b(digest_size=16)
+    for file in sorted(os.listdir(dir_path)):
+        tree_hash.update(file.encode())
+        with open(os.path.join(dir_path, file), "rb") as f:
+            tree_hash.update(f.read())
+    return tree_hash.hexdigest()
+
+
+def main() -> int:
+    """
+    Запуск сравнения.
+    :return: Код ошибки.
+    """
+    parser = argparse.ArgumentParser(description="Whole-image vs strip processing benchmark")
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--strip-height", type=int, default=256)
+    parser.add_argument("--ext", choices=(".png", ".tga"), default=".tga")
+    parser.add_argument("--profile", choices=ENCODE_PROFILES, default=ENCODE_PROFILE_FAST)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tools", nargs="+", choices=TOOLS, default=list(TOOLS))
+    parser.add_argument("--run", nargs=3, metavar=("TOOL", "FILE", "STRIP"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run is not None:
+        strip_height = int(args.run[2])
+        print(json.dumps(run_tool(args.run[0], args.run[1], args.profile,
+                                  strip_height if strip_height > 0 else None)))
+        return os.EX_OK
+    if args.size % 4 != 0 or args.size < 4:
+        parser.error("size must be a positive multiple of 4")
+    if get_memory() is None:
+        print("Process memory is not available on this platform.")
+        return os.EX_OK
+    rng = random.Random(args.seed)
+    tile = PIL.Image.frombytes("RGBA", (256, 256), rng.randbytes(256 * 256 * 4))
+    failed = False
+    print(f"{'tool':>18} {'mode':>7} " + " ".join(f"{field + ', MiB':>14}" for field in
+                                                   MEMORY_FIELDS) +
+          f" {'seconds':>8} {'identical':>10}")
+    for tool in args.tools:
+        hashes = []
+        for strip_height in (0, args.strip_height):
+            with tempfile.TemporaryDirectory() as temp_path:
+                file_path = os.path.join(temp_path, "atlas" + args.ext)
+                tile.resize((args.size, args.size), PIL.Image.Resampling.NEAREST).save(
+                    file_path, **get_save_params(args.ext, args.profile))
+                output = subprocess.run([sys.executable, __file__, "--profile", args.profile,
+                                         "--run", tool, file_path, str(strip_height)],
+                                        check=True, capture_output=True, text=True).stdout
+                hashes.append(get_tree_hash(temp_path))
+            result = json.loads(output.strip().splitlines()[-1])
+            identical = "" if strip_height == 0 else str(hashes[0] == hashes[-1])
+            failed |= identical == "False"
+            print(f"{tool:>18} {'strips' if strip_height else 'whole':>7} " + " ".join(
+                f"{result['peak_delta'][field] / (1 << 20):>14.1f}" for field in MEMORY_FIELDS) +
+                  f" {result['seconds']:>8.2f} {identical:>10}")
+    return 1 if failed else os.EX_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
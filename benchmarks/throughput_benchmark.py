@@ -0,0 +1,221 @@
+"""
+    Измерение пропускной способности resave_img, mirror_concat_img и split_eyes_img на
+    воспроизводимом синтетическом наборе текстур. Результат сохраняется в JSON, который можно
+    сравнить с результатом предыдущего запуска.
+"""
+# pylint: disable=import-error, wrong-import-position
+import os
+import sys
+import json
+import math
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import time
+from collections.abc import Callable
+from functools import partial
+from concurrent.futures import as_completed
+
+import PIL
+import PIL.Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src", "Pillow_PNG_TGA_Editor"))
+
+from general_funcs import init_i18n
+from executor_funcs import BACKEND_THREAD, EXECUTOR_BACKENDS, create_executor
+from helper_funcs import ENCODE_PROFILES, ENCODE_PROFILE_MAX
+from pillow_png_tga_editor import convert_file
+from mirror_concat_img import mirror_concat_file
+from split_eyes_img import split_eyes_file
+
+REPORT_VERSION = 1  # Версия формата отчёта.
+TOOLS = {"resave_img": convert_file, "mirror_concat_img": mirror_concat_file,
+         "split_eyes_img": split_eyes_file}
+
+
+def make_texture(size: tuple[int, int], rng: random.Random) -> PIL.Image.Image:
+    """
+    Создание непрозрачной текстуры из градиента и шума, чтобы сжатие было похоже на реальное.
+    :param size: Ширина и высота изображения.
+    :param rng: Генератор случайных чисел.
+    :return: Изображение в режиме RGB.
+    """
+    gradient = PIL.Image.linear_gradient("L").resize(size)
+    noise = PIL.Image.frombytes("L", size, rng.randbytes(size[0] * size[1]))
+    detail = PIL.Image.blend(gradient, noise, 0.25)
+    return PIL.Image.merge("RGB", (gradient, detail, gradient.transpose(
+        PIL.Image.Transpose.FLIP_LEFT_RIGHT)))
+
+
+def generate_corpus(dir_path: str, sizes: list[int], seed: int) -> list[str]:
+    """
+    Создание набора текстур: непрозрачные RGB, RGBA с прозрачностью и без, палитровые с
+    transparency, а также изображения с неквадратным и неподдерживаемым split_eyes_img разрешением.
+    :param dir_path: Путь к директории, в которой создаются файлы.
+    :param sizes: Размеры сторон квадратных текстур (кратные 4).
+    :param seed: Начальное значение генератора случайных чисел.
+    :return: Список путей к созданным файлам.
+    """
+    rng = random.Random(seed)
+    file_paths = []
+    for size in sizes:
+        opaque = make_texture((size, size), rng)
+        alpha = PIL.Image.radial_gradient("L").resize((size, size))
+        rgba_alpha = PIL.Image.merge("RGBA", (*opaque.split(), alpha))
+        palette = opaque.quantize(255)
+        palette.info["transparency"] = 0
+        images = {
+            "opaque_rgb.png": opaque,
+            "opaque_rgb.bmp": opaque,
+            "rgba_alpha.png": rgba_alpha,
+            "rgba_alpha.tga": rgba_alpha,
+            "rgba_opaque.png": opaque.convert("RGBA"),
+            "palette_transparency.png": palette,
+            "odd_rgba.png": PIL.Image.merge("RGBA", (*make_texture(
+                (size * 3 // 2, size // 2 + 12), rng).split(), PIL.Image.new(
+                "L", (size * 3 // 2, size // 2 + 12), 255))),
+            "unsupported_rgb.png": make_texture((size + 1, size // 2 + 1), rng)
+        }
+        for name, img_object in images.items():
+            file_path = os.path.join(dir_path, f"{size}_{name}")
+            if name.endswith(".tga"):
+                img_object.save(file_path, compression="tga_rle")
+            else:
+                img_object.save(file_path)
+            file_paths.append(file_path)
+    return file_paths
+
+
+def timed_call(func: Callable[[str], object], file_path: str) -> tuple[float, str]:
+    """
+    Вызов функции обработки файла с измерением времени.
+    :param func: Функция, вызываемая для файла.
+    :param file_path: Путь к файлу.
+    :return: Время выполнения в секундах и текст ошибки (пустая строка, если ошибки не было).
+    """
+    start = time.perf_counter()
+    try:
+        func(file_path)
+    except OSError as e:
+        return time.perf_counter() - start, str(e)
+    return time.perf_counter() - start, ""
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """
+    Вычисление перцентиля методом ближайшего ранга.
+    :param values: Отсортированный список значений.
+    :param fraction: Доля от 0 до 1.
+    :return: Значение перцентиля или 0, если список пуст.
+    """
+    if len(values) < 1:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def run_tool(func: Callable[[str], object], file_paths: list[str], backend: str,
+             jobs: int, prefetch_limit: int | None = None) -> dict:
+    """
+    Обработка набора файлов одной функцией и подсчёт показателей.
+    :param func: Функция, вызываемая для каждого файла.
+    :param file_paths: Пути к файлам.
+    :param backend: Тип пула: потоки или процессы.
+    :param jobs: Количество параллельных задач.
+    :param prefetch_limit: Ограничение объёма упреждающего чтения в байтах или None без
+        разделения на стадии. Задержка при этом измеряется без чтения и записи файлов.
+    :return: Словарь с показателями.
+    """
+    input_bytes = sum(os.path.getsize(file_path) for file_path in file_paths)
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    with create_executor(backend, jobs, prefetch_limit) as executor:
+        futures = [executor.submit(partial(timed_call, func), file_path) for file_path in
+                   file_paths]
+        for future in as_completed(futures):
+            latency, error = future.result()
+            latencies.append(latency)
+            errors += error != ""
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {"files": len(file_paths), "errors": errors, "input_mb": input_bytes / (1 << 20),
+            "seconds": elapsed, "files_per_s": len(file_paths) / elapsed,
+            "mb_per_s": input_bytes / (1 << 20) / elapsed,
+            "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000}
+
+
+def compare_reports(report: dict, baseline_path: str):
+    """
+    Вывод отношения показателей текущего запуска к показателям предыдущего.
+    :param report: Отчёт текущего запуска.
+    :param baseline_path: Путь к отчёту предыдущего запуска.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != report["config"]:
+        print("Warning: baseline was produced with a different configuration.")
+    print(f"{'tool':>18} {'files/s':>10} {'MB/s':>10} {'p50':>10} {'p95':>10}")
+    for tool, result in report["tools"].items():
+        base = baseline.get("tools", {}).get(tool)
+        if base is None:
+            continue
+        print(f"{tool:>18} " + " ".join(
+            f"{result[key] / base[key] if base[key] else 0:>9.2f}x" for key in (
+                "files_per_s", "mb_per_s", "p50_ms", "p95_ms")))
+
+
+def main() -> int:
+    """
+    Запуск измерения.
+    :return: Код ошибки.
+    """
+    parser = argparse.ArgumentParser(description="Throughput benchmark on a synthetic corpus")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 1024, 2048])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tools", nargs="+", choices=TOOLS, default=list(TOOLS))
+    parser.add_argument("--profile", choices=ENCODE_PROFILES, default=ENCODE_PROFILE_MAX)
+    parser.add_argument("--backend", choices=EXECUTOR_BACKENDS, default=BACKEND_THREAD)
+    parser.add_argument("--jobs", "-j", type=int, default=1)
+    parser.add_argument("--prefetch", type=float, default=0.0,
+                        help="Read-ahead limit in MB for the staged pipeline (0 disables)")
+    parser.add_argument("--output", type=str, default="", help="Path to the JSON report")
+    parser.add_argument("--compare", type=str, default="",
+                        help="Path to a previous JSON report to compare with")
+    args = parser.parse_args()
+    if any(size % 4 != 0 or size < 4 for size in args.sizes):
+        parser.error("sizes must be positive multiples of 4")
+    init_i18n()
+    report = {"version": REPORT_VERSION,
+              "environment": {"python": platform.python_version(), "pillow": PIL.__version__,
+                              "platform": platform.platform(), "cpu_count": os.cpu_count()},
+              "config": {"sizes": args.sizes, "seed": args.seed, "profile": args.profile,
+                         "backend": args.backend, "jobs": args.jobs, "prefetch": args.prefetch},
+              "tools": {}}
+    with tempfile.TemporaryDirectory() as temp_path:
+        corpus_path = os.path.join(temp_path, "corpus")
+        os.mkdir(corpus_path)
+        file_names = [os.path.basename(file_path) for file_path in
+                      generate_corpus(corpus_path, args.sizes, args.seed)]
+        for tool in args.tools:
+            work_path = os.path.join(temp_path, tool)
+            shutil.copytree(corpus_path, work_path)  # Инструменты изменяют файлы набора.
+            func = partial(TOOLS[tool], profile=args.profile)
+            report["tools"][tool] = run_tool(func, [os.path.join(work_path, file_name) for
+                                                    file_name in file_names],
+                                             args.backend, args.jobs,
+                                             int(args.prefetch * (1 << 20)) or None)
+            shutil.rmtree(work_path)
+    print(json.dumps(report, indent=2))
+    if args.output != "":
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare != "":
+        compare_reports(report, args.compare)
+    return os.EX_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
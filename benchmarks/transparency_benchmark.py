@@ -0,0 +1,88 @@
+"""
+    Сравнение скорости определения прозрачности текстур 4K/8K новой реализацией has_transparency
+    и прежней реализацией на основе полного getextrema(), а также проверка результата для режимов
+    с умноженной на альфа-канал яркостью (RGBa, La), которые прежняя реализация не поддерживала.
+"""
+# pylint: disable=import-error, wrong-import-position
+import os
+import sys
+import argparse
+import timeit
+
+import PIL.Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src", "Pillow_PNG_TGA_Editor"))
+
+from helper_funcs import has_transparency
+
+LEGACY_MODES = ("RGBA", "P")  # Режимы, которые поддерживала прежняя реализация.
+
+
+def legacy_has_transparency(img_object: PIL.Image.Image) -> bool:
+    """
+    Прежняя реализация проверки прозрачности.
+    :param img_object: Изображение.
+    :return: Является ли изображение частично или полностью прозрачным.
+    """
+    if img_object.mode == "P":
+        transparent = img_object.info.get("transparency", -1)
+        for _, index in img_object.getcolors():
+            if index == transparent:
+                return True
+    elif img_object.mode == "RGBA":
+        extrema = img_object.getextrema()
+        if extrema[3][0] < 255:
+            return True
+    return False
+
+
+def make_cases(size: int) -> dict[str, PIL.Image.Image]:
+    """
+    Создание тестовых изображений заданного размера.
+    :param size: Ширина и высота изображения.
+    :return: Словарь изображений по названию случая.
+    """
+    opaque = PIL.Image.new("RGBA", (size, size), (128, 64, 32, 255))
+    first = opaque.copy()
+    first.putpixel((0, 0), (128, 64, 32, 0))
+    middle = opaque.copy()
+    middle.putpixel((size // 2, size // 2), (128, 64, 32, 0))
+    last = opaque.copy()
+    last.putpixel((size - 1, size - 1), (128, 64, 32, 0))
+    cases = {"opaque": opaque, "first_pixel": first, "middle_pixel": middle, "last_pixel": last}
+    for mode in ("RGBa", "La"):
+        cases[mode + "_opaque"] = opaque.convert(mode)
+        cases[mode + "_last_pixel"] = last.convert(mode)
+    return cases
+
+
+def main() -> int:
+    """
+    Запуск сравнения.
+    :return: Код ошибки.
+    """
+    parser = argparse.ArgumentParser(description="has_transparency benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4096, 8192])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(f"{'size':>6} {'case':>15} {'legacy, ms':>12} {'current, ms':>12} {'speedup':>8}")
+    for size in args.sizes:
+        for name, img_object in make_cases(size).items():
+            expected = img_object.getextrema()[-1][0] < 255  # Альфа-канал последний.
+            if has_transparency(img_object) != expected:
+                print(f"Result mismatch for {name} at {size}x{size}.")
+                return 1
+            current = min(timeit.repeat(lambda img=img_object: has_transparency(img),
+                                        number=1, repeat=args.repeat)) * 1000
+            if img_object.mode not in LEGACY_MODES:
+                print(f"{size:>6} {name:>15} {'-':>12} {current:>12.2f} {'-':>8}")
+                continue
+            legacy = min(timeit.repeat(lambda img=img_object: legacy_has_transparency(img),
+                                       number=1, repeat=args.repeat)) * 1000
+            print(f"{size:>6} {name:>15} {legacy:>12.2f} {current:>12.2f} "
+                  f"{legacy / current:>7.1f}x")
+    return os.EX_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
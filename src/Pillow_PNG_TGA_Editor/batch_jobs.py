@@ -0,0 +1,393 @@
+"""
+    Скрипт, выполняющий задания из файла JSON или TOML (конвертацию, отзеркаливание, разделение
+    текстур и цепочки операций для разных путей) в одном процессе с общим пулом. Файлы всех
+    заданий чередуются, поэтому маленькое задание не ждёт окончания большого.
+"""
+# pylint: disable=import-error, duplicate-code, wrong-import-position
+import os
+import sys
+import json
+import time
+import tomllib
+import argparse
+import logging
+import multiprocessing
+from collections.abc import Callable, Iterator
+from functools import partial
+from concurrent.futures import Executor, Future
+
+from i18n import t
+import PIL.Image
+from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+
+from general_funcs import init_app
+from executor_funcs import BACKEND_THREAD, create_executor, iterate_tasks, add_executor_arguments
+from stage_timing import RunReport, add_report_arguments, create_report
+from staged_io import StagedExecutor
+from directory_index import DirectoryIndex, get_key
+from helper_funcs import OPERATIONS, ENCODE_PROFILES, ENCODE_PROFILE_MAX
+from pillow_png_tga_editor import convert_file, get_input_files, batch_remove_files
+from mirror_concat_img import mirror_concat_file
+from split_eyes_img import split_eyes_file
+from pipeline_img import pipeline_file
+
+TOOL_CONVERT = "convert"  # Конвертация, как в pillow_png_tga_editor.
+TOOL_MIRROR_CONCAT = "mirror_concat"  # Отзеркаливание, как в mirror_concat_img.
+TOOL_SPLIT_EYES = "split_eyes"  # Разделение текстуры глаз/рта, как в split_eyes_img.
+TOOL_PIPELINE = "pipeline"  # Цепочка операций, как в pipeline_img.
+TOOLS = (TOOL_CONVERT, TOOL_MIRROR_CONCAT, TOOL_SPLIT_EYES, TOOL_PIPELINE)
+JOB_KEYS = {"name", "tool", "paths", "profile", "reduce", "ops",
+            "strip_height"}  # Допустимые ключи задания.
+
+
+class Job:  # pylint: disable=too-many-instance-attributes
+    """
+    Задание из файла заданий и его результаты.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments, too-many-positional-arguments
+            self, name: str, tool: str, input_paths: list[str], profile: str = ENCODE_PROFILE_MAX,
+            reduce: bool = False, operations: list[str] | None = None,
+            strip_height: int | None = None):
+        """
+        :param name: Название задания.
+        :param tool: Название инструмента.
+        :param input_paths: Пути к файлам или директориям с файлами.
+        :param profile: Название профиля сохранения.
+        :param reduce: Уменьшать ли размер непрозрачных PNG без потерь.
+        :param operations: Названия операций в порядке применения (только для цепочки операций).
+        :param strip_height: Высота полосы в строках для обработки изображений полосами или None
+            (только для отзеркаливания и разделения текстур).
+        """
+        self.name = name
+        self.tool = tool
+        self.input_paths = input_paths
+        self.profile = profile
+        self.reduce = reduce
+        self.operations = operations or []
+        self.strip_height = strip_height
+        self.file_paths: list[str] = []
+        self.remaining = 0  # Количество файлов, обработка которых ещё не завершена.
+        self.processed = 0  # Количество файлов, по которым был сохранён хотя бы один файл.
+        self.unchanged = 0  # Количество файлов, которые уже были в нужном формате.
+        self.outputs = 0  # Количество сохранённых файлов.
+        self.errors: list[dict[str, str]] = []  # Файлы, которые не удалось обработать.
+        self.exist_files: list[str] = []  # Файлы, новый путь которых уже занят.
+        self.obsolete_files: list[str] = []  # Файлы, которые нужно удалить после задания.
+        self.removed = 0  # Количество удалённых файлов.
+        self.start = 0.0
+        self.seconds = 0.0
+
+    def get_func(self, index: DirectoryIndex | None = None) -> Callable[[str], object]:
+        """
+        Получение функции обработки одного файла задания.
+        :param index: Индекс директорий для проверки новых путей или None, чтобы проверять на
+            диске.
+        :return: Функция, вызываемая для каждого файла.
+        """
+        if self.tool == TOOL_CONVERT:
+            return partial(convert_file, profile=self.profile, reduce=self.reduce, index=index)
+        if self.tool == TOOL_MIRROR_CONCAT:
+            return partial(mirror_concat_file, profile=self.profile,
+                           strip_height=self.strip_height)
+        if self.tool == TOOL_SPLIT_EYES:
+            return partial(split_eyes_file, profile=self.profile, strip_height=self.strip_height)
+        return partial(pipeline_file, operations=self.operations, profile=self.profile,
+                       reduce=self.reduce, index=index)
+
+    def add_result(self, file_path: str, future: Future, index: DirectoryIndex | None = None):
+        """
+        Учёт результата обработки одного файла.
+        :param file_path: Путь к файлу.
+        :param future: Завершённая задача.
+        :param index: Индекс директорий, в который добавляются сохранённые файлы, или None.
+        """
+        self.remaining -= 1
+        try:
+            result = future.result()
+        except PIL.UnidentifiedImageError:
+            self.errors.append({"file": file_path, "error": t("main.file_not_image") % file_path})
+            return
+        except FileExistsError as e:
+            self.exist_files.append(file_path)
+            logging.info(e)
+            return
+        except OSError as e:
+            self.errors.append({"file": file_path, "error": str(e)})
+            logging.info(t("main.exception"), file_path)
+            logging.info(e)
+            return
+        if self.tool == TOOL_CONVERT:
+            result_paths = [] if result == "" else [result]
+            if result not in ("", file_path):
+                self.obsolete_files.append(file_path)
+        elif self.tool == TOOL_MIRROR_CONCAT:
+            result_paths = [result]
+        elif self.tool == TOOL_SPLIT_EYES:
+            result_paths = result
+        else:
+            result_paths, obsolete_paths = result
+            self.obsolete_files.extend(obsolete_paths)
+        result_paths = [result_path for result_path in result_paths if result_path != ""]
+        for result_path in result_paths:
+            logging.info("%s -> %s", file_path, result_path)
+            if index is not None:
+                index.add(result_path)
+        self.outputs += len(result_paths)
+        if len(result_paths) > 0:
+            self.processed += 1
+        else:
+            self.unchanged += 1
+
+    def finish(self, index: DirectoryIndex | None = None):
+        """
+        Удаление сконвертированных файлов после обработки всех файлов задания.
+        :param index: Индекс директорий, из которого убираются удалённые файлы, или None.
+        """
+        batch_remove_files(self.obsolete_files)
+        for obsolete_file in self.obsolete_files:
+            if not os.path.exists(obsolete_file):
+                self.removed += 1
+                if index is not None:
+                    index.discard(obsolete_file)
+        self.seconds = time.perf_counter() - self.start
+        logging.info(t("main.job_finished"), self.name, self.processed, self.unchanged,
+                     len(self.errors) + len(self.exist_files), round(self.seconds, 2))
+
+    def to_dict(self) -> dict:
+        """
+        Получение результатов задания.
+        :return: Словарь с результатами.
+        """
+        return {"name": self.name, "tool": self.tool, "files": len(self.file_paths),
+                "processed": self.processed, "unchanged": self.unchanged,
+                "outputs": self.outputs, "removed": self.removed,
+                "ok": len(self.errors) + len(self.exist_files) < 1, "errors": self.errors,
+                "exist_files": self.exist_files, "seconds": self.seconds}
+
+
+def parse_job(item: object, number: int, base_path: str, profile: str) -> Job:
+    """
+    Проверка и создание задания из записи файла заданий.
+    :param item: Запись из файла заданий.
+    :param number: Номер задания, начиная с 1.
+    :param base_path: Директория, относительно которой задаются пути задания.
+    :param profile: Профиль сохранения для заданий, в которых он не указан.
+    :return: Задание.
+    """
+    if not isinstance(item, dict):
+        raise ValueError(t("main.job_invalid") % (number, "{...}"))
+    unknown_keys = set(item).difference(JOB_KEYS)
+    if len(unknown_keys) > 0:
+        raise ValueError(t("main.job_invalid") % (number, ", ".join(sorted(unknown_keys))))
+    tool = item.get("tool")
+    if tool not in TOOLS:
+        raise ValueError(t("main.job_invalid") % (number, "tool"))
+    input_paths = item.get("paths")
+    if isinstance(input_paths, str):
+        input_paths = [input_paths]
+    if not isinstance(input_paths, list) or not all(isinstance(path, str) for path in
+                                                     input_paths):
+        raise ValueError(t("main.job_invalid") % (number, "paths"))
+    profile = item.get("profile", profile)
+    if profile not in ENCODE_PROFILES:
+        raise ValueError(t("main.job_invalid") % (number, "profile"))
+    reduce = item.get("reduce", False)
+    if not isinstance(reduce, bool) or (reduce and tool not in (TOOL_CONVERT, TOOL_PIPELINE)):
+        raise ValueError(t("main.job_invalid") % (number, "reduce"))
+    operations = item.get("ops")
+    if (tool == TOOL_PIPELINE) != (operations is not None) or (operations is not None and (
+            not isinstance(operations, list) or len(operations) < 1 or not all(
+            operation in OPERATIONS for operation in operations))):
+        raise ValueError(t("main.job_invalid") % (number, "ops"))
+    strip_height = item.get("strip_height")
+    if strip_height is not None and (isinstance(strip_height, bool) or not isinstance(
+            strip_height, int) or strip_height < 1 or tool not in (TOOL_MIRROR_CONCAT,
+                                                                   TOOL_SPLIT_EYES)):
+        raise ValueError(t("main.job_invalid") % (number, "strip_height"))
+    return Job(str(item.get("name", number)), tool, [os.path.join(base_path, path) for path in
+                                                    input_paths], profile, reduce, operations,
+               strip_height)
+
+
+def load_jobs(job_file_path: str, profile: str = ENCODE_PROFILE_MAX) -> list[Job]:
+    """
+    Чтение файла заданий. Файл с расширением .toml читается как TOML (задания в таблицах
+    [[jobs]]), остальные - как JSON (список заданий или объект с ключом "jobs").
+    :param job_file_path: Путь к файлу заданий.
+    :param profile: Профиль сохранения для заданий, в которых он не указан.
+    :return: Список заданий.
+    """
+    with open(job_file_path, "rb") as f:
+        if os.path.splitext(job_file_path)[1].lower() == ".toml":
+            data = tomllib.load(f)
+        else:
+            data = json.load(f)
+    items = data.get("jobs") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValueError(t("main.job_file_invalid") % job_file_path)
+    base_path = os.path.dirname(os.path.abspath(job_file_path))
+    return [parse_job(item, number, base_path, profile) for number, item in enumerate(items, 1)]
+
+
+def is_overlapping(first_paths: list[str], second_paths: list[str]) -> bool:
+    """
+    Проверка того, могут ли два задания обрабатывать одни и те же файлы: совпадают ли их пути или
+    лежит ли путь одного задания внутри директории другого.
+    :param first_paths: Пути первого задания.
+    :param second_paths: Пути второго задания.
+    :return: Есть ли общие файлы.
+    """
+    for first_key in map(get_key, first_paths):
+        for second_key in map(get_key, second_paths):
+            if first_key == second_key or second_key.startswith(first_key + os.sep) or \
+                    first_key.startswith(second_key + os.sep):
+                return True
+    return False
+
+
+def get_waves(jobs: list[Job]) -> list[list[Job]]:
+    """
+    Разбиение заданий на последовательные волны так, чтобы задания одной волны не обрабатывали
+    общие файлы, а задание с общими файлами выполнялось после всех предыдущих заданий с ними.
+    :param jobs: Задания в порядке из файла заданий.
+    :return: Волны заданий.
+    """
+    waves = []
+    job_waves = []  # Номер волны каждого уже распределённого задания.
+    for job in jobs:
+        wave = max((job_wave + 1 for previous, job_wave in zip(jobs, job_waves) if
+                    is_overlapping(previous.input_paths, job.input_paths)), default=0)
+        if wave >= len(waves):
+            waves.append([])
+        waves[wave].append(job)
+        job_waves.append(wave)
+    return waves
+
+
+def interleave_tasks(jobs: list[Job], funcs: dict[Job, Callable[[str], object]]) -> \
+        Iterator[tuple[str, Callable[[str], object]]]:
+    """
+    Чередование файлов заданий: по одному файлу из каждого незавершённого задания по очереди.
+    :param jobs: Задания.
+    :param funcs: Функции обработки файлов для каждого задания.
+    :return: Итератор пар из пути к файлу и функции, вызываемой для него.
+    """
+    iterators = [(iter(job.file_paths), funcs[job]) for job in jobs]
+    while len(iterators) > 0:
+        active = []
+        for file_iterator, func in iterators:
+            file_path = next(file_iterator, None)
+            if file_path is not None:
+                active.append((file_iterator, func))
+                yield file_path, func
+        iterators = active
+
+
+def execute_jobs(  # pylint: disable=too-many-arguments, too-many-positional-arguments
+        jobs: list[Job], backend: str = BACKEND_THREAD, jobs_count: int | None = None,
+        memory_limit: int | None = None, report: RunReport | None = None,
+        prefetch_limit: int | None = None) -> list[dict]:
+    """
+    Выполнение заданий в одном пуле, создаваемом один раз. Файлы заданий одной волны чередуются,
+    а сконвертированные файлы удаляются сразу после завершения своего задания.
+    :param jobs: Задания.
+    :param backend: Тип пула: потоки или процессы.
+    :param jobs_count: Количество параллельных задач или None для значения по умолчанию.
+    :param memory_limit: Ограничение объёма пикселей выполняющихся задач в байтах или None.
+    :param report: Отчёт о времени этапов обработки или None, если замер не ведётся.
+    :param prefetch_limit: Ограничение объёма файлов, прочитанных заранее, в байтах или None, если
+        файлы читаются и записываются в самих задачах.
+    :return: Результаты заданий в порядке из файла заданий.
+    """
+    index = DirectoryIndex()
+    with logging_redirect_tqdm():
+        pbar = tqdm(total=0, desc=t("main.files"))
+        with create_executor(backend, jobs_count, prefetch_limit) as executor:
+            for wave in get_waves(jobs):
+                execute_wave(executor, wave, backend, jobs_count, memory_limit, report, index,
+                             pbar)
+        pbar.set_postfix_str("")
+        pbar.close()
+    logging.info(t("main.index_statistics"), index.hits, index.listdirs, index.stats)
+    results = [job.to_dict() for job in jobs]
+    if report is not None:
+        report.add_section("jobs", {"jobs": results})
+        report.add_section("index", index.to_dict())
+    return results
+
+
+def execute_wave(  # pylint: disable=too-many-arguments, too-many-positional-arguments
+        executor: Executor | StagedExecutor, wave: list[Job], backend: str, jobs_count: int | None,
+        memory_limit: int | None, report: RunReport | None, index: DirectoryIndex, pbar: tqdm):
+    """
+    Выполнение заданий без общих файлов с чередованием их файлов в общем пуле. Файлы заданий
+    ищутся в начале волны, поэтому задания видят результаты предыдущих волн.
+    :param executor: Пул потоков или процессов или пул с упреждающим чтением и отложенной записью.
+    :param wave: Задания.
+    :param backend: Тип пула: потоки или процессы.
+    :param jobs_count: Количество параллельных задач или None для значения по умолчанию.
+    :param memory_limit: Ограничение объёма пикселей выполняющихся задач в байтах или None.
+    :param report: Отчёт о времени этапов обработки или None, если замер не ведётся.
+    :param index: Индекс директорий.
+    :param pbar: Индикатор прогресса.
+    """
+    funcs = {}
+    func_jobs = {}
+    for job in wave:
+        job.start = time.perf_counter()
+        job.file_paths = list(get_input_files(job.input_paths, index))
+        job.remaining = len(job.file_paths)
+        funcs[job] = job.get_func(index if backend == BACKEND_THREAD else None)
+        func_jobs[id(funcs[job])] = job
+    pbar.total += sum(job.remaining for job in wave)
+    pbar.refresh()
+    for job in wave:
+        if job.remaining < 1:
+            job.finish(index)
+    for file_path, func, future in iterate_tasks(executor, interleave_tasks(wave, funcs),
+                                                 jobs_count, memory_limit, report):
+        pbar.set_postfix_str(file_path)
+        job = func_jobs[id(func)]
+        job.add_result(file_path, future, index)
+        pbar.update(1)
+        if job.remaining < 1:
+            job.finish(index)
+
+
+def main() -> int | str:
+    """
+    Запуск скрипта.
+    :return: Код ошибки или строка об ошибке.
+    """
+    init_app(os.path.join("images", "Pillows_Hat_Icon.tga"))
+    parser = argparse.ArgumentParser(prog=t("main.batch_jobs_name"),
+                                     description=t("main.batch_jobs_desc"))
+    parser.add_argument("job_file", type=str, help=t("main.job_file_arg"))
+    parser.add_argument("--results", type=str, default="", help=t("main.results_arg"))
+    parser.add_argument("--profile", choices=ENCODE_PROFILES, default=ENCODE_PROFILE_MAX,
+                        help=t("main.profile_arg"))
+    add_executor_arguments(parser)
+    add_report_arguments(parser)
+    args = parser.parse_args()
+    try:
+        jobs = load_jobs(args.job_file, args.profile)
+    except (OSError, ValueError, tomllib.TOMLDecodeError) as e:
+        parser.error(str(e))
+    report = create_report(args)
+    results = execute_jobs(jobs, args.backend, args.jobs, args.memory_limit, report,
+                           args.prefetch)
+    if args.results != "":
+        with open(args.results, "w", encoding="utf-8") as f:
+            json.dump({"jobs": results}, f, indent=2, ensure_ascii=False)
+    if report is not None:
+        report.save()
+    return os.EX_OK
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Пул процессов в собранном исполняемом файле.
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""
+    Поиск одинаковых изображений по хэшу содержимого, чтобы конвертировать только одно изображение
+    из группы, а результаты для остальных получать копированием или ссылками.
+"""
+# pylint: disable=import-error, wrong-import-position
+import os
+import sys
+import errno
+import shutil
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from i18n import t
+import PIL.Image
+
+try:
+    import fcntl
+except ImportError:  # Windows.
+    fcntl = None
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+
+from helper_funcs import get_header_transparency, has_transparency, claim_target, \
+    TARGET_OPAQUE_EXTENSION, TARGET_TRANSPARENT_EXTENSION
+from directory_index import DirectoryIndex
+from conversion_cache import get_file_hash
+
+LINK_COPY = "copy"  # Копирование файла.
+LINK_REFLINK = "reflink"  # Копия, разделяющая блоки с исходным файлом (copy-on-write).
+LINK_HARDLINK = "hardlink"  # Жёсткая ссылка на исходный файл.
+LINK_MODES = (LINK_COPY, LINK_REFLINK, LINK_HARDLINK)
+FICLONE = 0x40049409  # Код ioctl для reflink в Linux (Btrfs, XFS).
+TARGET_EXTENSIONS = {TARGET_OPAQUE_EXTENSION.lower(), TARGET_TRANSPARENT_EXTENSION.lower()}
+ENCODER_INFO_KEYS = {  # Метаданные, которые берутся из info при сохранении в целевом режиме.
+    "RGB": ("icc_profile", "transparency"),  # PNG.
+    "RGBA": ("compression", "id_section", "orientation")  # TGA.
+}
+
+
+def get_pixel_hash(file_path: str) -> str:
+    """
+    Вычисление хэша пикселей изображения в том режиме, в котором оно будет сохранено при
+    конвертации, вместе с метаданными, влияющими на сохранение.
+    :param file_path: Путь к файлу.
+    :return: Хэш пикселей в шестнадцатеричном виде.
+    """
+    img_object = PIL.Image.open(file_path)
+    try:
+        transparent = get_header_transparency(img_object)
+        if transparent is None:
+            img_object.load()
+            transparent = has_transparency(img_object)
+        mode = "RGBA" if transparent else "RGB"
+        converted = img_object if img_object.mode == mode else img_object.convert(mode)
+        import hashlib  # pylint: disable=import-outside-toplevel  # Только при --dedup.
+        pixel_hash = hashlib.blake2b(digest_size=16)
+        pixel_hash.update(repr((mode, converted.size, [converted.info.get(key) for key in
+                                                       ENCODER_INFO_KEYS[mode]])).encode())
+        pixel_hash.update(converted.tobytes())
+        converted.close()
+    finally:
+        img_object.close()
+    return pixel_hash.hexdigest()
+
+
+def get_header_size(file_path: str) -> tuple[int, int] | None:
+    """
+    Получение размеров изображения по заголовку без чтения пикселей.
+    :param file_path: Путь к файлу.
+    :return: Ширина и высота или None, если файл не удалось открыть.
+    """
+    try:
+        with PIL.Image.open(file_path) as img_object:
+            return img_object.size
+    except (OSError, PIL.Image.DecompressionBombError):
+        return None
+
+
+def reflink_file(src_path: str, dst_path: str):
+    """
+    Создание копии файла, разделяющей с ним блоки на диске.
+    :param src_path: Путь к исходному файлу.
+    :param dst_path: Путь к новому файлу.
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+class ContentDedup:  # pylint: disable=too-many-instance-attributes
+    """
+    Группы файлов с одинаковым содержимым. Файлы с одинаковым расширением объединяются по хэшу
+    байтов, а файлы в форматах, которые всегда конвертируются, - ещё и по хэшу пикселей.
+    """
+
+    def __init__(self, link_mode: str = LINK_COPY, jobs: int | None = None):
+        """
+        :param link_mode: Способ получения результата для повторяющихся файлов.
+        :param jobs: Количество потоков для вычисления хэшей или None для значения по умолчанию.
+        """
+        self.link_mode = link_mode
+        self.jobs = jobs
+        self.followers: dict[str, list[str]] = {}  # Повторяющиеся файлы по основному файлу группы.
+        self.groups = 0
+        self.files = 0
+        self.bytes_saved = 0  # Объём повторяющихся файлов, которые не были прочитаны.
+        self.bytes_linked = 0  # Объём результатов, полученных ссылкой вместо записи.
+        self.fallbacks = 0  # Количество ссылок, заменённых копированием.
+
+    def group_by(self, file_paths: list[str], get_key: Callable[[str], object]) -> list[str]:
+        """
+        Объединение файлов с одинаковым ключом, вычисляемым в пуле потоков. Первый файл группы
+        становится основным, остальные добавляются к его повторяющимся файлам.
+        :param file_paths: Пути к файлам.
+        :param get_key: Функция вычисления ключа. Исключение OSError означает, что файл ни с чем
+            не объединяется.
+        :return: Пути к основным файлам и файлам без пары в исходном порядке.
+        """
+
+        def safe_key(file_path: str) -> object:
+            try:
+                return get_key(file_path)
+            except (OSError, PIL.Image.DecompressionBombError):
+                return None
+
+        leaders = {}
+        result = []
+        for file_path, key in zip(file_paths, self.map_keys(safe_key, file_paths)):
+            leader = None if key is None else leaders.setdefault(key, file_path)
+            if leader is None or leader == file_path:
+                result.append(file_path)
+                continue
+            followers = self.followers.setdefault(leader, [])
+            followers.append(file_path)
+            followers.extend(self.followers.pop(file_path, []))
+        return result
+
+    def group(self, file_paths: list[str]) -> list[str]:
+        """
+        Поиск повторяющихся файлов. Хэши байтов считаются только для файлов с совпадающими
+        расширением и размером, а хэши пикселей - только для файлов с совпадающими размерами
+        изображения в форматах, отличных от целевых.
+        :param file_paths: Пути к файлам.
+        :return: Пути к файлам, которые нужно конвертировать.
+        """
+        sizes = {}
+        for file_path in file_paths:
+            try:
+                key = (os.path.splitext(file_path)[1].lower(), os.path.getsize(file_path))
+            except OSError:
+                continue
+            sizes[key] = sizes.get(key, 0) + 1
+
+        def get_byte_key(file_path: str) -> object:
+            key = (os.path.splitext(file_path)[1].lower(), os.path.getsize(file_path))
+            return None if sizes.get(key, 0) < 2 else (key, get_file_hash(file_path))
+
+        file_paths = self.group_by(file_paths, get_byte_key)
+        candidates = [file_path for file_path in file_paths if os.path.splitext(file_path)[
+            1].lower() not in TARGET_EXTENSIONS]  # Такие файлы всегда сохраняются в новый файл.
+        headers = dict(zip(candidates, self.map_keys(get_header_size, candidates)))
+        header_counts = {}
+        for header in headers.values():
+            header_counts[header] = header_counts.get(header, 0) + 1
+        candidates = [file_path for file_path in candidates if headers[file_path] is not None and
+                      header_counts[headers[file_path]] > 1]
+        if len(candidates) > 1:
+            leaders = self.group_by(candidates, get_pixel_hash)
+            skipped = set(candidates).difference(leaders)
+            file_paths = [file_path for file_path in file_paths if file_path not in skipped]
+        self.groups = len(self.followers)
+        return file_paths
+
+    def map_keys(self, func: Callable[[str], object], file_paths: list[str]) -> list[object]:
+        """
+        Вычисление значений функции для файлов в пуле потоков.
+        :param func: Функция, вызываемая для каждого файла.
+        :param file_paths: Пути к файлам.
+        :return: Значения функции в порядке файлов.
+        """
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(func, file_paths))
+
+    def pop_followers(self, file_path: str) -> list[str]:
+        """
+        Получение повторяющихся файлов основного файла группы.
+        :param file_path: Путь к основному файлу.
+        :return: Пути к повторяющимся файлам.
+        """
+        return self.followers.pop(file_path, [])
+
+    def materialize(self, new_file_path: str, follower_path: str,
+                    index: DirectoryIndex | None = None) -> str:
+        """
+        Получение результата конвертации повторяющегося файла из результата основного файла.
+        :param new_file_path: Путь к результату основного файла или пустая строка, если он уже был
+            в нужном формате.
+        :param follower_path: Путь к повторяющемуся файлу.
+        :param index: Индекс директорий для проверки нового пути или None, чтобы проверять на диске.
+        :return: Путь к результату повторяющегося файла или пустая строка.
+        """
+        self.files += 1
+        self.bytes_saved += os.path.getsize(follower_path)
+        if new_file_path == "":
+            return ""
+        fpe, ext = os.path.splitext(follower_path)
+        new_ext = os.path.splitext(new_file_path)[1]
+        target_path = fpe + new_ext
+        if ext.lower() != new_ext.lower() and claim_target(target_path, index):
+            raise FileExistsError(errno.EEXIST, t("main.file_already_exists") % target_path)
+        try:
+            self.link(new_file_path, target_path)
+        except OSError:
+            if index is not None and ext.lower() != new_ext.lower():
+                index.discard(target_path)  # Путь был отмечен занятым при проверке.
+            raise
+        return target_path
+
+    def link(self, src_path: str, dst_path: str):
+        """
+        Создание файла с содержимым другого файла выбранным способом через временный файл. Если
+        ссылку создать нельзя (другой диск, неподдерживаемая файловая система), файл копируется.
+        :param src_path: Путь к исходному файлу.
+        :param dst_path: Путь к новому файлу.
+        """
+        tmp_path = dst_path + ".dedup.tmp"
+        try:
+            linked = self.link_mode != LINK_COPY
+            if linked:
+                try:
+                    if self.link_mode == LINK_HARDLINK:
+                        os.link(src_path, tmp_path)
+                    else:
+                        reflink_file(src_path, tmp_path)
+                except OSError:
+                    self.fallbacks += 1
+                    linked = False
+            if not linked:
+                shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, dst_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if linked:
+            self.bytes_linked += os.path.getsize(dst_path)
+
+    def to_dict(self) -> dict:
+        """
+        Получение сводки по повторяющимся файлам для отчёта.
+        :return: Словарь со сводкой.
+        """
+        return {"link_mode": self.link_mode, "groups": self.groups, "files": self.files,
+                "bytes_saved": self.bytes_saved, "bytes_linked": self.bytes_linked,
+                "fallbacks": self.fallbacks}
@@ -0,0 +1,167 @@
+"""
+    Постоянный кэш результатов конвертации, позволяющий пропускать неизменённые файлы при
+    повторных запусках.
+"""
+import os
+import json
+import logging
+from collections.abc import Callable
+
+from i18n import t
+
+CACHE_VERSION = 1  # Версия формата файла кэша.
+STATUS_UNCHANGED = "unchanged"  # Файл уже был в нужном формате.
+STATUS_CONVERTED = "converted"  # Файл был конвертирован в другой файл.
+STATUS_FAILED = "failed"  # Файл не удалось открыть как изображение.
+
+
+def get_file_hash(file_path: str, data: bytes | None = None) -> str:
+    """
+    Вычисление хэша содержимого файла.
+    :param file_path: Путь к файлу.
+    :param data: Уже прочитанное содержимое файла или None, чтобы прочитать файл.
+    :return: Хэш содержимого файла в шестнадцатеричном виде.
+    """
+    import hashlib  # pylint: disable=import-outside-toplevel
+    # hashlib загружается только при хэшировании, чтобы не замедлять запуск инструментов.
+    file_hash = hashlib.blake2b(digest_size=16)
+    if data is not None:
+        file_hash.update(data)
+        return file_hash.hexdigest()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+class ConversionCache:
+    """
+    Манифест результатов конвертации, ключом которого являются путь, размер, время изменения и
+    (опционально) хэш содержимого файла.
+    """
+
+    def __init__(self, cache_path: str, use_hash: bool = False, rebuild: bool = False,
+                 profile: str = ""):
+        """
+        :param cache_path: Путь к файлу кэша.
+        :param use_hash: Сравнивать ли хэш содержимого, если время изменения файла отличается.
+        :param rebuild: Игнорировать ли существующие записи кэша.
+        :param profile: Название профиля сохранения. Записи, сделанные с другим профилем,
+            игнорируются.
+        """
+        self.cache_path = cache_path
+        self.use_hash = use_hash
+        self.profile = profile
+        self.entries: dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+        if not rebuild:
+            self.load()
+
+    def load(self):
+        """
+        Загрузка записей кэша из файла. Повреждённый или устаревший кэш игнорируется.
+        """
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.info(t("main.cache_load_failed"), self.cache_path)
+            logging.info(e)
+            return
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION or data.get(
+                "profile", "") != self.profile:
+            return
+        entries = data.get("entries", {})
+        if isinstance(entries, dict):
+            self.entries = entries
+
+    def save(self):
+        """
+        Атомарная запись кэша в файл.
+        """
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, "profile": self.profile,
+                           "entries": self.entries}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logging.info(t("main.cache_save_failed"), self.cache_path)
+            logging.info(e)
+
+    def invalidate(self, root_paths: list[str]):
+        """
+        Удаление записей кэша для файлов и директорий.
+        :param root_paths: Пути к файлам или директориям.
+        """
+        roots = [os.path.abspath(root_path) for root_path in root_paths if root_path != ""]
+        for file_path in list(self.entries):
+            for root in roots:
+                if file_path == root or file_path.startswith(os.path.join(root, "")):
+                    del self.entries[file_path]
+                    break
+
+    def lookup(self, file_path: str,
+               target_exists: Callable[[str], bool] = os.path.isfile) -> dict | None:
+        """
+        Поиск записи о файле, ключ которого не изменился с прошлого запуска. Файл не открывается,
+        если не требуется сравнение хэша.
+        :param file_path: Путь к файлу.
+        :param target_exists: Функция проверки существования сконвертированного файла. Запись о
+            конвертации, результат которой удалён, не используется.
+        :return: Запись кэша или None, если файл необходимо обработать заново.
+        """
+        key = os.path.abspath(file_path)
+        entry = self.entries.get(key)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            entry = None
+        if entry is not None and entry.get("status") == STATUS_CONVERTED and not target_exists(
+                entry.get("target", "")):
+            entry = None
+        if entry is not None and entry.get("size") == stat.st_size:
+            if entry.get("mtime") == stat.st_mtime_ns:
+                self.hits += 1
+                return entry
+            if self.use_hash and entry.get("hash") is not None:
+                try:
+                    file_hash = get_file_hash(file_path)
+                except OSError:
+                    file_hash = None
+                if file_hash == entry["hash"]:
+                    entry["mtime"] = stat.st_mtime_ns
+                    self.hits += 1
+                    return entry
+        self.misses += 1
+        return None
+
+    def record(self, file_path: str, status: str, target: str = "",
+               file_hash: str | None = None):
+        """
+        Запись результата обработки файла в кэш. Хэш не вычисляется здесь, чтобы не читать файлы в
+        основном потоке: его вычисляет задача конвертации.
+        :param file_path: Путь к файлу.
+        :param status: Результат обработки файла.
+        :param target: Путь к сконвертированному файлу, если он есть.
+        :param file_hash: Хэш содержимого файла или None, если он не вычислялся.
+        """
+        key = os.path.abspath(file_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            self.entries.pop(key, None)
+            return
+        self.entries[key] = {"size": stat.st_size, "mtime": stat.st_mtime_ns,
+                             "hash": file_hash if self.use_hash else None,
+                             "status": status, "target": target}
+
+    def forget(self, file_path: str):
+        """
+        Удаление записи о файле из кэша.
+        :param file_path: Путь к файлу.
+        """
+        self.entries.pop(os.path.abspath(file_path), None)
@@ -0,0 +1,162 @@
+"""
+    Содержимое директорий в памяти для проверки существования файлов без обращения к диску.
+"""
+import os
+import threading
+from collections.abc import Iterable
+
+
+def get_key(path: str) -> str:
+    """
+    Получение ключа пути, одинакового для разных написаний одного пути.
+    :param path: Путь.
+    :return: Нормализованный абсолютный путь.
+    """
+    return os.path.normcase(os.path.abspath(path))
+
+
+def is_case_insensitive(dir_path: str, names: Iterable[str]) -> bool:
+    """
+    Проверка того, что имена в директории не различаются регистром букв (например, APFS и HFS+ в
+    macOS по умолчанию), хотя os.path.normcase их не меняет. Проверяется, что имя файла из
+    директории или, если подходящего нет, имя самой директории с другим регистром букв указывает на
+    тот же файл.
+    :param dir_path: Путь к директории.
+    :param names: Имена в директории.
+    :return: Не различаются ли имена регистром.
+    """
+    if os.path.normcase("A") == "a":
+        return True
+    name = next((name for name in names if name.swapcase() != name), None)
+    if name is not None:
+        path = os.path.join(dir_path, name)
+    else:
+        path = os.path.abspath(dir_path)
+        name = os.path.basename(path)
+    try:
+        return os.path.samefile(path, os.path.join(os.path.dirname(path), name.swapcase()))
+    except (OSError, ValueError):
+        return False
+
+
+class DirectoryIndex:
+    """
+    Имена файлов и поддиректорий в директориях. Содержимое директорий берётся из обхода при
+    индексировании, а директории, не попавшие в обход, читаются один раз при первой проверке.
+    Индекс обновляется при записи и удалении файлов, поэтому проверки не обращаются к диску. В
+    директориях, имена в которых не различаются регистром, имена хранятся в casefold.
+    """
+
+    def __init__(self):
+        self.listings: dict[str, set[str]] = {}  # Имена в директории по пути к ней.
+        self.folded: set[str] = set()  # Директории, имена в которых не различаются регистром.
+        self.lock = threading.Lock()
+        self.hits = 0  # Проверки, на которые ответил индекс.
+        self.listdirs = 0  # Директории, прочитанные при проверках.
+        self.stats = 0  # Проверки через os.path.exists, если директорию не удалось прочитать.
+
+    def add_listing(self, dir_path: str, names: list[str]):
+        """
+        Добавление содержимого директории, прочитанного при индексировании.
+        :param dir_path: Путь к директории.
+        :param names: Имена файлов и поддиректорий.
+        """
+        dir_key = get_key(dir_path)
+        names = [os.path.normcase(name) for name in names]
+        with self.lock:
+            if dir_key not in self.listings and is_case_insensitive(dir_key, names):
+                self.folded.add(dir_key)
+            self.listings.setdefault(dir_key, set()).update(
+                self.get_name(dir_key, name) for name in names)
+
+    def get_name(self, dir_key: str, name: str) -> str:
+        """
+        Получение имени в том виде, в котором оно хранится в содержимом директории.
+        :param dir_key: Ключ пути к директории.
+        :param name: Имя файла или поддиректории после os.path.normcase.
+        :return: Имя в casefold, если имена в директории не различаются регистром, иначе само имя.
+        """
+        return name.casefold() if dir_key in self.folded else name
+
+    def get_listing(self, dir_key: str) -> set[str] | None:
+        """
+        Получение содержимого директории с чтением при первом обращении. Вызывается под lock.
+        :param dir_key: Ключ пути к директории.
+        :return: Имена в директории или None, если директорию не удалось прочитать.
+        """
+        listing = self.listings.get(dir_key)
+        if listing is None:
+            try:
+                names = [os.path.normcase(name) for name in os.listdir(dir_key)]
+            except OSError:
+                return None
+            self.listdirs += 1
+            if is_case_insensitive(dir_key, names):
+                self.folded.add(dir_key)
+            listing = {self.get_name(dir_key, name) for name in names}
+            self.listings[dir_key] = listing
+        return listing
+
+    def exists(self, file_path: str) -> bool:
+        """
+        Проверка существования файла или директории.
+        :param file_path: Путь к файлу.
+        :return: Существует ли путь.
+        """
+        dir_key, name = os.path.split(get_key(file_path))
+        with self.lock:
+            listing = self.get_listing(dir_key)
+            if listing is not None:
+                self.hits += 1
+                return self.get_name(dir_key, name) in listing
+            self.stats += 1
+        return os.path.exists(file_path)
+
+    def claim(self, file_path: str) -> bool:
+        """
+        Проверка существования файла и, если его нет, отметка пути занятым для записи нового
+        файла. Проверка и отметка выполняются атомарно, поэтому путь может занять только один поток.
+        :param file_path: Путь к файлу.
+        :return: Существовал ли путь до вызова.
+        """
+        dir_key, name = os.path.split(get_key(file_path))
+        with self.lock:
+            listing = self.get_listing(dir_key)
+            if listing is not None:
+                self.hits += 1
+                name = self.get_name(dir_key, name)
+                exists = name in listing
+                listing.add(name)
+                return exists
+            self.stats += 1
+        return os.path.exists(file_path)
+
+    def add(self, file_path: str):
+        """
+        Добавление записанного файла.
+        :param file_path: Путь к файлу.
+        """
+        dir_key, name = os.path.split(get_key(file_path))
+        with self.lock:
+            listing = self.listings.get(dir_key)
+            if listing is not None:
+                listing.add(self.get_name(dir_key, name))
+
+    def discard(self, file_path: str):
+        """
+        Удаление файла, которого больше нет на диске.
+        :param file_path: Путь к файлу.
+        """
+        dir_key, name = os.path.split(get_key(file_path))
+        with self.lock:
+            listing = self.listings.get(dir_key)
+            if listing is not None:
+                listing.discard(self.get_name(dir_key, name))
+
+    def to_dict(self) -> dict:
+        """
+        Получение сводки по проверкам для отчёта.
+        :return: Словарь со сводкой.
+        """
+        return {"directories": len(self.listings), "hits": self.hits, "listdirs": self.listdirs,
+                "stats": self.stats}
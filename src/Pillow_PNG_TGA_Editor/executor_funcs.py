@@ -0,0 +1,249 @@
+"""
+    Общий код для параллельной обработки файлов в пуле потоков или процессов.
+"""
+# pylint: disable=import-error, wrong-import-position
+import os
+import sys
+import math
+import argparse
+import queue
+import logging
+import warnings
+from collections.abc import Callable, Iterable, Iterator
+from functools import partial
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+from i18n import t
+import PIL.Image
+from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+
+from general_funcs import init_i18n
+from helper_funcs import get_image_memory_size
+from stage_timing import RunReport, run_timed
+from staged_io import StagedExecutor
+
+BACKEND_THREAD = "thread"  # Выполнение в пуле потоков.
+BACKEND_PROCESS = "process"  # Выполнение в пуле процессов.
+EXECUTOR_BACKENDS = (BACKEND_THREAD, BACKEND_PROCESS)
+PENDING_PER_JOB = 2  # Количество одновременно отправленных в пул задач на одну параллельную задачу.
+
+
+def init_worker():
+    """
+    Подготовка дочернего процесса к выполнению задач. Журнал настраивается так же, как в init_app,
+    потому что при запуске процессов через spawn настройки родителя не наследуются.
+    """
+    logging.basicConfig(stream=sys.stdout, format="%(message)s", level=logging.INFO)
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    init_i18n()
+
+
+def create_executor(backend: str = BACKEND_THREAD, jobs: int | None = None,
+                    prefetch_limit: int | None = None,
+                    get_removals: Callable[[str, object], list[str]] | None = None) -> \
+        Executor | StagedExecutor:
+    """
+    Создание пула для выполнения задач.
+    :param backend: Тип пула: потоки или процессы.
+    :param jobs: Количество параллельных задач или None для значения по умолчанию.
+    :param prefetch_limit: Ограничение объёма файлов, прочитанных заранее, в байтах или None, если
+        файлы читаются и записываются в самих задачах.
+    :param get_removals: Функция, получающая по пути к файлу и результату обработки пути к
+        устаревшим файлам, которые удаляются сразу после записи результатов, или None. Используется
+        только вместе с prefetch_limit.
+    :return: Пул потоков или процессов или пул с упреждающим чтением и отложенной записью.
+    """
+    if backend == BACKEND_PROCESS:
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=init_worker)
+    else:
+        executor = ThreadPoolExecutor(max_workers=jobs)
+    if prefetch_limit is None:
+        return executor
+    return StagedExecutor(executor, prefetch_limit, get_removals=get_removals)
+
+
+def get_pending_limit(jobs: int | None = None) -> int:
+    """
+    Получение максимального количества задач, одновременно находящихся в пуле.
+    :param jobs: Количество параллельных задач или None для значения по умолчанию.
+    :return: Максимальное количество задач.
+    """
+    if jobs is None or jobs < 1:
+        jobs = min(32, (os.cpu_count() or 1) + 4)  # Как в ThreadPoolExecutor.
+    return jobs * PENDING_PER_JOB
+
+
+def iterate_completed(  # pylint: disable=too-many-arguments, too-many-positional-arguments
+        executor: Executor | StagedExecutor, func: Callable[[str], object],
+        file_paths: Iterable[str], jobs: int | None = None, memory_limit: int | None = None,
+        report: RunReport | None = None) -> Iterator[tuple[str, Future]]:
+    """
+    Отправка задач в пул ограниченными порциями и перебор их по мере завершения. Задача
+    отправляется, только если суммарный объём пикселей выполняющихся задач не превысит ограничение
+    памяти. Изображение, не помещающееся в ограничение, обрабатывается в одиночку.
+    :param executor: Пул потоков или процессов или пул с упреждающим чтением и отложенной записью.
+    :param func: Функция, вызываемая для каждого файла. Должна возвращать только небольшие
+        результаты (пути к файлам), так как в случае пула процессов результат передаётся обратно.
+    :param file_paths: Пути к файлам.
+    :param jobs: Количество параллельных задач или None для значения по умолчанию.
+    :param memory_limit: Ограничение объёма пикселей выполняющихся задач в байтах или None.
+    :param report: Отчёт о времени этапов обработки или None, если замер не ведётся.
+    :return: Итератор пар из пути к файлу и завершённой задачи.
+    """
+    for file_path, _, future in iterate_tasks(executor, ((file_path, func) for file_path in
+                                                         file_paths), jobs, memory_limit, report):
+        yield file_path, future
+
+
+def iterate_tasks(executor: Executor | StagedExecutor,  # pylint: disable=too-many-locals
+                  tasks: Iterable[tuple[str, Callable[[str], object]]], jobs: int | None = None,
+                  memory_limit: int | None = None, report: RunReport | None = None) -> \
+        Iterator[tuple[str, Callable[[str], object], Future]]:
+    """
+    То же, что iterate_completed, но для каждого файла задаётся своя функция, поэтому в одном пуле
+    могут выполняться файлы разных заданий.
+    :param executor: Пул потоков или процессов или пул с упреждающим чтением и отложенной записью.
+    :param tasks: Пары из пути к файлу и функции, вызываемой для него.
+    :param jobs: Количество параллельных задач или None для значения по умолчанию.
+    :param memory_limit: Ограничение объёма пикселей выполняющихся задач в байтах или None.
+    :param report: Отчёт о времени этапов обработки или None, если замер не ведётся.
+    :return: Итератор из пути к файлу, функции и завершённой задачи.
+    """
+    pending_limit = get_pending_limit(jobs)
+    task_iterator = iter(tasks)  # Пути могут поступать во время индексирования.
+    waiting_tasks = []  # Путь к файлу, функция и оценка занимаемой памяти для задач, ожидающих
+    # отправки.
+    future_tasks = {}
+    memory_used = 0
+    done_futures = queue.SimpleQueue()  # Задачи попадают в очередь по мере завершения.
+    exhausted = False
+
+    def fits(cost: int) -> bool:
+        return len(future_tasks) < 1 or memory_limit is None or memory_used + cost <= memory_limit
+
+    while True:
+        while not exhausted and len(waiting_tasks) < pending_limit and (
+                len(waiting_tasks) < 1 or fits(waiting_tasks[0][2])):  # Пока первый файл ждёт
+            # освобождения памяти, новые файлы не берутся, чтобы он не ждал бесконечно.
+            task = next(task_iterator, None)
+            if task is None:
+                exhausted = True
+            else:
+                waiting_tasks.append((*task, 0 if memory_limit is None else
+                                      get_image_memory_size(task[0])))
+        submitted = False
+        for task in list(waiting_tasks):
+            file_path, func, cost = task
+            if len(future_tasks) >= pending_limit:
+                break
+            if fits(cost):
+                future = executor.submit(func if report is None else partial(run_timed, func),
+                                         file_path)
+                future_tasks[future] = task
+                memory_used += cost
+                waiting_tasks.remove(task)
+                future.add_done_callback(done_futures.put)
+                submitted = True
+        if len(future_tasks) < 1:
+            return
+        if submitted and done_futures.empty():  # Можно взять следующие файлы, не дожидаясь задач.
+            continue
+        future = done_futures.get()
+        while True:
+            file_path, func, cost = future_tasks.pop(future)
+            memory_used -= cost
+            yield file_path, func, future if report is None else report.unwrap(file_path, future)
+            if done_futures.empty():
+                break
+            future = done_futures.get()
+
+
+def batch_process_files(  # pylint: disable=too-many-arguments, too-many-positional-arguments
+        func: Callable[[str], object], file_paths: list[str], backend: str = BACKEND_THREAD,
+        jobs: int | None = None, memory_limit: int | None = None, report: RunReport | None = None,
+        on_result: Callable[[str, object], None] | None = None, prefetch_limit: int | None = None,
+        get_removals: Callable[[str, object], list[str]] | None = None) -> str | int:
+    """
+    Обработка изображений с выводом прогресса и ошибок.
+    :param func: Функция, вызываемая для каждого файла.
+    :param file_paths: Пути к файлам.
+    :param backend: Тип пула: потоки или процессы.
+    :param jobs: Количество параллельных задач или None для значения по умолчанию.
+    :param memory_limit: Ограничение объёма пикселей выполняющихся задач в байтах или None.
+    :param report: Отчёт о времени этапов обработки или None, если замер не ведётся.
+    :param on_result: Функция, вызываемая с путём к файлу и результатом успешно обработанного
+        файла, или None.
+    :param prefetch_limit: Ограничение объёма файлов, прочитанных заранее, в байтах или None, если
+        файлы читаются и записываются в самих задачах.
+    :param get_removals: Функция, получающая по пути к файлу и результату обработки пути к
+        устаревшим файлам, которые удаляются сразу после записи результатов, или None.
+    :return: Код ошибки или строка с ошибкой.
+    """
+    if len(file_paths) < 1:
+        return os.EX_OK
+    with logging_redirect_tqdm():
+        pbar = tqdm(total=len(file_paths), desc=t("main.files"))
+        with create_executor(backend, jobs, prefetch_limit, get_removals) as executor:
+            for file_path, future in iterate_completed(executor, func, file_paths, jobs,
+                                                       memory_limit, report):
+                pbar.set_postfix_str(file_path)
+                try:
+                    result = future.result()
+                except PIL.UnidentifiedImageError:
+                    logging.info(t("main.file_not_image"), file_path)
+                except OSError as e:
+                    logging.info(t("main.exception"), file_path)
+                    logging.info(e)
+                else:
+                    if on_result is not None:
+                        on_result(file_path, result)
+                finally:
+                    pbar.update(1)
+            pbar.set_postfix_str("")
+            pbar.close()
+    return os.EX_OK
+
+
+def parse_jobs(value: str) -> int:
+    """
+    Проверка количества параллельных задач.
+    :param value: Количество параллельных задач.
+    :return: Количество параллельных задач.
+    """
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(t("main.jobs_invalid") % value)
+    return jobs
+
+
+def parse_memory_limit(value: str) -> int:
+    """
+    Преобразование ограничения памяти из мегабайт в байты.
+    :param value: Ограничение памяти в мегабайтах.
+    :return: Ограничение памяти в байтах.
+    """
+    memory_limit = float(value)
+    if not math.isfinite(memory_limit) or memory_limit <= 0:
+        raise argparse.ArgumentTypeError(t("main.memory_limit_invalid") % value)
+    return int(memory_limit * (1 << 20))
+
+
+def add_executor_arguments(parser: argparse.ArgumentParser):
+    """
+    Добавление аргументов выбора пула, количества параллельных задач, ограничения памяти и объёма
+    упреждающего чтения.
+    :param parser: Парсер аргументов командной строки.
+    """
+    parser.add_argument("--backend", choices=EXECUTOR_BACKENDS, default=BACKEND_THREAD,
+                        help=t("main.backend_arg"))
+    parser.add_argument("--jobs", "-j", type=parse_jobs, default=None, help=t("main.jobs_arg"))
+    parser.add_argument("--memory-limit", type=parse_memory_limit, default=None,
+                        help=t("main.memory_limit_arg"))
+    parser.add_argument("--prefetch", type=parse_memory_limit, default=None,
+                        help=t("main.prefetch_arg"))
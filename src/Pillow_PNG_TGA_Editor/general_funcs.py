@@ -3,16 +3,29 @@
 """
 import os
 import sys
+import argparse
 import logging
 import locale
 import warnings
-from tkinter import Tk
+from functools import cache
+from collections.abc import Callable
 
 import i18n
+from i18n import t
 import PIL.Image
-import PIL.ImageTk
 
-SUPPORTED_EXTENSIONS = set(PIL.Image.registered_extensions().keys())
+_ICON_PATH = ""  # Путь к иконке для диалоговых окон Tkinter, заданный в init_app.
+_GUI_ROOT = None  # Корневое окно Tkinter, создаваемое только перед первым диалогом.
+
+
+@cache
+def get_supported_extensions() -> frozenset[str]:
+    """
+    Получение расширений файлов, поддерживаемых Pillow. При первом вызове загружаются все модули
+    форматов Pillow, поэтому функция вызывается только когда расширения действительно нужны.
+    :return: Множество расширений с точкой в нижнем регистре.
+    """
+    return frozenset(PIL.Image.registered_extensions().keys())
 
 
 def get_resource_path(file_path: str) -> str:
@@ -30,22 +43,92 @@ def get_resource_path(file_path: str) -> str:
     return os.path.join(base_path, file_path)
 
 
-def init_app(icon_path: str):
+def init_i18n():
     """
-    Подготовка приложения к выполнению.
-    :param icon_path: Путь к иконке для диалоговых окон Tkinter.
+    Настройка локализации.
     """
-    sys.tracebacklimit = 0
-    logging.basicConfig(stream=sys.stdout, format="%(message)s", level=logging.INFO)
-    warnings.filterwarnings("ignore", category=DeprecationWarning)
     # noinspection PyDeprecation
     i18n.set("locale", locale.getdefaultlocale()[0])  # pylint: disable=deprecated-method
     i18n.set("fallback", "en_US")
-    i18n.load_path.append(get_resource_path("localization"))
+    if get_resource_path("localization") not in i18n.load_path:
+        i18n.load_path.append(get_resource_path("localization"))
     i18n.set("file_format", "yml")
     i18n.set("filename_format", "{namespace}.{format}")
     i18n.set("skip_locale_root_data", True)
     i18n.set("use_locale_dirs", True)
-    root = Tk()
-    root.withdraw()
-    root.iconphoto(True, PIL.ImageTk.PhotoImage(file=get_resource_path(icon_path)))
+
+
+def init_app(icon_path: str):
+    """
+    Подготовка приложения к выполнению. Окно Tkinter не создаётся до первого диалога.
+    :param icon_path: Путь к иконке для диалоговых окон Tkinter.
+    """
+    global _ICON_PATH  # pylint: disable=global-statement
+    sys.tracebacklimit = 0
+    logging.basicConfig(stream=sys.stdout, format="%(message)s", level=logging.INFO)
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    init_i18n()
+    _ICON_PATH = icon_path
+
+
+def init_gui():
+    """
+    Создание скрытого корневого окна Tkinter с иконкой приложения, если оно ещё не создано.
+    """
+    global _GUI_ROOT  # pylint: disable=global-statement
+    if _GUI_ROOT is not None:
+        return
+    from tkinter import Tk  # pylint: disable=import-outside-toplevel
+    from PIL import ImageTk  # pylint: disable=import-outside-toplevel
+    _GUI_ROOT = Tk()
+    _GUI_ROOT.withdraw()
+    if _ICON_PATH != "":
+        _GUI_ROOT.iconphoto(True, ImageTk.PhotoImage(file=get_resource_path(_ICON_PATH)))
+
+
+def ask_directory() -> str:
+    """
+    Выбор директории в диалоговом окне.
+    :return: Путь к директории или пустая строка, если выбор отменён.
+    """
+    from tkinter.filedialog import askdirectory  # pylint: disable=import-outside-toplevel
+    init_gui()
+    return askdirectory()
+
+
+def ask_image_files(title: str, filetypes_name: str) -> list[str]:
+    """
+    Выбор файлов изображений в диалоговом окне.
+    :param title: Заголовок диалогового окна.
+    :param filetypes_name: Название типа файлов изображений.
+    :return: Пути к выбранным файлам.
+    """
+    from tkinter.filedialog import askopenfilenames  # pylint: disable=import-outside-toplevel
+    init_gui()
+    return list(askopenfilenames(title=title, filetypes=[
+        (filetypes_name, ["*" + ext for ext in get_supported_extensions()])]))
+
+
+def add_headless_argument(parser: argparse.ArgumentParser):
+    """
+    Добавление аргумента, запрещающего открытие диалоговых окон.
+    :param parser: Парсер аргументов командной строки.
+    """
+    parser.add_argument("--headless", action="store_true", help=t("main.headless_arg"))
+
+
+def get_input_paths(parser: argparse.ArgumentParser, input_paths: list[str], headless: bool,
+                    ask: Callable[[], list[str]]) -> list[str]:
+    """
+    Получение путей ввода из аргументов или, если они не заданы, из диалогового окна.
+    :param parser: Парсер аргументов командной строки.
+    :param input_paths: Пути ввода из аргументов командной строки.
+    :param headless: Запрещено ли открытие диалоговых окон.
+    :param ask: Функция выбора путей в диалоговом окне.
+    :return: Пути ввода.
+    """
+    if len(input_paths) > 0:
+        return input_paths
+    if headless:
+        parser.error(t("main.no_input_paths"))
+    return ask()
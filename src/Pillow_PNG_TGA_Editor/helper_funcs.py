@@ -1,17 +1,77 @@
 """
     Набор функций для работы с изображениями - определения прозрачности и конвертации.
 """
-# pylint: disable=line-too-long
+# pylint: disable=line-too-long, wrong-import-position
+import io
 import os
+import sys
+import math
 import logging
 import errno
+import threading
+import contextvars
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 
 from i18n import t
 import PIL.Image
 import PIL.ImageOps
+import PIL.ImageChops
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+
+from stage_timing import stage, count_written, count, is_recording, STAGE_DECODE, \
+    STAGE_TRANSPARENCY, STAGE_CONVERT, STAGE_REDUCE, STAGE_TRANSFORM, STAGE_ENCODE, STAGE_EXISTS
+from staged_io import capture_image, claim_path, is_capturing
+from directory_index import DirectoryIndex
+from strip_funcs import get_strips, can_process_strips, TgaStripReader, TgaStripWriter
 
 TARGET_OPAQUE_EXTENSION = ".png"  # Расширение, в котором будут сохраняться изображения без прозрачности.
 TARGET_TRANSPARENT_EXTENSION = ".tga"  # Расширение, в котором будут сохраняться изображения с прозрачностью.
+ALPHA_MODES = {"RGBA", "RGBa", "LA", "La", "PA"}  # Режимы изображений с альфа-каналом.
+ALPHA_STRIP_PIXELS = 1 << 20  # Количество пикселей в полосе при проверке альфа-канала.
+REDUCE_SAMPLE_PIXELS = 1 << 16  # Количество пикселей в выборке для быстрого отказа от уменьшения.
+REDUCE_COLORS = 256  # Максимальное количество цветов для сохранения с палитрой.
+REDUCED_MODES = {"L", "P"}  # Режимы непрозрачных PNG после уменьшения размера.
+OPERATION_SPLIT_EYES = "split_eyes"  # Разделение текстуры глаз/рта на 8 изображений.
+OPERATION_MIRROR_CONCAT = "mirror_concat"  # Добавление справа отзеркаленной версии.
+OPERATION_NORMALIZE = "normalize"  # Приведение к PNG или RLE TGA по правилам resave_img.
+OPERATIONS = (OPERATION_SPLIT_EYES, OPERATION_MIRROR_CONCAT, OPERATION_NORMALIZE)
+TILE_SAVE_JOBS = 8  # Количество потоков для параллельного сохранения частей изображения.
+ENCODE_PROFILE_FAST = "fast"  # Быстрое сохранение: минимальное сжатие PNG, TGA без RLE.
+ENCODE_PROFILE_BALANCED = "balanced"  # Стандартное сжатие PNG, TGA с RLE.
+ENCODE_PROFILE_MAX = "max"  # Максимальное сжатие PNG, TGA с RLE.
+ENCODE_PROFILES = {  # Параметры сохранения для каждого расширения ("" - для остальных расширений).
+    ENCODE_PROFILE_FAST: {".png": {"compress_level": 1}, ".tga": {}, "": {"quality": 100}},
+    ENCODE_PROFILE_BALANCED: {".png": {"compress_level": 6}, ".tga": {"compression": "tga_rle"},
+                              "": {"quality": 100}},
+    ENCODE_PROFILE_MAX: {".png": {"optimize": True}, ".tga": {"compression": "tga_rle"},
+                         "": {"optimize": True, "quality": 100}}
+}
+
+_TILE_EXECUTOR: ThreadPoolExecutor | None = None  # Пул для сохранения частей изображения.
+_TILE_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_header_transparency(img_object: PIL.Image.Image) -> bool | None:
+    """
+    Определение прозрачности изображения только по заголовку и метаданным, без чтения пикселей.
+    :param img_object: Изображение.
+    :return: False, если изображение точно непрозрачное, или None, если для ответа нужно прочитать
+        пиксели.
+    """
+    if img_object.mode in ALPHA_MODES:
+        return None
+    if img_object.mode == "P" and img_object.palette is not None and \
+            img_object.palette.mode == "RGBA":
+        return None
+    transparency = img_object.info.get("transparency")
+    if transparency is None:
+        return False
+    if img_object.mode == "P" and isinstance(transparency, bytes) and \
+            transparency.count(255) == len(transparency):  # Все значения tRNS непрозрачные.
+        return False
+    return None
 
 
 def has_transparency(img_object: PIL.Image.Image) -> bool:
@@ -20,128 +80,640 @@ def has_transparency(img_object: PIL.Image.Image) -> bool:
     :param img_object: Изображение.
     :return: Является ли изображение частично или полностью прозрачным.
     """
+    if img_object.mode in ALPHA_MODES:
+        return has_alpha_transparency(img_object)
     if img_object.mode == "P":
-        transparent = img_object.info.get("transparency", -1)
-        for _, index in img_object.getcolors():
-            if index == transparent:
-                return True
-    elif img_object.mode == "RGBA":
-        extrema = img_object.getextrema()
-        if extrema[3][0] < 255:
+        return has_palette_transparency(img_object)
+    transparency = img_object.info.get("transparency")
+    if transparency is None:
+        return False
+    if img_object.mode == "L" and isinstance(transparency, int):
+        return img_object.histogram()[transparency] > 0
+    return has_alpha_transparency(img_object.convert("RGBA"))
+
+
+def has_alpha_transparency(img_object: PIL.Image.Image) -> bool:
+    """
+    Проверка альфа-канала изображения на наличие непрозрачных значений. Изображение проверяется
+    полосами, чтобы прекратить проверку на первой полосе с прозрачностью.
+    :param img_object: Изображение с альфа-каналом.
+    :return: Есть ли в альфа-канале значения меньше 255.
+    """
+    alpha_index = len(img_object.getbands()) - 1  # Альфа-канал последний и называется "A" или
+    # "a" для режимов с умноженными на него цветами (RGBa, La).
+    width, height = img_object.size
+    if width < 1 or height < 1:
+        return False
+    if img_object.getpixel((0, 0))[alpha_index] < 255:
+        return True
+    strip_height = max(1, ALPHA_STRIP_PIXELS // width)
+    if strip_height >= height:
+        return img_object.getextrema()[alpha_index][0] < 255
+    for y0 in range(0, height, strip_height):
+        strip = img_object.crop((0, y0, width, min(y0 + strip_height, height)))
+        if strip.getextrema()[alpha_index][0] < 255:
+            return True
+    return False
+
+
+def has_palette_transparency(img_object: PIL.Image.Image) -> bool:
+    """
+    Проверка палитрового изображения на использование прозрачных индексов палитры.
+    :param img_object: Изображение в режиме P.
+    :return: Используется ли в изображении хотя бы один прозрачный индекс.
+    """
+    transparent_indices = set()
+    if img_object.palette is not None and img_object.palette.mode == "RGBA":
+        palette = img_object.palette.tobytes()
+        transparent_indices.update(i // 4 for i in range(3, len(palette), 4) if palette[i] < 255)
+    transparency = img_object.info.get("transparency")
+    if isinstance(transparency, int):
+        transparent_indices.add(transparency)
+    elif isinstance(transparency, bytes):
+        transparent_indices.update(i for i, value in enumerate(transparency) if value < 255)
+    if len(transparent_indices) < 1:
+        return False
+    for _, index in img_object.getcolors(256):
+        if index in transparent_indices:
             return True
     return False
 
 
-def save_image(img_object: PIL.Image.Image, fpe: str, ext: str) -> str:
+def is_grayscale(img_object: PIL.Image.Image) -> bool:
+    """
+    Проверка равенства всех каналов изображения в режиме RGB. Изображение проверяется полосами,
+    чтобы прекратить проверку на первой полосе с цветным пикселем.
+    :param img_object: Изображение в режиме RGB.
+    :return: Совпадают ли значения каналов R, G и B во всех пикселях.
+    """
+    width, height = img_object.size
+    strip_height = max(1, ALPHA_STRIP_PIXELS // max(1, width))
+    for y0 in range(0, height, strip_height):
+        strip = img_object.crop((0, y0, width, min(y0 + strip_height, height)))
+        red, green, blue = strip.split()
+        if PIL.ImageChops.difference(red, green).getbbox() is not None or \
+                PIL.ImageChops.difference(green, blue).getbbox() is not None:
+            return False
+    return True
+
+
+def get_reduced_img(img_object: PIL.Image.Image) -> PIL.Image.Image | None:
+    """
+    Поиск представления непрозрачного изображения, которое сохраняется в PNG меньшего размера без
+    потерь: в оттенках серого (L) или с палитрой (P). Сначала проверяется выборка пикселей, чтобы
+    быстро отказаться от уменьшения для фотографических текстур; подсчёт цветов прекращается на
+    257-м цвете.
+    :param img_object: Изображение в режиме RGB.
+    :return: Изображение в режиме L или P с теми же цветами или None, если уменьшение невозможно.
+    """
+    width, height = img_object.size
+    sample = img_object
+    if width * height > REDUCE_SAMPLE_PIXELS:
+        scale = math.sqrt(REDUCE_SAMPLE_PIXELS / (width * height))
+        sample = img_object.resize((max(1, int(width * scale)), max(1, int(height * scale))),
+                                   PIL.Image.Resampling.NEAREST)  # Пиксели без смешивания.
+    if is_grayscale(sample) and is_grayscale(img_object):
+        return img_object.convert("L")
+    if sample.getcolors(REDUCE_COLORS) is None:
+        return None
+    colors = img_object.getcolors(REDUCE_COLORS)
+    if colors is None:
+        return None
+    img_reduced = img_object.quantize(len(colors), PIL.Image.Quantize.MEDIANCUT,
+                                      dither=PIL.Image.Dither.NONE)
+    if PIL.ImageChops.difference(img_reduced.convert("RGB"), img_object).getbbox() is not None:
+        return None  # Палитра оказалась неточной.
+    return img_reduced
+
+
+def reduce_img(img_object: PIL.Image.Image, profile: str = ENCODE_PROFILE_MAX) -> PIL.Image.Image:
+    """
+    Уменьшение размера непрозрачного изображения без потерь перед сохранением в PNG. Если ведётся
+    запись о файле, в неё добавляется количество байт, сэкономленных по сравнению с RGB (для этого
+    изображение дополнительно сохраняется в память в обоих режимах).
+    :param img_object: Изображение в режиме RGB.
+    :param profile: Название профиля сохранения.
+    :return: Изображение в режиме L или P или то же изображение, если уменьшение невозможно.
+    """
+    with stage(STAGE_DECODE):
+        img_object.load()
+    with stage(STAGE_REDUCE):
+        img_reduced = get_reduced_img(img_object)
+    if img_reduced is None:
+        return img_object
+    count("reduced_files")
+    if is_recording():
+        sizes = []
+        for item in (img_object, img_reduced):
+            buffer = io.BytesIO()
+            item.save(buffer, "PNG", **get_save_params(TARGET_OPAQUE_EXTENSION, profile))
+            sizes.append(buffer.tell())
+        count("reduced_bytes_saved", sizes[0] - sizes[1])
+    img_object.close()
+    return img_reduced
+
+
+def get_image_memory_size(file_path: str) -> int:
+    """
+    Оценка объёма памяти, занимаемого пикселями изображения, по его заголовку без чтения пикселей.
+    :param file_path: Путь к файлу.
+    :return: Произведение ширины, высоты и количества каналов или 0, если файл не удалось открыть.
+    """
+    try:
+        with PIL.Image.open(file_path) as img_object:
+            return img_object.size[0] * img_object.size[1] * len(img_object.getbands())
+    except (OSError, PIL.Image.DecompressionBombError):
+        return 0
+
+
+def get_save_params(ext: str, profile: str = ENCODE_PROFILE_MAX) -> dict:
     """
-    Сохранение изображения с заданным именем и расширением.
+    Получение параметров сохранения изображения для расширения и профиля сохранения.
+    :param ext: Расширение файла с точкой.
+    :param profile: Название профиля сохранения.
+    :return: Параметры для PIL.Image.Image.save.
+    """
+    profile_params = ENCODE_PROFILES[profile]
+    return profile_params.get(ext.lower(), profile_params[""])
+
+
+def save_image(img_object: PIL.Image.Image, fpe: str, ext: str,
+               profile: str = ENCODE_PROFILE_MAX) -> str:
+    """
+    Сохранение изображения с заданным именем и расширением. При отложенной записи изображение
+    кодируется в память и записывается на диск позже.
     :param img_object: Изображение.
     :param fpe: Путь к файлу без расширения.
     :param ext: Расширение файла с точкой.
+    :param profile: Название профиля сохранения.
     :return: Путь к сохранённому файлу.
     """
     if img_object is None:
         return ""
     fp = fpe + ext
     try:
-        if ext.lower() == ".tga":  # Файлы TGA можно сжать, используя RLE сжатие.
-            img_object.save(fp, optimize=True, quality=100, compression="tga_rle")
-        else:
-            img_object.save(fp, optimize=True, quality=100)
+        with stage(STAGE_ENCODE):
+            params = get_save_params(ext, profile)
+            if capture_image(img_object, fp, params):
+                return fp
+            img_object.save(fp, **params)
     except OSError as e:
         logging.info(t("helper_funcs.exception_save"), fp)
         logging.info(e)
         return ""
+    count_written(fp)
     return fp
 
 
-def resave_img(img_object: PIL.Image.Image) -> str:
+def save_and_close(img_object: PIL.Image.Image, fpe: str, ext: str,
+                   profile: str = ENCODE_PROFILE_MAX) -> str:
+    """
+    Сохранение изображения с заданным именем и расширением и освобождение его пикселей.
+    :param img_object: Изображение, которое больше не нужно после сохранения.
+    :param fpe: Путь к файлу без расширения.
+    :param ext: Расширение файла с точкой.
+    :param profile: Название профиля сохранения.
+    :return: Путь к сохранённому файлу.
+    """
+    try:
+        return save_image(img_object, fpe, ext, profile)
+    finally:
+        img_object.close()
+
+
+def convert_img(img_object: PIL.Image.Image, mode: str) -> PIL.Image.Image:
+    """
+    Изменение режима изображения с раздельным замером чтения пикселей и конвертации.
+    :param img_object: Изображение.
+    :param mode: Новый режим изображения.
+    :return: Изображение в новом режиме.
+    """
+    with stage(STAGE_DECODE):
+        img_object.load()
+    with stage(STAGE_CONVERT):
+        return img_object.convert(mode)
+
+
+def claim_target(file_path: str, index: DirectoryIndex | None = None) -> bool:
+    """
+    Проверка существования файла по новому пути с отметкой пути занятым в индексе директорий.
+    :param file_path: Новый путь к файлу.
+    :param index: Индекс директорий или None, чтобы проверить путь на диске.
+    :return: Существует ли файл.
+    """
+    if index is not None:
+        return index.claim(file_path)
+    count("exists_stats")
+    return os.path.exists(file_path)
+
+
+def release_target(file_path: str, index: DirectoryIndex | None = None):
+    """
+    Снятие отметки занятости с нового пути, по которому файл так и не был записан.
+    :param file_path: Новый путь к файлу.
+    :param index: Индекс директорий или None, если путь не отмечался.
+    """
+    if index is not None:
+        index.discard(file_path)
+
+
+def is_normalized(img_object: PIL.Image.Image, transparent: bool,
+                  profile: str = ENCODE_PROFILE_MAX, reduce: bool = False) -> bool:
+    """
+    Проверка того, что изображение с нужным расширением уже сохранено в нужном режиме.
+    :param img_object: Изображение.
+    :param transparent: Есть ли в изображении прозрачность.
+    :param profile: Название профиля сохранения.
+    :param reduce: Считаются ли режимы L и P нужными для непрозрачных PNG.
+    :return: Не требуется ли конвертация изображения.
+    """
+    if not transparent:
+        return img_object.mode == "RGB" or (reduce and img_object.mode in REDUCED_MODES)
+    if img_object.mode != "RGBA":
+        return False
+    if TARGET_TRANSPARENT_EXTENSION.lower() != ".tga" or "compression" not in get_save_params(
+            TARGET_TRANSPARENT_EXTENSION, profile):  # В профиле без RLE-сжатия подходит любой TGA.
+        return True
+    return img_object.info.get("compression") == "tga_rle"
+
+
+def normalize_mode(img_object: PIL.Image.Image, transparent: bool,
+                   profile: str = ENCODE_PROFILE_MAX, reduce: bool = False) -> PIL.Image.Image:
+    """
+    Приведение изображения к режиму, зависящему от наличия в нём прозрачности.
+    :param img_object: Изображение.
+    :param transparent: Есть ли в изображении прозрачность.
+    :param profile: Название профиля сохранения.
+    :param reduce: Уменьшать ли размер непрозрачных PNG без потерь.
+    :return: Изображение в нужном режиме.
+    """
+    if transparent:
+        return img_object if img_object.mode == "RGBA" else convert_img(img_object, "RGBA")
+    if img_object.mode != "RGB":
+        img_object = convert_img(img_object, "RGB")
+    if reduce:
+        img_object = reduce_img(img_object, profile)
+    return img_object
+
+
+def get_normalized_img(  # pylint: disable=too-many-arguments, too-many-positional-arguments
+        img_object: PIL.Image.Image, fpe: str, ext: str, profile: str = ENCODE_PROFILE_MAX,
+        reduce: bool = False,
+        index: DirectoryIndex | None = None) -> tuple[PIL.Image.Image, str, bool]:
+    """
+    Приведение изображения к режиму и расширению, зависящим от наличия в нём прозрачности. Если
+    расширение меняется, новый путь отмечается занятым, а при ошибке конвертации отметка снимается.
+    :param img_object: Изображение.
+    :param fpe: Путь к файлу изображения без расширения.
+    :param ext: Расширение файла изображения с точкой.
+    :param profile: Название профиля сохранения.
+    :param reduce: Уменьшать ли размер непрозрачных PNG без потерь (режимы L и P считаются
+        нужным форматом).
+    :param index: Индекс директорий для проверки нового пути или None, чтобы проверять на диске.
+    :return: Изображение в нужном режиме, новое расширение и находится ли уже файл изображения в
+        нужном формате (в этом случае изображение не конвертируется).
+    """
+    transparent = get_header_transparency(img_object)
+    if transparent is None:  # Прозрачность зависит от значений пикселей.
+        with stage(STAGE_DECODE):
+            img_object.load()
+        with stage(STAGE_TRANSPARENCY):
+            transparent = has_transparency(img_object)
+    new_ext = TARGET_TRANSPARENT_EXTENSION if transparent else TARGET_OPAQUE_EXTENSION
+    if ext.lower() == new_ext.lower():
+        if is_normalized(img_object, transparent, profile, reduce):  # Изображение уже в нужном
+            # формате.
+            return img_object, new_ext, True
+        return normalize_mode(img_object, transparent, profile, reduce), new_ext, False
+    with stage(STAGE_EXISTS):
+        exists = claim_target(fpe + new_ext, index)
+    if exists:  # Существует другой файл с новым путём.
+        raise FileExistsError(errno.EEXIST, t("main.file_already_exists") % (fpe + new_ext))
+    claim_path(fpe + new_ext, index)
+    try:
+        return normalize_mode(img_object, transparent, profile, reduce), new_ext, False
+    except BaseException:
+        release_target(fpe + new_ext, index)
+        raise
+
+
+def resave_img(img_object: PIL.Image.Image, profile: str = ENCODE_PROFILE_MAX,
+               reduce: bool = False, index: DirectoryIndex | None = None) -> str:
     """
     Сохранение изображения в другом формате в зависимости от наличия в нём прозрачности и RLE-сжатия
     для случая TGA.
-    :param img_object: Изображение.
+    :param img_object: Изображение. Закрывается, как только его пиксели больше не нужны.
+    :param profile: Название профиля сохранения.
+    :param reduce: Уменьшать ли размер непрозрачных PNG без потерь.
+    :param index: Индекс директорий для проверки нового пути или None, чтобы проверять на диске.
     :return: Путь к сохранённому файлу или пустая строка, если файл уже в нужном формате.
     """
     fp = getattr(img_object, "filename", "")
     if fp == "":
         raise FileNotFoundError
-    fpe, ext = os.path.splitext(fp)
-    ext = ext.lower()
-    if not has_transparency(img_object):  # Изображение непрозрачное.
-        if ext != TARGET_OPAQUE_EXTENSION.lower() and os.path.exists(
-                fpe + TARGET_OPAQUE_EXTENSION):  # Существует другой файл с новым путём.
-            raise FileExistsError(errno.EEXIST, t("main.file_already_exists") %
-                                  (fpe + TARGET_OPAQUE_EXTENSION))
-        if ext == TARGET_OPAQUE_EXTENSION.lower() and img_object.mode == "RGB":  # Изображение уже
-            # в нужном формате.
-            return ""
-        if img_object.mode != "RGB":
-            img_object = img_object.convert("RGB")
-        return save_image(img_object, fpe, TARGET_OPAQUE_EXTENSION)
-    if ext != TARGET_TRANSPARENT_EXTENSION.lower() and os.path.exists(
-            fpe + TARGET_TRANSPARENT_EXTENSION):  # Существует другой файл с новым путём.
-        raise FileExistsError(errno.EEXIST, t("main.file_already_exists") %
-                              (fpe + TARGET_TRANSPARENT_EXTENSION))
-    if ext == TARGET_TRANSPARENT_EXTENSION.lower() and img_object.mode == "RGBA" and (
-            TARGET_TRANSPARENT_EXTENSION.lower() != ".tga" or (
-            "compression" in img_object.info and img_object.info["compression"]
-            == "tga_rle")):  # Изображение уже
-        # в нужном формате.
+    fpe, old_ext = os.path.splitext(fp)
+    new_object, ext, unchanged = get_normalized_img(img_object, fpe, old_ext, profile, reduce,
+                                                    index)
+    if unchanged:
         return ""
-    if img_object.mode != "RGBA":
-        img_object = img_object.convert("RGBA")
-    return save_image(img_object, fpe, TARGET_TRANSPARENT_EXTENSION)
+    if new_object is not img_object:
+        img_object.close()  # Сохраняется только копия в новом режиме.
+    new_file_path = ""
+    try:
+        new_file_path = save_and_close(new_object, fpe, ext, profile)
+    finally:
+        if new_file_path == "" and ext.lower() != old_ext.lower():
+            release_target(fpe + ext, index)  # Путь был отмечен занятым при проверке.
+    return new_file_path
 
 
-def mirror_concat_img(img_object: PIL.Image.Image) -> str:
+def get_mirror_concat_img(img_object: PIL.Image.Image) -> PIL.Image.Image:
     """
-    Добавление справа от изображения его отзеркаленной версии и сохранение вместо начального.
+    Добавление справа от изображения его отзеркаленной версии без сохранения.
     :param img_object: Изображение.
+    :return: Изображение двойной ширины.
+    """
+    with stage(STAGE_DECODE):
+        img_object.load()
+    with stage(STAGE_TRANSFORM):
+        img_concat = PIL.Image.new(img_object.mode, (img_object.size[0] * 2, img_object.size[1]))
+        img_concat.paste(img_object, (0, 0))
+        img_mirrored = PIL.ImageOps.mirror(img_object)
+        img_concat.paste(img_mirrored, (img_object.size[0], 0))
+        img_mirrored.close()
+    return img_concat
+
+
+def mirror_concat_strips(img_object: PIL.Image.Image, fp: str, profile: str,
+                         strip_height: int) -> str:
+    """
+    Добавление справа от изображения его отзеркаленной версии по полосам строк с сохранением
+    вместо начального. Каждая полоса читается, отзеркаливается и записывается отдельно, а файл
+    совпадает с результатом обработки изображения целиком.
+    :param img_object: Изображение, для которого can_process_strips возвращает True. Закрывается
+        перед заменой начального файла.
+    :param fp: Путь к начальному файлу.
+    :param profile: Название профиля сохранения.
+    :param strip_height: Высота полосы в строках.
+    :return: Путь к сохранённому файлу (совпадает с начальным).
+    """
+    width, height = img_object.size
+    reader = TgaStripReader(img_object)
+    with TgaStripWriter(fp, img_object.mode, (width * 2, height),
+                        get_save_params(os.path.splitext(fp)[1], profile)) as writer:
+        for y0, y1 in get_strips(height, strip_height):
+            with stage(STAGE_DECODE):
+                img_strip = reader.read(y0, y1)
+            img_concat = get_mirror_concat_img(img_strip)
+            img_strip.close()
+            with stage(STAGE_ENCODE):
+                writer.write(img_concat)
+            img_concat.close()
+        img_object.close()
+    if not is_capturing():  # Иначе объём учитывается при отложенной записи.
+        count_written(fp)
+    return fp
+
+
+def mirror_concat_img(img_object: PIL.Image.Image, profile: str = ENCODE_PROFILE_MAX,
+                      strip_height: int | None = None) -> str:
+    """
+    Добавление справа от изображения его отзеркаленной версии и сохранение вместо начального.
+    :param img_object: Изображение. Закрывается перед сохранением результата.
+    :param profile: Название профиля сохранения.
+    :param strip_height: Высота полосы в строках для обработки полосами несжатых и сжатых RLE
+        изображений TGA или None, чтобы обрабатывать изображение целиком.
     :return: Путь к сохранённому файлу (совпадает с начальным).
     """
     fp = getattr(img_object, "filename", "")
     if fp == "":
         raise FileNotFoundError
     fpe, ext = os.path.splitext(fp)
-    img_concat = PIL.Image.new(img_object.mode, (img_object.size[0] * 2, img_object.size[1]))
-    img_concat.paste(img_object, (0, 0))
-    img_concat.paste(PIL.ImageOps.mirror(img_object), (img_object.size[0], 0))
-    return save_image(img_concat, fpe, ext)
+    if strip_height is not None and can_process_strips(img_object, ext):
+        return mirror_concat_strips(img_object, fp, profile, strip_height)
+    img_concat = get_mirror_concat_img(img_object)
+    img_object.close()
+    return save_and_close(img_concat, fpe, ext, profile)
+
+
+def get_tile_executor() -> ThreadPoolExecutor:
+    """
+    Получение общего пула потоков для параллельного сохранения частей изображения. Пул создаётся
+    при первом использовании отдельно в каждом процессе.
+    :return: Пул потоков.
+    """
+    global _TILE_EXECUTOR  # pylint: disable=global-statement
+    with _TILE_EXECUTOR_LOCK:
+        if _TILE_EXECUTOR is None:
+            _TILE_EXECUTOR = ThreadPoolExecutor(max_workers=TILE_SAVE_JOBS)
+        return _TILE_EXECUTOR
+
+
+def map_tiles(func: Callable[[object], str], items: Iterable[object]) -> list[str]:
+    """
+    Параллельное сохранение частей изображения в общем пуле потоков. Каждая часть сохраняется в
+    копии контекста вызывающего потока, чтобы при отложенной записи результаты попадали в память
+    обрабатываемого файла.
+    :param func: Функция сохранения части.
+    :param items: Части изображения.
+    :return: Пути к сохранённым файлам в порядке частей.
+    """
+    executor = get_tile_executor()
+    futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+    return [future.result() for future in futures]
+
+
+def check_split_eyes_size(img_object: PIL.Image.Image):
+    """
+    Проверка того, что текстуру глаз/рта можно разделить на 8 изображений.
+    :param img_object: Изображение.
+    """
+    width, height = img_object.size
+    if width % 2 != 0 or height % 4 != 0:
+        raise IOError(errno.EIO, t("main.img_split_eyes_wrong_resolution") % (
+            getattr(img_object, "filename", ""), width, height))
 
 
-def split_eyes_img(img_object: PIL.Image.Image) -> list[str]:
+def get_split_eyes_pair(img_object: PIL.Image.Image, img_mirrored: PIL.Image.Image, y0: int,
+                        y1: int) -> tuple[PIL.Image.Image, PIL.Image.Image]:
     """
-    Разделение текстуры глаз/рта на 8 изображений и их сохранение.
+    Сборка левой и правой частей текстуры глаз/рта из полосы строк.
     :param img_object: Изображение.
+    :param img_mirrored: Отзеркаленное изображение.
+    :param y0: Первая строка полосы.
+    :param y1: Строка после последней строки полосы.
+    :return: Отзеркаленная левая половина полосы с самой левой половиной (части 1-4) и правая
+        половина полосы с её отзеркаленной версией (части 5-8).
+    """
+    width = img_object.size[0]
+    img_left = PIL.Image.new(img_object.mode, (width, y1 - y0))
+    img_left.paste(img_mirrored.crop((width // 2, y0, width, y1)), (0, 0))
+    img_left.paste(img_object.crop((0, y0, width // 2, y1)), (width // 2, 0))
+    img_right = PIL.Image.new(img_object.mode, (width, y1 - y0))
+    img_right.paste(img_object.crop((width // 2, y0, width, y1)), (0, 0))
+    img_right.paste(img_mirrored.crop((0, y0, width // 2, y1)), (width // 2, 0))
+    return img_left, img_right
+
+
+def split_eyes_tiles(img_object: PIL.Image.Image) -> list[PIL.Image.Image]:
+    """
+    Разделение текстуры глаз/рта на 8 изображений без сохранения. Изображение читается и
+    отзеркаливается один раз, а каждая часть собирается из полосы исходного и отзеркаленного
+    изображений.
+    :param img_object: Изображение.
+    :return: Список из 8 изображений в порядке номеров частей (1-8).
+    """
+    check_split_eyes_size(img_object)
+    height = img_object.size[1]
+    with stage(STAGE_DECODE):
+        img_object.load()
+    with stage(STAGE_TRANSFORM):
+        img_mirrored = PIL.ImageOps.mirror(img_object)
+        tiles_left, tiles_right = zip(*(
+            get_split_eyes_pair(img_object, img_mirrored, i * height // 4, (i + 1) * height // 4)
+            for i in range(4)))
+        img_mirrored.close()
+    return list(tiles_left + tiles_right)
+
+
+def split_eyes_strips(  # pylint: disable=too-many-locals
+        img_object: PIL.Image.Image, fp: str, profile: str, strip_height: int) -> list[str]:
+    """
+    Разделение текстуры глаз/рта на 8 изображений по полосам строк с сохранением. Четверти
+    изображения обрабатываются снизу вверх, а каждая полоса читается и отзеркаливается один раз и
+    дописывается в две части. Файлы совпадают с результатом обработки изображения целиком.
+    :param img_object: Изображение с проверенными размерами, для которого can_process_strips
+        возвращает True. Закрывается после чтения.
+    :param fp: Путь к начальному файлу.
+    :param profile: Название профиля сохранения.
+    :param strip_height: Высота полосы в строках.
+    :return: Путь к сохранённым файлам.
+    """
+    width, height = img_object.size
+    fpe, ext = os.path.splitext(fp)
+    params = get_save_params(ext, profile)
+    reader = TgaStripReader(img_object)
+    for i in reversed(range(4)):
+        with TgaStripWriter(f"{fpe}_{i + 1}{ext}", img_object.mode, (width, height // 4),
+                            params) as writer_left, \
+                TgaStripWriter(f"{fpe}_{i + 5}{ext}", img_object.mode, (width, height // 4),
+                               params) as writer_right:
+            for y0, y1 in get_strips(height // 4, strip_height):
+                with stage(STAGE_DECODE):
+                    img_strip = reader.read(i * height // 4 + y0, i * height // 4 + y1)
+                with stage(STAGE_TRANSFORM):
+                    img_mirrored = PIL.ImageOps.mirror(img_strip)
+                    img_left, img_right = get_split_eyes_pair(img_strip, img_mirrored, 0, y1 - y0)
+                    img_mirrored.close()
+                    img_strip.close()
+                with stage(STAGE_ENCODE):
+                    writer_left.write(img_left)
+                    writer_right.write(img_right)
+                img_left.close()
+                img_right.close()
+    img_object.close()
+    result_paths = [f"{fpe}_{j + 1}{ext}" for i in range(4) for j in (i, i + 4)]
+    if not is_capturing():  # Иначе объём учитывается при отложенной записи.
+        for result_path in result_paths:
+            count_written(result_path)
+    return result_paths
+
+
+def split_eyes_img(img_object: PIL.Image.Image, profile: str = ENCODE_PROFILE_MAX,
+                   strip_height: int | None = None) -> list[str]:
+    """
+    Разделение текстуры глаз/рта на 8 изображений и их параллельное сохранение.
+    :param img_object: Изображение. Закрывается перед сохранением частей.
+    :param profile: Название профиля сохранения.
+    :param strip_height: Высота полосы в строках для обработки полосами несжатых и сжатых RLE
+        изображений TGA или None, чтобы обрабатывать изображение целиком.
     :return: Путь к сохранённым файлам.
     """
     fp = getattr(img_object, "filename", "")
     if fp == "":
         raise FileNotFoundError
-    if img_object.size[0] % 2 != 0 or img_object.size[1] % 4 != 0:
-        raise IOError(errno.EIO, t("main.img_split_eyes_wrong_resolution") % (
-        fp, img_object.size[0], img_object.size[1]))
     fpe, ext = os.path.splitext(fp)
-    result_paths = []
-    for i in range(4):
-        y0 = i * img_object.size[1] // 4
-        y1 = (i + 1) * img_object.size[1] // 4
-        x0 = 0
-        x1 = img_object.size[0] // 2
-        img_cropped_right = img_object.crop((x0, y0, x1, y1))
-        img_cropped_left = PIL.ImageOps.mirror(img_cropped_right)
-        img_concat = PIL.Image.new(img_object.mode,
-                                   (img_object.size[0], img_object.size[1] // 4))
-        img_concat.paste(img_cropped_left, (0, 0))
-        img_concat.paste(img_cropped_right, (img_object.size[0] // 2, 0))
-        result_paths.append(save_image(img_concat, fpe + "_" + str(i + 1), ext))
-        x0 = img_object.size[0] // 2
-        x1 = img_object.size[0]
-        img_cropped_left = img_object.crop((x0, y0, x1, y1))
-        img_cropped_right = PIL.ImageOps.mirror(img_cropped_left)
-        img_concat = PIL.Image.new(img_object.mode,
-                                   (img_object.size[0], img_object.size[1] // 4))
-        img_concat.paste(img_cropped_left, (0, 0))
-        img_concat.paste(img_cropped_right, (img_object.size[0] // 2, 0))
-        result_paths.append(save_image(img_concat, fpe + "_" + str(i + 5), ext))
+    if strip_height is not None and can_process_strips(img_object, ext):
+        check_split_eyes_size(img_object)
+        return split_eyes_strips(img_object, fp, profile, strip_height)
+    tiles = split_eyes_tiles(img_object)
+    img_object.close()
+    order = [j for i in range(4) for j in (i, i + 4)]  # Порядок путей: 1, 5, 2, 6, 3, 7, 4, 8.
+    with stage(STAGE_ENCODE):
+        result_paths = map_tiles(
+            lambda j: save_and_close(tiles[j], fpe + "_" + str(j + 1), ext, profile), order)
+    if not is_capturing():  # Иначе объём учитывается при отложенной записи.
+        for result_path in result_paths:
+            count_written(result_path)
     return result_paths
+
+
+def run_pipeline(  # pylint: disable=too-many-locals, too-many-branches
+        img_object: PIL.Image.Image, operations: list[str], profile: str = ENCODE_PROFILE_MAX,
+        reduce: bool = False, index: DirectoryIndex | None = None) -> tuple[list[str], list[str]]:
+    """
+    Последовательное применение операций к изображению в памяти и сохранение только итоговых
+    изображений. Для изображений без потерь результат совпадает с последовательным запуском
+    соответствующих инструментов, кроме двух случаев: промежуточные изображения не сохраняются с
+    потерями (например, в JPEG), а при существовании файла по новому пути нормализации не
+    сохраняется ни одно итоговое изображение.
+    Промежуточные изображения закрываются после каждой операции, итоговые - после сохранения.
+    :param img_object: Изображение.
+    :param operations: Названия операций в порядке применения.
+    :param profile: Название профиля сохранения.
+    :param reduce: Уменьшать ли размер непрозрачных PNG без потерь при нормализации.
+    :param index: Индекс директорий для проверки новых путей при нормализации или None, чтобы
+        проверять на диске.
+    :return: Пути к сохранённым файлам и пути к файлам, которые нужно удалить, так как они были
+        сконвертированы в другой формат.
+    """
+    fp = getattr(img_object, "filename", "")
+    if fp == "":
+        raise FileNotFoundError
+    fpe, ext = os.path.splitext(fp)
+    items = [(img_object, fpe, ext, True)]  # Изображение, путь без расширения, расширение и
+    # совпадает ли изображение с файлом по этому пути.
+    converted_paths = []  # Пути, с которых изображения были сконвертированы в другой формат.
+    claimed_paths = []  # Новые пути, отмеченные занятыми при нормализации.
+    result_paths = []
+    try:
+        for operation in operations:
+            results = []
+            for item_object, item_fpe, item_ext, unchanged in items:
+                if operation == OPERATION_MIRROR_CONCAT:
+                    results.append((get_mirror_concat_img(item_object), item_fpe, item_ext, False))
+                elif operation == OPERATION_SPLIT_EYES:
+                    results += [(tile, item_fpe + "_" + str(i + 1), item_ext, False) for i, tile
+                                in enumerate(split_eyes_tiles(item_object))]
+                elif operation == OPERATION_NORMALIZE:
+                    new_object, new_ext, already = get_normalized_img(item_object, item_fpe,
+                                                                      item_ext, profile, reduce,
+                                                                      index)
+                    if new_ext.lower() != item_ext.lower():
+                        converted_paths.append(item_fpe + item_ext)
+                        claimed_paths.append(item_fpe + new_ext)
+                    results.append((new_object, item_fpe, new_ext, unchanged and already))
+                else:
+                    raise ValueError(operation)
+            kept = {id(result[0]) for result in results}
+            for item in items:
+                if id(item[0]) not in kept:
+                    item[0].close()
+            items = results
+        items = [item for item in items if not item[3]]  # Неизменённые файлы не сохраняются.
+        with stage(STAGE_ENCODE):
+            result_paths = map_tiles(
+                lambda item: save_and_close(item[0], item[1], item[2], profile), items)
+    finally:
+        for claimed_path in claimed_paths:
+            if index is not None and claimed_path not in result_paths and not os.path.exists(
+                    claimed_path):  # Файл по новому пути не был записан из-за ошибки.
+                release_target(claimed_path, index)
+    if not is_capturing():  # Иначе объём учитывается при отложенной записи.
+        for result_path in result_paths:
+            count_written(result_path)
+    obsolete_paths = [] if "" in result_paths else [  # Если что-то не сохранилось, файлы не
+        # удаляются.
+        path for path in converted_paths if path not in result_paths and (
+            os.path.isfile(path) if index is None else index.exists(path))]
+    return [result_path for result_path in result_paths if result_path != ""], obsolete_paths
@@ -0,0 +1,50 @@
+"""
+    Построчный журнал результатов обработки файлов в формате JSON Lines, записываемый по мере
+    завершения обработки каждого файла.
+"""
+import json
+import logging
+
+from i18n import t
+
+STATUS_EXISTS = "exists"  # Файл с новым путём уже существует.
+STATUS_ERROR = "error"  # Исключение при обработке файла.
+
+
+class OutcomeLog:
+    """
+    Журнал результатов обработки файлов. Каждая строка - объект JSON с путём к исходному файлу,
+    путём к новому файлу, статусом, текстом ошибки и признаком того, что результат взят из кэша.
+    """
+
+    def __init__(self, log_path: str):
+        """
+        :param log_path: Путь к файлу журнала.
+        """
+        self.log_path = log_path
+        self.file = open(log_path, "w", encoding="utf-8",  # pylint: disable=consider-using-with
+                         buffering=1)
+
+    def write(self, source: str, status: str, target: str = "", error: str = "",
+              cached: bool = False):
+        """
+        Запись результата обработки файла.
+        :param source: Путь к исходному файлу.
+        :param status: Результат обработки файла.
+        :param target: Путь к новому файлу, если он есть.
+        :param error: Текст ошибки, если она была.
+        :param cached: Взят ли результат из кэша конвертации без открытия файла.
+        """
+        try:
+            self.file.write(json.dumps({"source": source, "target": target, "status": status,
+                                        "error": error, "cached": cached},
+                                       ensure_ascii=False) + "\n")
+        except OSError as e:
+            logging.info(t("main.outcome_log_failed"), self.log_path)
+            logging.info(e)
+
+    def close(self):
+        """
+        Закрытие файла журнала.
+        """
+        self.file.close()
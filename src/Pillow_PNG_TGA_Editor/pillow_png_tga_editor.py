@@ -6,95 +6,463 @@
 import os
 import sys
 import argparse
+import multiprocessing
 import logging
-from tkinter.filedialog import askdirectory
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import queue
+import threading
+import time
+from functools import partial
+from contextlib import nullcontext
+from typing import NamedTuple
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed
 from i18n import t
 
 import PIL.Image
-import PIL.ImageTk
 from tqdm import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "."))
 
-from general_funcs import init_app, SUPPORTED_EXTENSIONS
-from helper_funcs import resave_img
+from general_funcs import init_app, get_supported_extensions, add_headless_argument, \
+    get_input_paths, ask_directory
+from executor_funcs import BACKEND_THREAD, create_executor, iterate_completed, \
+    add_executor_arguments
+from stage_timing import RunReport, stage, count_read, add_report_arguments, create_report, \
+    STAGE_OPEN, STAGE_REMOVE
+from outcome_log import OutcomeLog, STATUS_EXISTS, STATUS_ERROR
+from staged_io import StagedExecutor, open_image, get_staged_bytes
+from directory_index import DirectoryIndex
+from helper_funcs import resave_img, ENCODE_PROFILES, ENCODE_PROFILE_MAX
+from conversion_cache import ConversionCache, get_file_hash, STATUS_UNCHANGED, STATUS_CONVERTED, \
+    STATUS_FAILED
+from content_dedup import ContentDedup, LINK_MODES
+from watch_funcs import create_watcher, parse_watch_interval, parse_debounce, Debouncer, \
+    WATCH_AUTO, WATCH_BACKENDS
 
+INDEX_QUEUE_SIZE = 1024  # Максимальное количество найденных, но ещё не обработанных файлов.
+REDUCE_CACHE_SUFFIX = "+reduce"  # Добавляется к профилю в кэше, чтобы записи без --reduce
+# не использовались с ним и наоборот.
 
-def get_convertable_files(root_path: str) -> list[str]:
+
+def get_convertable_files(root_path: str, index: DirectoryIndex | None = None) -> Iterator[str]:
     """
-    Получение списка путей к конвертируемым файлов.
+    Получение путей к конвертируемым файлам по мере обхода директории.
     :param root_path: Путь к корневой директории.
-    :return: Список путей к файлам.
+    :param index: Индекс директорий, в который добавляется содержимое каждой директории до
+        получения путей к её файлам, или None.
+    :return: Итератор путей к файлам.
+    """
+    supported_extensions = get_supported_extensions()
+    dir_paths = [os.path.abspath(root_path)]
+    while len(dir_paths) > 0:
+        dir_path = dir_paths.pop()
+        try:
+            with os.scandir(dir_path) as entries:
+                entries = list(entries)
+        except OSError:  # Директорию не удалось прочитать, как и в os.walk.
+            continue
+        if index is not None:
+            index.add_listing(dir_path, [entry.name for entry in entries])
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dir_paths.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in \
+                        supported_extensions:
+                    yield entry.path
+            except OSError:
+                continue
+
+
+def get_input_files(input_paths: list[str], index: DirectoryIndex | None = None) -> Iterator[str]:
+    """
+    Получение путей к файлам из путей к файлам и директориям без повторений.
+    :param input_paths: Список путей к файлам или директориям с файлами.
+    :param index: Индекс директорий, заполняемый при обходе директорий, или None.
+    :return: Итератор путей к файлам.
+    """
+    found_paths = set()
+    for input_path in input_paths:
+        if input_path == "":
+            continue
+        if os.path.isfile(input_path):
+            file_paths = [input_path]
+        elif os.path.isdir(input_path):
+            file_paths = get_convertable_files(input_path, index)
+        else:
+            continue
+        for file_path in file_paths:
+            key = os.path.abspath(file_path)
+            if key not in found_paths:
+                found_paths.add(key)
+                yield file_path
+
+
+def put_until_stopped(file_queue: queue.Queue, item: str | None,
+                      stop_event: threading.Event) -> bool:
+    """
+    Помещение элемента в ограниченную очередь с ожиданием свободного места.
+    :param file_queue: Очередь путей к файлам.
+    :param item: Путь к файлу или None в качестве признака окончания индексирования.
+    :param stop_event: Событие, означающее, что очередь больше не читается.
+    :return: Был ли элемент помещён в очередь.
+    """
+    while not stop_event.is_set():
+        try:
+            file_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def index_files(input_paths: list[str], file_queue: queue.Queue, stop_event: threading.Event,
+                index: DirectoryIndex | None = None, pbar: tqdm | None = None):
+    """
+    Индексирование файлов в отдельном потоке с передачей путей через очередь.
+    :param input_paths: Список путей к файлам или директориям с файлами.
+    :param file_queue: Очередь путей к файлам.
+    :param stop_event: Событие, означающее, что очередь больше не читается.
+    :param index: Индекс директорий, заполняемый при обходе директорий, или None.
+    :param pbar: Индикатор прогресса, общее количество файлов в котором увеличивается при
+        обнаружении каждого файла, или None.
+    """
+    try:
+        for file_path in get_input_files(input_paths, index):
+            if pbar is not None:
+                pbar.total += 1  # Отображается при следующем обновлении индикатора.
+            if not put_until_stopped(file_queue, file_path, stop_event):
+                return
+    finally:
+        put_until_stopped(file_queue, None, stop_event)
+
+
+def stream_input_files(input_paths: list[str], queue_size: int = INDEX_QUEUE_SIZE,
+                       index: DirectoryIndex | None = None,
+                       pbar: tqdm | None = None) -> Iterator[str]:
+    """
+    Получение путей к файлам во время индексирования, чтобы конвертация начиналась до окончания
+    обхода директорий.
+    :param input_paths: Список путей к файлам или директориям с файлами.
+    :param queue_size: Максимальное количество найденных, но ещё не обработанных путей.
+    :param index: Индекс директорий, заполняемый при обходе директорий, или None.
+    :param pbar: Индикатор прогресса, общее количество файлов в котором увеличивает поток
+        индексирования, или None.
+    :return: Итератор путей к файлам.
+    """
+    file_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    thread = threading.Thread(target=index_files, args=(input_paths, file_queue, stop_event,
+                                                        index, pbar), daemon=True)
+    thread.start()
+    try:
+        while (file_path := file_queue.get()) is not None:
+            yield file_path
+        logging.info(t("main.indexing_finish"))
+    finally:
+        stop_event.set()
+
+
+class ConvertOptions(NamedTuple):
+    """
+    Параметры конвертации, общие для всех пакетов файлов.
     """
-    file_paths = []
-    for subdir, _, files in os.walk(root_path):
-        for file in files:
-            file_path = os.path.abspath(os.path.join(subdir, file))
-            if os.path.splitext(file_path)[1].lower() not in SUPPORTED_EXTENSIONS:
+    cache: ConversionCache | None = None  # Кэш результатов конвертации или None.
+    backend: str = BACKEND_THREAD  # Тип пула: потоки или процессы.
+    jobs: int | None = None  # Количество параллельных задач или None для значения по умолчанию.
+    memory_limit: int | None = None  # Ограничение объёма пикселей выполняющихся задач в байтах.
+    profile: str = ENCODE_PROFILE_MAX  # Название профиля сохранения.
+    reduce: bool = False  # Уменьшать ли размер непрозрачных PNG без потерь.
+    prefetch_limit: int | None = None  # Ограничение объёма файлов, прочитанных заранее, в байтах
+    # или None, если файлы читаются и записываются в самих задачах.
+    report: RunReport | None = None  # Отчёт о времени этапов обработки или None.
+    outcome_log: OutcomeLog | None = None  # Журнал результатов обработки файлов или None.
+    dedup: ContentDedup | None = None  # Поиск повторяющихся файлов или None, если каждый файл
+    # конвертируется отдельно. Поиск требует окончания индексирования до начала конвертации.
+    on_result: Callable[[str, str], None] | None = None  # Функция, вызываемая с путём к файлу и
+    # путём к новому файлу после успешной конвертации, или None.
+
+
+class BatchResults:  # pylint: disable=too-many-instance-attributes
+    """
+    Учёт результатов конвертации пакета файлов в статистике, кэше, журнале и индексе директорий.
+    """
+
+    def __init__(self, options: ConvertOptions, pbar: tqdm, index: DirectoryIndex | None = None):
+        """
+        :param options: Параметры конвертации.
+        :param pbar: Индикатор прогресса.
+        :param index: Индекс директорий или None.
+        """
+        self.options = options
+        self.pbar = pbar
+        self.index = index
+        self.resave_success = 0  # Количество изображений, которые успешно конвертированы.
+        self.error_files: dict[str, None] = {}  # Файлы, которые не удалось прочитать (словарь
+        # используется как упорядоченное множество).
+        self.obsolete_files: dict[str, None] = {}  # Файлы, которые необходимо удалить
+        # (упорядоченное множество).
+        self.already_exist_files: list[str] = []  # Файлы, которые не удалось конвертировать, так
+        # как по новому пути уже существует другой файл, совпадающий по имени и расширению
+        # с конвертированным.
+        self.retry_files: list[str] = []  # Повторяющиеся файлы, основной файл которых не удалось
+        # конвертировать.
+        self.pop_removed: Callable[[str], bool] = lambda _: False  # Проверка того, был ли файл
+        # удалён сразу после записи результата при отложенной записи (см. StagedExecutor).
+
+    def filter_cached(self, file_paths: Iterable[str]) -> Iterator[str]:
+        """
+        Отбор файлов, которые изменились с прошлого запуска. Результаты для неизменённых файлов
+        берутся из кэша без открытия файлов и отмечаются в индикаторе прогресса обработанными.
+        :param file_paths: Пути к файлам.
+        :return: Итератор путей к файлам, которые нужно обработать.
+        """
+        cache, outcome_log = self.options.cache, self.options.outcome_log
+        for file_path in file_paths:
+            entry = cache.lookup(file_path, os.path.isfile if self.index is None else
+                                 self.index.exists)
+            if entry is None:
+                yield file_path
+                continue
+            if entry["status"] == STATUS_FAILED:
+                self.error_files[file_path] = None
+            elif entry["status"] == STATUS_CONVERTED:
+                self.obsolete_files[file_path] = None  # Файл был конвертирован, но не был удалён.
+            if outcome_log is not None:
+                outcome_log.write(file_path, entry["status"], entry.get("target", ""), cached=True)
+            self.pbar.update(1)
+
+    def handle_result(self, file_path: str, future: Future):
+        """
+        Учёт результата конвертации файла.
+        :param file_path: Путь к файлу.
+        :param future: Завершённая задача с результатом convert_hashed_file.
+        """
+        cache, outcome_log = self.options.cache, self.options.outcome_log
+        self.pbar.set_postfix_str(file_path)
+        try:
+            new_file_path, hashes = future.result()
+        except PIL.UnidentifiedImageError as e:
+            self.error_files[file_path] = None
+            logging.info(t("main.file_not_image"), file_path)
+            if cache is not None:
+                cache.record(file_path, STATUS_FAILED)
+            if outcome_log is not None:
+                outcome_log.write(file_path, STATUS_FAILED, error=str(e))
+        except FileExistsError as e:
+            self.already_exist_files.append(file_path)
+            logging.info(e)
+            if outcome_log is not None:
+                outcome_log.write(file_path, STATUS_EXISTS, error=str(e))
+        except OSError as e:
+            logging.info(t("main.exception"), file_path)
+            logging.info(e)
+            if outcome_log is not None:
+                outcome_log.write(file_path, STATUS_ERROR, error=str(e))
+        else:
+            if new_file_path != "":
+                self.add_converted(file_path, new_file_path, hashes)
+            elif cache is not None:
+                cache.record(file_path, STATUS_UNCHANGED, file_hash=hashes.get(file_path))
+            if outcome_log is not None:
+                outcome_log.write(file_path, STATUS_CONVERTED if new_file_path != ""
+                                  else STATUS_UNCHANGED, new_file_path)
+        finally:
+            self.pbar.update(1)
+
+    def add_converted(self, file_path: str, new_file_path: str, hashes: dict[str, str]):
+        """
+        Учёт успешно конвертированного файла.
+        :param file_path: Путь к файлу.
+        :param new_file_path: Путь к новому файлу.
+        :param hashes: Хэши исходного и нового файлов по путям к ним или пустой словарь.
+        """
+        logging.info("%s -> %s", file_path, new_file_path)
+        if self.index is not None:
+            self.index.add(new_file_path)
+        if not self.pop_removed(file_path):
+            self.obsolete_files[file_path] = None
+        elif self.index is not None:
+            self.index.discard(file_path)
+        self.obsolete_files.pop(new_file_path, None)
+        self.error_files.pop(new_file_path, None)
+        self.resave_success += 1
+        if self.options.cache is not None:
+            self.options.cache.record(file_path, STATUS_CONVERTED, new_file_path,
+                                      hashes.get(file_path))
+            self.options.cache.record(new_file_path, STATUS_UNCHANGED,
+                                      file_hash=hashes.get(new_file_path))
+        if self.options.on_result is not None:
+            self.options.on_result(file_path, new_file_path)
+
+    def handle_followers(self, file_path: str, future: Future):
+        """
+        Учёт результатов повторяющихся файлов по результату их основного файла.
+        :param file_path: Путь к основному файлу.
+        :param future: Завершённая задача основного файла.
+        """
+        dedup = self.options.dedup
+        error = future.exception()
+        for follower_path in dedup.pop_followers(file_path):
+            if error is not None and not isinstance(error, PIL.UnidentifiedImageError):
+                self.retry_files.append(follower_path)  # Ошибка могла относиться только
+                # к основному файлу (например, занятый новый путь).
                 continue
-            file_paths.append(file_path)
-    return file_paths
+            follower_future = Future()
+            if error is not None:
+                follower_future.set_exception(error)
+            else:
+                new_file_path, hashes = future.result()
+                try:
+                    target_path = dedup.materialize(new_file_path, follower_path, self.index)
+                except OSError as e:
+                    follower_future.set_exception(e)
+                else:  # Содержимое совпадает с основным файлом и его результатом.
+                    follower_future.set_result((target_path, {
+                        follower_path: hashes.get(file_path), target_path: hashes.get(new_file_path)
+                    }))
+            self.handle_result(follower_path, follower_future)
+
+    def log_statistics(self):
+        """
+        Печать статистики после прохода по файлам из директории.
+        """
+        if len(self.error_files) > 0:
+            logging.info(t("main.failed_to_open_files"))
+            for error_file in self.error_files:
+                logging.info(error_file)
+        if self.resave_success > 0:
+            logging.info(t("main.converted_files"), self.resave_success)
+        if len(self.already_exist_files) > 0:
+            logging.info(t("main.failed_to_convert_files"))
+            for already_exist_file in self.already_exist_files:
+                logging.info(already_exist_file)
+        if len(self.obsolete_files) > 0:
+            logging.info(t("main.pending_removal_files"))
+            for obsolete_file in self.obsolete_files:
+                logging.info(obsolete_file)
+        cache, dedup, index = self.options.cache, self.options.dedup, self.index
+        if cache is not None:
+            logging.info(t("main.cache_statistics"), cache.hits, cache.misses)
+        if dedup is not None:
+            logging.info(t("main.dedup_statistics"), dedup.files, dedup.bytes_saved)
+        if index is not None:
+            logging.info(t("main.index_statistics"), index.hits, index.listdirs, index.stats)
 
 
-def batch_convert_files(file_paths: list[str]) -> list[
-    str]:
+def batch_convert_files(file_paths: Iterable[str], options: ConvertOptions = ConvertOptions(),
+                        executor: Executor | None = None, index: DirectoryIndex | None = None,
+                        pbar: tqdm | None = None) -> list[str]:
     """
     Конвертация изображений в нужный формат при соблюдении условий.
-    :param file_paths: Список путей к файлам.
+    :param file_paths: Пути к файлам. Могут поступать во время индексирования.
+    :param options: Параметры конвертации.
+    :param executor: Уже созданный пул, который не закрывается после конвертации, или None, чтобы
+        создать новый. Ограничение упреждающего чтения используется, только если пул не передан.
+    :param index: Индекс директорий для проверки новых путей без обращения к диску или None. В пуле
+        процессов задачи проверяют новые пути на диске, так как индекс есть только в этом процессе.
+    :param pbar: Индикатор прогресса, общее количество файлов в котором увеличивается при их
+        обнаружении (см. stream_input_files), или None, чтобы создать индикатор по количеству
+        переданных путей. Закрывается после конвертации.
     :return: Список путей к изображениям, которые нужно удалить.
     """
-    resave_success = 0  # Количество изображений, которые успешно конвертированы.
-    error_files = []  # Файлы, которые не удалось прочитать.
-    obsolete_files = []  # Файлы, которые необходимо удалить.
-    already_exist_files = []  # Файлы, которые не удалось конвертировать, так как по новому пути
-    # уже существует другой файл, совпадающий по имени и расширению с конвертированным.
+    convert_func = partial(convert_hashed_file, profile=options.profile, reduce=options.reduce,
+                           index=index if options.backend == BACKEND_THREAD else None,
+                           use_hash=options.cache is not None and options.cache.use_hash)
+    if pbar is None:
+        file_paths = list(file_paths)
+        pbar = create_progress(len(file_paths))
+    results = BatchResults(options, pbar, index)
+    if options.cache is not None:
+        file_paths = results.filter_cached(file_paths)
     with logging_redirect_tqdm():
-        pbar = tqdm(total=len(file_paths), desc=t("main.files"))
-        with ThreadPoolExecutor() as executor:
-            future_convert_file = {executor.submit(convert_file, file_path): file_path for
-                                   file_path in file_paths}
-            for future in as_completed(future_convert_file):
-                file_path = future_convert_file[future]
-                pbar.set_postfix_str(file_path)
-                try:
-                    new_file_path = future.result()
-                except PIL.UnidentifiedImageError:
-                    error_files.append(file_path)
-                    logging.info(t("main.file_not_image"), file_path)
-                except FileExistsError as e:
-                    already_exist_files.append(file_path)
-                    logging.info(e)
-                except OSError as e:
-                    logging.info(t("main.exception"), file_path)
-                    logging.info(e)
-                else:
-                    if new_file_path != "":
-                        logging.info("%s -> %s", file_path, new_file_path)
-                        if file_path not in obsolete_files:
-                            obsolete_files.append(file_path)
-                        if new_file_path in obsolete_files:
-                            obsolete_files.remove(new_file_path)
-                        if new_file_path in error_files:
-                            error_files.remove(new_file_path)
-                        resave_success += 1
-                finally:
-                    pbar.update(1)
+        if options.dedup is not None:
+            file_paths = options.dedup.group(list(file_paths))
+            logging.info(t("main.dedup_groups"), options.dedup.groups)
+        with create_executor(options.backend, options.jobs, options.prefetch_limit,
+                             get_converted_paths) if executor is None else \
+                nullcontext(executor) as batch_executor:
+            if isinstance(batch_executor, StagedExecutor):
+                results.pop_removed = batch_executor.pop_removed
+            for file_path, future in iterate_completed(batch_executor, convert_func, file_paths,
+                                                       options.jobs, options.memory_limit,
+                                                       options.report):
+                results.handle_result(file_path, future)
+                if options.dedup is not None:
+                    results.handle_followers(file_path, future)
+            for file_path, future in iterate_completed(batch_executor, convert_func,
+                                                       results.retry_files, options.jobs,
+                                                       options.memory_limit, options.report):
+                results.handle_result(file_path, future)
         pbar.set_postfix_str("")
         pbar.close()
-    log_statistics(error_files, resave_success, already_exist_files, obsolete_files)
-    return obsolete_files
+    results.log_statistics()
+    if options.report is not None and options.dedup is not None:
+        options.report.add_section("dedup", options.dedup.to_dict())
+    if options.report is not None and index is not None:
+        options.report.add_section("index", index.to_dict())
+    return list(results.obsolete_files)
 
 
-def convert_file(file_path: str) -> str:
+def create_progress(total: int = 0) -> tqdm:
+    """
+    Создание индикатора прогресса конвертации файлов.
+    :param total: Начальное общее количество файлов.
+    :return: Индикатор прогресса.
+    """
+    return tqdm(total=total, desc=t("main.files"))
+
+
+def convert_file(file_path: str, profile: str = ENCODE_PROFILE_MAX, reduce: bool = False,
+                 index: DirectoryIndex | None = None) -> str:
     """
     Попытка открытия и конвертирования одного изображения без обработки исключений.
     :param file_path: Путь к файлу.
+    :param profile: Название профиля сохранения.
+    :param reduce: Уменьшать ли размер непрозрачных PNG без потерь.
+    :param index: Индекс директорий для проверки нового пути или None, чтобы проверять на диске.
     :return: Новый путь к файлу, если файл был удачно конвертирован или тот же, если файл был просто
         пересохранён, а иначе - пустая строка.
     """
-    return resave_img(PIL.Image.open(file_path))
+    with stage(STAGE_OPEN):
+        img_object = open_image(file_path)
+    try:
+        count_read(file_path)
+        return resave_img(img_object, profile, reduce, index)
+    finally:
+        img_object.close()  # Файл и пиксели освобождаются сразу после обработки.
+
+
+def convert_hashed_file(file_path: str, profile: str = ENCODE_PROFILE_MAX, reduce: bool = False,
+                        index: DirectoryIndex | None = None,
+                        use_hash: bool = False) -> tuple[str, dict[str, str]]:
+    """
+    Конвертирование изображения с вычислением хэшей содержимого исходного и нового файлов для кэша,
+    чтобы файлы читались в задаче, а не в основном потоке.
+    :param file_path: Путь к файлу.
+    :param profile: Название профиля сохранения.
+    :param reduce: Уменьшать ли размер непрозрачных PNG без потерь.
+    :param index: Индекс директорий для проверки нового пути или None, чтобы проверять на диске.
+    :param use_hash: Вычислять ли хэши.
+    :return: Новый путь к файлу, как в convert_file, и хэши файлов по путям к ним.
+    """
+    new_file_path = convert_file(file_path, profile, reduce, index)
+    if not use_hash:
+        return new_file_path, {}
+    return new_file_path, {fp: get_file_hash(fp, get_staged_bytes(fp)) for fp in
+                           dict.fromkeys((file_path, new_file_path)) if fp != ""}
+
+
+def get_converted_paths(file_path: str, result: tuple[str, dict[str, str]]) -> list[str]:
+    """
+    Получение пути к файлу, который нужно удалить после записи результата его конвертации.
+    :param file_path: Путь к файлу.
+    :param result: Результат convert_hashed_file: путь к новому файлу или пустая строка, если файл
+        уже в нужном формате, и хэши файлов.
+    :return: Путь к файлу, если он был сохранён по другому пути, или пустой список.
+    """
+    return [] if result[0] in ("", file_path) else [file_path]
 
 
 def batch_remove_files(file_paths: list[str]):
@@ -121,52 +489,86 @@ def remove_wrapper(file_path: str):
     os.remove(file_path)
 
 
-def log_statistics(error_files: list[str], resave_success: int,
-                   already_exist_files: list[str], obsolete_files: list[str]):
-    """
-    Печать статистики после прохода по файлам из директории.
-    :param error_files: Список с путями к файлам, к которым не удалось получить доступ.
-    :param resave_success: Количество файлов, которые были конвертированы.
-    :param already_exist_files: Список с путями к файлам, которые не удалось конвертировать, так как
-        файл с новым путём уже существует.
-    :param obsolete_files: Файлы, которые необходимо удалить после конвертации.
-    """
-    if len(error_files) > 0:
-        logging.info(t("main.failed_to_open_files"))
-        for error_file in error_files:
-            logging.info(error_file)
-    if resave_success > 0:
-        logging.info(t("main.converted_files"), resave_success)
-    if len(already_exist_files) > 0:
-        logging.info(t("main.failed_to_convert_files"))
-        for already_exist_file in already_exist_files:
-            logging.info(already_exist_file)
-    if len(obsolete_files) > 0:
-        logging.info(t("main.pending_removal_files"))
-        for obsolete_file in obsolete_files:
-            logging.info(obsolete_file)
-
-
-def execute_convert(input_paths: list[str]) -> str | int:
+def execute_convert(input_paths: list[str], options: ConvertOptions = ConvertOptions()) -> \
+        str | int:
     """
     Конвертация изображений из форматов, поддерживаемых библиотекой Pillow в форматы, читаемые
     Unreal Engine.
     :param input_paths: Список путей к файлам или директориям с файлами.
+    :param options: Параметры конвертации.
     :return: Код ошибки или строка с ошибкой.
     """
-    file_paths = []
     logging.info(t("main.indexing_start"))
-    for input_path in input_paths:
-        if input_path == "":
-            continue
-        if os.path.isfile(input_path):
-            file_paths.append(input_path)
-        elif os.path.isdir(input_path):
-            file_paths += get_convertable_files(input_path)
-    file_paths = list(dict.fromkeys(file_paths))
-    logging.info(t("main.indexing_finish"))
-    obsolete_files = batch_convert_files(file_paths)
+    index = DirectoryIndex()
+    pbar = create_progress()
+    obsolete_files = batch_convert_files(stream_input_files(input_paths, index=index, pbar=pbar),
+                                         options, index=index, pbar=pbar)
+    remove_obsolete_files(obsolete_files, options.cache, options.report)
+    return os.EX_OK
+
+
+def remove_obsolete_files(obsolete_files: list[str], cache: ConversionCache | None = None,
+                          report: RunReport | None = None):
+    """
+    Удаление сконвертированных файлов и сохранение кэша.
+    :param obsolete_files: Пути к файлам, которые нужно удалить.
+    :param cache: Кэш результатов конвертации или None, если кэш не используется.
+    :param report: Отчёт о времени этапов обработки или None, если замер не ведётся.
+    """
+    start = time.perf_counter()
     batch_remove_files(obsolete_files)
+    if report is not None:
+        report.add_stage(STAGE_REMOVE, time.perf_counter() - start, len(obsolete_files))
+    if cache is not None:
+        for obsolete_file in obsolete_files:
+            if not os.path.exists(obsolete_file):
+                cache.forget(obsolete_file)
+        cache.save()
+
+
+def execute_watch(  # pylint: disable=too-many-arguments, too-many-positional-arguments
+        input_paths: list[str], options: ConvertOptions = ConvertOptions(),
+        watch_backend: str = WATCH_AUTO, interval: float = 1.0, debounce: float = 1.0,
+        stop_event: threading.Event | None = None) -> str | int:
+    """
+    Конвертация всех изображений, а затем - новых и изменённых изображений по мере их появления,
+    пока работа не будет прервана. Пул создаётся один раз на всё время работы, а файлы, записанные
+    при конвертации, не считаются изменёнными.
+    :param input_paths: Список путей к файлам или директориям с файлами.
+    :param options: Параметры конвертации.
+    :param watch_backend: Способ отслеживания изменений.
+    :param interval: Интервал между обходами директорий в секундах при опросе.
+    :param debounce: Время без изменений в секундах, после которого файл считается записанным.
+    :param stop_event: Событие, останавливающее отслеживание, или None для остановки по Ctrl+C.
+    :return: Код ошибки или строка с ошибкой.
+    """
+    debouncer = Debouncer(debounce)
+    options = options._replace(on_result=lambda _, new_file_path: debouncer.ignore(new_file_path))
+
+    def convert_batch(file_paths: Iterable[str], index: DirectoryIndex, pbar: tqdm | None = None):
+        remove_obsolete_files(batch_convert_files(file_paths, options, executor, index, pbar),
+                              options.cache, options.report)
+
+    with create_executor(options.backend, options.jobs, options.prefetch_limit,
+                         get_converted_paths) as executor:
+        watcher = create_watcher(input_paths, watch_backend, interval)  # До первого прохода,
+        # чтобы не пропустить файлы, появившиеся во время него.
+        try:
+            logging.info(t("main.indexing_start"))
+            index = DirectoryIndex()
+            pbar = create_progress()
+            convert_batch(stream_input_files(input_paths, index=index, pbar=pbar), index, pbar)
+            logging.info(t("main.watch_start"), type(watcher).__name__)
+            while stop_event is None or not stop_event.is_set():
+                debouncer.add(watcher.wait(debouncer.next_timeout(interval)))
+                ready_files = debouncer.pop_ready()
+                if len(ready_files) > 0:
+                    convert_batch(ready_files, DirectoryIndex())  # Директории читаются
+                    # заново, так как их содержимое могло измениться.
+        except KeyboardInterrupt:
+            logging.info(t("main.watch_stop"))
+        finally:
+            watcher.close()
     return os.EX_OK
 
 
@@ -180,9 +582,54 @@ def main() -> int | str:
                                      description=t("main.pillow_png_tga_editor_desc"))
     parser.add_argument("input_paths", nargs="*", type=str, default="",
                         help=t("main.input_paths_arg"))
+    parser.add_argument("--cache", type=str, default="", help=t("main.cache_arg"))
+    parser.add_argument("--cache-hash", action="store_true", help=t("main.cache_hash_arg"))
+    parser.add_argument("--rebuild-cache", action="store_true", help=t("main.rebuild_cache_arg"))
+    parser.add_argument("--invalidate-cache", action="store_true",
+                        help=t("main.invalidate_cache_arg"))
+    parser.add_argument("--profile", choices=ENCODE_PROFILES, default=ENCODE_PROFILE_MAX,
+                        help=t("main.profile_arg"))
+    parser.add_argument("--reduce", action="store_true", help=t("main.reduce_arg"))
+    add_executor_arguments(parser)
+    add_report_arguments(parser)
+    parser.add_argument("--outcome-log", type=str, default="", help=t("main.outcome_log_arg"))
+    parser.add_argument("--dedup", choices=LINK_MODES, default=None, help=t("main.dedup_arg"))
+    parser.add_argument("--watch", action="store_true", help=t("main.watch_arg"))
+    parser.add_argument("--watch-backend", choices=WATCH_BACKENDS, default=WATCH_AUTO,
+                        help=t("main.watch_backend_arg"))
+    parser.add_argument("--watch-interval", type=parse_watch_interval, default=1.0,
+                        help=t("main.watch_interval_arg"))
+    parser.add_argument("--debounce", type=parse_debounce, default=1.0,
+                        help=t("main.debounce_arg"))
+    add_headless_argument(parser)
     args = parser.parse_args()
-    return execute_convert([askdirectory()] if len(args.input_paths) < 1 else args.input_paths)
+    input_paths = get_input_paths(parser, args.input_paths, args.headless,
+                                  lambda: [ask_directory()])
+    cache = None
+    if args.cache != "":
+        cache = ConversionCache(args.cache, args.cache_hash, args.rebuild_cache,
+                                args.profile + (REDUCE_CACHE_SUFFIX if args.reduce else ""))
+        if args.invalidate_cache:
+            cache.invalidate(input_paths)
+    report = create_report(args)
+    outcome_log = OutcomeLog(args.outcome_log) if args.outcome_log != "" else None
+    dedup = ContentDedup(args.dedup, args.jobs) if args.dedup is not None else None
+    options = ConvertOptions(cache, args.backend, args.jobs, args.memory_limit, args.profile,
+                             args.reduce, args.prefetch, report, outcome_log, dedup)
+    try:
+        if args.watch:
+            result = execute_watch(input_paths, options, args.watch_backend, args.watch_interval,
+                                   args.debounce)
+        else:
+            result = execute_convert(input_paths, options)
+    finally:
+        if outcome_log is not None:
+            outcome_log.close()
+    if report is not None:
+        report.save()
+    return result
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Пул процессов в собранном исполняемом файле.
     sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+    Скрипт, применяющий к каждому изображению цепочку операций (разделение текстуры глаз/рта,
+    отзеркаливание, конвертация в формат для Unreal Engine) с одним чтением и одним сохранением
+    каждого итогового файла.
+"""
+# pylint: disable=import-error, duplicate-code, wrong-import-position
+import os
+import sys
+import argparse
+import multiprocessing
+import logging
+from functools import partial
+
+from i18n import t
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+
+from general_funcs import init_app, add_headless_argument, get_input_paths, ask_image_files
+from executor_funcs import BACKEND_THREAD, batch_process_files, add_executor_arguments
+from stage_timing import RunReport, stage, count_read, add_report_arguments, create_report, \
+    STAGE_OPEN
+from staged_io import open_image
+from directory_index import DirectoryIndex
+from helper_funcs import run_pipeline, OPERATIONS, ENCODE_PROFILES, ENCODE_PROFILE_MAX
+from pillow_png_tga_editor import get_input_files, batch_remove_files
+
+
+def execute_pipeline(  # pylint: disable=too-many-arguments, too-many-positional-arguments
+        img_paths: list[str], operations: list[str], backend: str = BACKEND_THREAD,
+        jobs: int | None = None, memory_limit: int | None = None, profile: str = ENCODE_PROFILE_MAX,
+        report: RunReport | None = None, reduce: bool = False,
+        prefetch_limit: int | None = None) -> str | int:
+    """
+    Применение цепочки операций к изображениям и удаление файлов, сконвертированных в другой
+    формат.
+    :param img_paths: Пути к изображениям или директориям с изображениями.
+    :param operations: Названия операций в порядке применения.
+    :param backend: Тип пула: потоки или процессы.
+    :param jobs: Количество параллельных задач или None для значения по умолчанию.
+    :param memory_limit: Ограничение объёма пикселей выполняющихся задач в байтах или None.
+    :param profile: Название профиля сохранения.
+    :param report: Отчёт о времени этапов обработки или None, если замер не ведётся.
+    :param reduce: Уменьшать ли размер непрозрачных PNG без потерь при нормализации.
+    :param prefetch_limit: Ограничение объёма файлов, прочитанных заранее, в байтах или None, если
+        файлы читаются и записываются в самих задачах. При отложенной записи сконвертированные
+        файлы удаляются сразу после записи результатов.
+    :return: Код ошибки или строка с ошибкой.
+    """
+    obsolete_files = []
+    index = DirectoryIndex()
+
+    def on_result(file_path: str, result: tuple[list[str], list[str]]):
+        result_paths, obsolete_paths = result
+        for result_path in result_paths:
+            logging.info("%s -> %s", file_path, result_path)
+            index.add(result_path)
+        if prefetch_limit is None:  # Иначе файлы уже удалены при записи результатов.
+            obsolete_files.extend(obsolete_paths)
+
+    result = batch_process_files(partial(pipeline_file, operations=operations, profile=profile,
+                                         reduce=reduce,
+                                         index=index if backend == BACKEND_THREAD else None),
+                                 list(get_input_files(img_paths, index)), backend, jobs,
+                                 memory_limit, report, on_result, prefetch_limit,
+                                 get_obsolete_paths)
+    logging.info(t("main.index_statistics"), index.hits, index.listdirs, index.stats)
+    if report is not None:
+        report.add_section("index", index.to_dict())
+    if len(obsolete_files) > 0:
+        logging.info(t("main.pending_removal_files"))
+        for obsolete_file in obsolete_files:
+            logging.info(obsolete_file)
+    batch_remove_files(obsolete_files)
+    return result
+
+
+def get_obsolete_paths(file_path: str,  # pylint: disable=unused-argument
+                       result: tuple[list[str], list[str]]) -> list[str]:
+    """
+    Получение путей к файлам, которые нужно удалить после записи результатов цепочки операций.
+    :param file_path: Путь к файлу.
+    :param result: Пути к сохранённым файлам и пути к файлам, которые нужно удалить.
+    :return: Пути к файлам, которые нужно удалить.
+    """
+    return result[1]
+
+
+def pipeline_file(file_path: str, operations: list[str],
+                  profile: str = ENCODE_PROFILE_MAX,
+                  reduce: bool = False,
+                  index: DirectoryIndex | None = None) -> tuple[list[str], list[str]]:
+    """
+    Попытка открытия изображения и применения к нему цепочки операций без обработки исключений.
+    :param file_path: Путь к файлу.
+    :param operations: Названия операций в порядке применения.
+    :param profile: Название профиля сохранения.
+    :param reduce: Уменьшать ли размер непрозрачных PNG без потерь при нормализации.
+    :param index: Индекс директорий для проверки новых путей или None, чтобы проверять на диске.
+    :return: Пути к сохранённым файлам и пути к файлам, которые нужно удалить.
+    """
+    with stage(STAGE_OPEN):
+        img_object = open_image(file_path)
+    try:
+        count_read(file_path)
+        return run_pipeline(img_object, operations, profile, reduce, index)
+    finally:
+        img_object.close()  # Файл и пиксели освобождаются сразу после обработки.
+
+
+def parse_operations(value: str) -> list[str]:
+    """
+    Разбор списка операций, разделённых запятыми.
+    :param value: Названия операций через запятую.
+    :return: Названия операций в порядке применения.
+    """
+    operations = [operation.strip() for operation in value.split(",")]
+    for operation in operations:
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(t("main.ops_invalid") % (operation,
+                                                                      ", ".join(OPERATIONS)))
+    return operations
+
+
+def main() -> int | str:
+    """
+    Запуск скрипта.
+    :return: Код ошибки или строка об ошибке.
+    """
+    init_app(os.path.join("images", "Pillows_Hat_Icon.tga"))
+    parser = argparse.ArgumentParser(prog=t("main.pipeline_img_name"),
+                                     description=t("main.pipeline_img_desc"))
+    parser.add_argument("img_paths", nargs="*", default=[], help=t("main.input_paths_arg"))
+    parser.add_argument("--ops", type=parse_operations, required=True, help=t("main.ops_arg"))
+    parser.add_argument("--profile", choices=ENCODE_PROFILES, default=ENCODE_PROFILE_MAX,
+                        help=t("main.profile_arg"))
+    parser.add_argument("--reduce", action="store_true", help=t("main.reduce_arg"))
+    add_executor_arguments(parser)
+    add_report_arguments(parser)
+    add_headless_argument(parser)
+    args = parser.parse_args()
+    report = create_report(args)
+    img_paths = get_input_paths(parser, args.img_paths, args.headless, lambda: ask_image_files(
+        t("main.select_image_files"), t("main.image_files")))
+    result = execute_pipeline(img_paths, args.ops, args.backend, args.jobs, args.memory_limit,
+                              args.profile, report, args.reduce, args.prefetch)
+    if report is not None:
+        report.save()
+    return result
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Пул процессов в собранном исполняемом файле.
+    sys.exit(main())
@@ -6,59 +6,62 @@
 import os
 import sys
 import argparse
-import logging
-from tkinter.filedialog import askopenfilenames
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import multiprocessing
+from functools import partial
 
 from i18n import t
-import PIL.Image
-import PIL.ImageTk
-from tqdm import tqdm
-from tqdm.contrib.logging import logging_redirect_tqdm
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "."))
 
-from general_funcs import init_app, SUPPORTED_EXTENSIONS
-from helper_funcs import split_eyes_img
+from general_funcs import init_app, add_headless_argument, get_input_paths, ask_image_files
+from executor_funcs import BACKEND_THREAD, batch_process_files, add_executor_arguments
+from stage_timing import RunReport, stage, count_read, add_report_arguments, create_report, \
+    STAGE_OPEN
+from staged_io import open_image
+from strip_funcs import add_strip_argument
+from helper_funcs import split_eyes_img, ENCODE_PROFILES, ENCODE_PROFILE_MAX
 
 
-def execute_split_eyes_img(img_paths: list[str]) -> str | int:
+def execute_split_eyes_img(  # pylint: disable=too-many-arguments, too-many-positional-arguments
+        img_paths: list[str], backend: str = BACKEND_THREAD, jobs: int | None = None,
+        memory_limit: int | None = None, profile: str = ENCODE_PROFILE_MAX,
+        report: RunReport | None = None, prefetch_limit: int | None = None,
+        strip_height: int | None = None) -> str | int:
     """
     Разделение текстур глаз/рта на отдельные текстуры.
     :param img_paths: Пути к изображениям.
+    :param backend: Тип пула: потоки или процессы.
+    :param jobs: Количество параллельных задач или None для значения по умолчанию.
+    :param memory_limit: Ограничение объёма пикселей выполняющихся задач в байтах или None.
+    :param profile: Название профиля сохранения.
+    :param report: Отчёт о времени этапов обработки или None, если замер не ведётся.
+    :param prefetch_limit: Ограничение объёма файлов, прочитанных заранее, в байтах или None, если
+        файлы читаются и записываются в самих задачах.
+    :param strip_height: Высота полосы в строках для обработки больших изображений полосами или
+        None, чтобы обрабатывать изображения целиком.
     :return: Код ошибки или строка с ошибкой.
     """
-    if len(img_paths) < 1:
-        return os.EX_OK
-    with logging_redirect_tqdm():
-        pbar = tqdm(total=len(img_paths), desc=t("main.files"))
-        with ThreadPoolExecutor() as executor:
-            future_images = {executor.submit(split_eyes_file, img_path): img_path for img_path in
-                             img_paths}
-            for future in as_completed(future_images):
-                img_path = future_images[future]
-                pbar.set_postfix_str(img_path)
-                try:
-                    future.result()
-                except PIL.UnidentifiedImageError:
-                    logging.info(t("main.file_not_image"), img_path)
-                except OSError as e:
-                    logging.info(t("main.exception"), img_path)
-                    logging.info(e)
-                finally:
-                    pbar.update(1)
-            pbar.set_postfix_str("")
-            pbar.close()
-    return os.EX_OK
+    return batch_process_files(partial(split_eyes_file, profile=profile,
+                                       strip_height=strip_height), img_paths, backend, jobs,
+                               memory_limit, report, prefetch_limit=prefetch_limit)
 
 
-def split_eyes_file(file_path: str) -> list[str]:
+def split_eyes_file(file_path: str, profile: str = ENCODE_PROFILE_MAX,
+                    strip_height: int | None = None) -> list[str]:
     """
     Попытка открытия изображения и его разделения на 4 других.
     :param file_path: Путь к файлу.
+    :param profile: Название профиля сохранения.
+    :param strip_height: Высота полосы в строках или None, чтобы обрабатывать изображение целиком.
     :return: Пути к новым изображениям.
     """
-    return split_eyes_img(PIL.Image.open(file_path))
+    with stage(STAGE_OPEN):
+        img_object = open_image(file_path)
+    try:
+        count_read(file_path)
+        return split_eyes_img(img_object, profile, strip_height)
+    finally:
+        img_object.close()  # Файл и пиксели освобождаются сразу после обработки.
 
 
 def main() -> int | str:
@@ -70,11 +73,23 @@ def main() -> int | str:
     parser = argparse.ArgumentParser(prog=t("main.split_eyes_img_name"),
                                      description=t("main.split_eyes_img_name"))
     parser.add_argument("img_paths", nargs="*", default=[], help=t("main.image_files"))
+    parser.add_argument("--profile", choices=ENCODE_PROFILES, default=ENCODE_PROFILE_MAX,
+                        help=t("main.profile_arg"))
+    add_strip_argument(parser)
+    add_executor_arguments(parser)
+    add_report_arguments(parser)
+    add_headless_argument(parser)
     args = parser.parse_args()
-    return execute_split_eyes_img(askopenfilenames(title=t("main.select_image_files"), filetypes=[
-        (t("main.image_files"), ["*" + ext for ext in SUPPORTED_EXTENSIONS])]) if len(
-        args.img_paths) < 1 else args.img_paths)
+    report = create_report(args)
+    img_paths = get_input_paths(parser, args.img_paths, args.headless, lambda: ask_image_files(
+        t("main.select_image_files"), t("main.image_files")))
+    result = execute_split_eyes_img(img_paths, args.backend, args.jobs, args.memory_limit,
+                                    args.profile, report, args.prefetch, args.strip_height)
+    if report is not None:
+        report.save()
+    return result
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Пул процессов в собранном исполняемом файле.
     sys.exit(main())
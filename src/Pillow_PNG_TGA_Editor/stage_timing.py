@@ -0,0 +1,304 @@
+"""
+    Замер времени этапов обработки файлов и формирование отчёта о запуске в формате JSON.
+"""
+import os
+import json
+import argparse
+import heapq
+import logging
+import threading
+import time
+import platform
+from contextlib import nullcontext
+from typing import NamedTuple
+from collections.abc import Callable
+from concurrent.futures import Future
+
+from i18n import t
+
+try:
+    import resource
+except ImportError:  # Windows.
+    resource = None
+
+REPORT_VERSION = 1  # Версия формата отчёта.
+FD_DIR_PATH = "/proc/self/fd"  # Директория с открытыми дескрипторами процесса в Linux.
+STAGE_OPEN = "open"  # Открытие файла и чтение заголовка.
+STAGE_DECODE = "decode"  # Чтение пикселей.
+STAGE_TRANSPARENCY = "transparency"  # Проверка прозрачности.
+STAGE_CONVERT = "convert"  # Изменение режима изображения.
+STAGE_REDUCE = "reduce"  # Поиск палитры или оттенков серого для уменьшения размера файла.
+STAGE_TRANSFORM = "transform"  # Отзеркаливание, разделение и склейка изображений.
+STAGE_ENCODE = "encode"  # Сохранение изображения.
+STAGE_EXISTS = "exists"  # Проверка существования файла с новым путём.
+STAGE_REMOVE = "remove"  # Удаление устаревших файлов.
+STAGE_READ = "read"  # Упреждающее чтение файла в память (--prefetch).
+STAGE_WRITE = "write"  # Отложенная запись результатов и удаление устаревших файлов (--prefetch).
+NO_TIMER = nullcontext()  # Пустой контекст, используемый, если замер не ведётся.
+
+_local = threading.local()  # Запись о файле, обрабатываемом в текущем потоке.
+
+
+def get_peak_rss(who: int) -> int | None:
+    """
+    Получение пикового объёма резидентной памяти.
+    :param who: RUSAGE_SELF для текущего процесса или RUSAGE_CHILDREN для завершённых дочерних.
+    :return: Пиковый объём в байтах или None, если он недоступен.
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(who).ru_maxrss
+    return peak_rss if platform.system() == "Darwin" else peak_rss * 1024  # В Linux - в КиБ.
+
+
+def get_open_fd_count() -> int | None:
+    """
+    Получение количества открытых дескрипторов файлов текущего процесса.
+    :return: Количество дескрипторов или None, если оно недоступно.
+    """
+    try:
+        return len(os.listdir(FD_DIR_PATH)) - 1  # Без дескриптора самой директории.
+    except OSError:
+        return None
+
+
+def get_resource_usage() -> dict:
+    """
+    Получение показателей использования памяти и дескрипторов файлов.
+    :return: Пиковая память текущего процесса и завершённых дочерних процессов в байтах и
+        количество открытых дескрипторов.
+    """
+    return {"peak_rss": get_peak_rss(resource.RUSAGE_SELF) if resource is not None else None,
+            "peak_rss_children": get_peak_rss(resource.RUSAGE_CHILDREN) if resource is not None
+            else None, "open_fds": get_open_fd_count()}
+
+
+class StageTimer:
+    """
+    Контекст, добавляющий время выполнения к этапу в записи о файле.
+    """
+    __slots__ = ("stages", "name", "start")
+
+    def __init__(self, stages: dict[str, float], name: str):
+        """
+        :param stages: Время этапов в секундах по названию этапа.
+        :param name: Название этапа.
+        """
+        self.stages = stages
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *_):
+        self.stages[self.name] = self.stages.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+def stage(name: str) -> StageTimer | nullcontext:
+    """
+    Получение контекста для замера этапа обработки текущего файла.
+    :param name: Название этапа.
+    :return: Контекст замера или пустой контекст, если замер не ведётся.
+    """
+    record = getattr(_local, "record", None)
+    if record is None:
+        return NO_TIMER
+    return StageTimer(record["stages"], name)
+
+
+def count_read(file_path: str):
+    """
+    Учёт размера прочитанного файла в записи о текущем файле.
+    :param file_path: Путь к файлу.
+    """
+    record = getattr(_local, "record", None)
+    if record is not None:
+        record["bytes_read"] += os.path.getsize(file_path)
+
+
+def count_written(file_path: str):
+    """
+    Учёт размера записанного файла в записи о текущем файле.
+    :param file_path: Путь к файлу.
+    """
+    record = getattr(_local, "record", None)
+    if record is not None and file_path != "":
+        record["bytes_written"] += os.path.getsize(file_path)
+
+
+def is_recording() -> bool:
+    """
+    Проверка того, ведётся ли запись о файле, обрабатываемом в текущем потоке.
+    :return: Ведётся ли запись.
+    """
+    return getattr(_local, "record", None) is not None
+
+
+def count(name: str, value: int = 1):
+    """
+    Увеличение счётчика в записи о текущем файле.
+    :param name: Название счётчика.
+    :param value: Величина увеличения.
+    """
+    record = getattr(_local, "record", None)
+    if record is not None:
+        record["counters"][name] = record["counters"].get(name, 0) + value
+
+
+class TimedResult(NamedTuple):
+    """
+    Результат функции обработки файла, вызванной через run_timed.
+    """
+    result: object  # Результат функции или None.
+    error: Exception | None  # Исключение, возникшее при вызове функции, или None.
+    record: dict  # Запись о файле.
+
+
+def run_timed(func: Callable[[str], object], file_path: str) -> TimedResult:
+    """
+    Вызов функции обработки файла с замером этапов. Исключение возвращается, а не выбрасывается,
+    чтобы запись о файле дошла из дочернего процесса.
+    :param func: Функция, вызываемая для файла.
+    :param file_path: Путь к файлу.
+    :return: Результат функции, исключение или None и запись о файле.
+    """
+    record = {"seconds": 0.0, "stages": {}, "bytes_read": 0, "bytes_written": 0, "counters": {}}
+    _local.record = record
+    start = time.perf_counter()
+    try:
+        result, error = func(file_path), None
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        result, error = None, e
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        _local.record = None
+    return TimedResult(result, error, record)
+
+
+class RunReport:  # pylint: disable=too-many-instance-attributes
+    """
+    Сводка времени этапов, объёмов прочитанных и записанных данных и самых медленных файлов.
+    """
+
+    def __init__(self, report_path: str, slowest_count: int = 10):
+        """
+        :param report_path: Путь к файлу отчёта.
+        :param slowest_count: Количество самых медленных файлов в отчёте.
+        """
+        self.report_path = report_path
+        self.slowest_count = slowest_count
+        self.start = time.perf_counter()
+        self.files = 0
+        self.errors = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.stages: dict[str, dict[str, float]] = {}
+        self.slowest: list[tuple[float, int, dict]] = []  # Куча из самых медленных файлов.
+        self.counters: dict[str, int] = {}  # Суммы счётчиков из записей о файлах.
+        self.sections: dict[str, dict] = {}  # Дополнительные сводки по названию.
+        self.start_fds = get_open_fd_count()
+
+    def add_stage(self, name: str, seconds: float, runs: int = 1):
+        """
+        Добавление времени этапа в сводку.
+        :param name: Название этапа.
+        :param seconds: Время этапа в секундах.
+        :param runs: Количество выполнений этапа.
+        """
+        total = self.stages.setdefault(name, {"seconds": 0.0, "count": 0})
+        total["seconds"] += seconds
+        total["count"] += runs
+
+    def add_file(self, file_path: str, record: dict, error: Exception | None = None):
+        """
+        Добавление записи о файле в сводку.
+        :param file_path: Путь к файлу.
+        :param record: Запись о файле.
+        :param error: Исключение, возникшее при обработке файла, или None.
+        """
+        self.files += 1
+        self.errors += error is not None
+        self.bytes_read += record["bytes_read"]
+        self.bytes_written += record["bytes_written"]
+        for name, seconds in record["stages"].items():
+            self.add_stage(name, seconds)
+        for name, value in record["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        record = dict(record, file=file_path, error="" if error is None else str(error))
+        item = (record["seconds"], self.files, record)
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, item)
+        elif self.slowest_count > 0:
+            heapq.heappushpop(self.slowest, item)
+
+    def add_section(self, name: str, values: dict):
+        """
+        Добавление дополнительной сводки в отчёт.
+        :param name: Название сводки.
+        :param values: Значения сводки.
+        """
+        self.sections.setdefault(name, {}).update(values)
+
+    def unwrap(self, file_path: str, future: Future) -> Future:
+        """
+        Добавление записи о файле из завершённой задачи, запущенной через run_timed, и получение
+        задачи с результатом исходной функции.
+        :param file_path: Путь к файлу.
+        :param future: Завершённая задача.
+        :return: Завершённая задача с результатом или исключением исходной функции.
+        """
+        result, error, record = future.result()
+        self.add_file(file_path, record, error)
+        unwrapped = Future()
+        if error is None:
+            unwrapped.set_result(result)
+        else:
+            unwrapped.set_exception(error)
+        return unwrapped
+
+    def to_dict(self) -> dict:
+        """
+        Получение отчёта в виде словаря.
+        :return: Словарь с отчётом.
+        """
+        return {"version": REPORT_VERSION, "wall_seconds": time.perf_counter() - self.start,
+                "files": self.files, "errors": self.errors, "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written, "stages": self.stages,
+                "counters": self.counters,
+                "slowest": [record for _, _, record in sorted(self.slowest, reverse=True)],
+                "resources": dict(get_resource_usage(), start_fds=self.start_fds),
+                **self.sections}
+
+    def save(self):
+        """
+        Запись отчёта в файл.
+        """
+        data = self.to_dict()  # До открытия файла отчёта, чтобы он не попал в счётчик дескрипторов.
+        try:
+            with open(self.report_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+        except OSError as e:
+            logging.info(t("main.report_save_failed"), self.report_path)
+            logging.info(e)
+
+
+def add_report_arguments(parser: argparse.ArgumentParser):
+    """
+    Добавление аргументов отчёта о времени этапов обработки.
+    :param parser: Парсер аргументов командной строки.
+    """
+    parser.add_argument("--report", type=str, default="", help=t("main.report_arg"))
+    parser.add_argument("--report-slowest", type=int, default=10,
+                        help=t("main.report_slowest_arg"))
+
+
+def create_report(args: argparse.Namespace) -> RunReport | None:
+    """
+    Создание отчёта по аргументам командной строки.
+    :param args: Аргументы командной строки.
+    :return: Отчёт или None, если отчёт не запрошен.
+    """
+    if args.report == "":
+        return None
+    return RunReport(args.report, args.report_slowest)
@@ -0,0 +1,360 @@
+"""
+    Обработка файлов в три стадии: упреждающее чтение файлов в память в пуле потоков ввода-вывода,
+    декодирование, обработка и кодирование изображений в памяти в основном пуле и отложенная запись
+    результатов с удалением устаревших файлов сразу после обработки каждого файла.
+"""
+# pylint: disable=import-error, wrong-import-position
+import io
+import os
+import sys
+import errno
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from collections.abc import Callable
+from functools import partial
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+from i18n import t
+import PIL.Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+
+from stage_timing import TimedResult, STAGE_READ, STAGE_WRITE
+from directory_index import DirectoryIndex
+
+IO_JOBS = 4  # Количество потоков чтения и количество потоков записи.
+
+# Прочитанный в память файл, который обрабатывается в текущем контексте.
+_input: ContextVar[tuple[str, bytes] | None] = ContextVar("staged_input", default=None)
+# Закодированные в память результаты обработки текущего файла.
+_outputs: ContextVar[list[tuple[str, bytes]] | None] = ContextVar("staged_outputs", default=None)
+# Новые пути, которые не должны существовать к моменту записи результатов, и индексы директорий,
+# в которых они отмечены занятыми (None, если путь проверялся на диске).
+_claims: ContextVar[dict[str, DirectoryIndex | None] | None] = ContextVar("staged_claims",
+                                                                         default=None)
+
+
+def open_image(file_path: str) -> PIL.Image.Image:
+    """
+    Открытие изображения из прочитанных заранее байтов или, если их нет, с диска.
+    :param file_path: Путь к файлу.
+    :return: Изображение, у которого filename указывает на файл.
+    """
+    staged_input = _input.get()
+    if staged_input is None or staged_input[0] != file_path:
+        return PIL.Image.open(file_path)
+    img_object = PIL.Image.open(io.BytesIO(staged_input[1]))
+    img_object.filename = file_path
+    return img_object
+
+
+def is_capturing() -> bool:
+    """
+    Проверка того, сохраняются ли результаты в память для отложенной записи.
+    :return: Сохраняются ли результаты в память.
+    """
+    return _outputs.get() is not None
+
+
+def capture_image(img_object: PIL.Image.Image, fp: str, params: dict) -> bool:
+    """
+    Кодирование изображения в память для отложенной записи, если она ведётся.
+    :param img_object: Изображение.
+    :param fp: Путь к файлу, в который будет записан результат.
+    :param params: Параметры для PIL.Image.Image.save.
+    :return: Было ли изображение закодировано в память.
+    """
+    if _outputs.get() is None:
+        return False
+    image_format = PIL.Image.registered_extensions().get(os.path.splitext(fp)[1].lower())
+    if image_format is None:
+        return False
+    buffer = io.BytesIO()
+    img_object.save(buffer, image_format, **params)
+    return capture_bytes(fp, buffer.getvalue())
+
+
+def capture_bytes(fp: str, data: bytes) -> bool:
+    """
+    Сохранение уже закодированного файла в память для отложенной записи, если она ведётся.
+    :param fp: Путь к файлу, в который будет записан результат.
+    :param data: Содержимое файла.
+    :return: Был ли файл сохранён в память.
+    """
+    outputs = _outputs.get()
+    if outputs is None:
+        return False
+    outputs.append((fp, data))
+    return True
+
+
+def get_staged_bytes(file_path: str) -> bytes | None:
+    """
+    Получение содержимого файла из памяти: результата, ожидающего отложенной записи, или файла,
+    прочитанного заранее.
+    :param file_path: Путь к файлу.
+    :return: Содержимое файла или None, если его нужно читать с диска.
+    """
+    for fp, data in reversed(_outputs.get() or []):
+        if fp == file_path:
+            return data
+    staged_input = _input.get()
+    if staged_input is not None and staged_input[0] == file_path:
+        return staged_input[1]
+    return None
+
+
+def claim_path(file_path: str, index: DirectoryIndex | None = None):
+    """
+    Отметка нового пути, который проверен на отсутствие файла и должен оставаться свободным до
+    отложенной записи результата.
+    :param file_path: Путь к файлу.
+    :param index: Индекс директорий, в котором путь уже отмечен занятым, или None, если путь
+        проверялся на диске и перед записью проверяется повторно.
+    """
+    claims = _claims.get()
+    if claims is not None:
+        claims[file_path] = index
+
+
+def run_staged(func: Callable[[str], object], file_path: str, data: bytes | None) -> tuple[
+        object, list[tuple[str, bytes]], list[tuple[str, DirectoryIndex | None]]]:
+    """
+    Вызов функции обработки файла с чтением из памяти и сохранением результатов в память.
+    :param func: Функция, вызываемая для файла.
+    :param file_path: Путь к файлу.
+    :param data: Содержимое файла или None, если файл не удалось прочитать заранее.
+    :return: Результат функции, пути и содержимое результатов и новые пути, которые должны
+        оставаться свободными, с индексами, в которых они отмечены занятыми.
+    """
+    tokens = (_input.set(None if data is None else (file_path, data)), _outputs.set([]),
+              _claims.set({}))
+    try:
+        return func(file_path), _outputs.get(), sorted(_claims.get().items(),
+                                                       key=lambda claim: claim[0])
+    finally:
+        for var, token in zip((_input, _outputs, _claims), tokens):
+            var.reset(token)
+
+
+class StagedExecutor:  # pylint: disable=too-many-instance-attributes
+    """
+    Пул, разделяющий обработку файла на стадии. Файлы читаются заранее в пределах ограничения
+    объёма, обработка в основном пуле идёт в памяти, а результаты записываются в пуле записи, после
+    чего сразу удаляются устаревшие файлы. Задача завершается после записи результатов.
+    """
+
+    def __init__(self, executor: Executor, prefetch_limit: int, io_jobs: int = IO_JOBS,
+                 get_removals: Callable[[str, object], list[str]] | None = None):
+        """
+        :param executor: Пул потоков или процессов для обработки.
+        :param prefetch_limit: Ограничение объёма прочитанных и ещё не обработанных файлов в байтах.
+            Файл больше ограничения читается, только когда других прочитанных файлов нет.
+        :param io_jobs: Количество потоков чтения и количество потоков записи.
+        :param get_removals: Функция, получающая по пути к файлу и результату обработки пути к
+            файлам, которые нужно удалить после записи результатов, или None.
+        """
+        self.executor = executor
+        self.prefetch_limit = prefetch_limit
+        self.get_removals = get_removals
+        self.read_executor = ThreadPoolExecutor(max_workers=io_jobs)
+        self.write_executor = ThreadPoolExecutor(max_workers=io_jobs)
+        self.prefetched = 0  # Объём прочитанных и ещё не обработанных файлов.
+        self.prefetch_condition = threading.Condition()
+        self.claimed: set[str] = set()  # Новые пути результатов, которые сейчас записываются.
+        self.claim_lock = threading.Lock()
+        self.removed: set[str] = set()  # Удалённые устаревшие файлы, которые ещё не учтены.
+        self.removed_lock = threading.Lock()
+
+    def __enter__(self) -> "StagedExecutor":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def shutdown(self, wait: bool = True):
+        """
+        Завершение работы всех пулов.
+        :param wait: Ждать ли завершения отправленных задач.
+        """
+        self.read_executor.shutdown(wait)
+        self.executor.shutdown(wait)
+        self.write_executor.shutdown(wait)
+
+    def submit(self, func: Callable[[str], object], file_path: str) -> Future:
+        """
+        Отправка файла на чтение, обработку и запись результатов.
+        :param func: Функция, вызываемая для файла, или run_timed с ней.
+        :param file_path: Путь к файлу.
+        :return: Задача, завершающаяся после записи результатов.
+        """
+        future = Future()
+        self.read_executor.submit(self.read, file_path).add_done_callback(
+            partial(self.on_read, future, func, file_path))
+        return future
+
+    def read(self, file_path: str) -> tuple[bytes | None, int, float]:
+        """
+        Чтение файла в память после освобождения места в ограничении объёма.
+        :param file_path: Путь к файлу.
+        :return: Содержимое файла или None, если его не удалось прочитать, занятый объём и время
+            чтения в секундах.
+        """
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return None, 0, 0.0  # Ошибка будет получена при обработке.
+        with self.prefetch_condition:
+            self.prefetch_condition.wait_for(
+                lambda: self.prefetched < 1 or self.prefetched + size <= self.prefetch_limit)
+            self.prefetched += size
+        start = time.perf_counter()
+        try:
+            with open(file_path, "rb") as f:
+                return f.read(), size, time.perf_counter() - start
+        except OSError:
+            self.release(size)
+            return None, 0, 0.0
+
+    def release(self, size: int):
+        """
+        Освобождение места в ограничении объёма прочитанных файлов.
+        :param size: Освобождаемый объём.
+        """
+        with self.prefetch_condition:
+            self.prefetched -= size
+            self.prefetch_condition.notify_all()
+
+    def on_read(self, future: Future, func: Callable[[str], object], file_path: str,
+                read_future: Future):
+        """
+        Отправка прочитанного файла на обработку.
+        :param future: Задача, возвращённая из submit.
+        :param func: Функция, вызываемая для файла.
+        :param file_path: Путь к файлу.
+        :param read_future: Завершённая задача чтения.
+        """
+        try:
+            data, size, read_seconds = read_future.result()
+            self.executor.submit(run_staged, func, file_path, data).add_done_callback(
+                partial(self.on_processed, future, file_path, size, read_seconds))
+        except BaseException as e:  # pylint: disable=broad-exception-caught
+            future.set_exception(e)
+
+    def on_processed(self, future: Future, file_path: str, size: int, read_seconds: float,
+                     process_future: Future):
+        """
+        Отправка результатов обработки на запись.
+        :param future: Задача, возвращённая из submit.
+        :param file_path: Путь к файлу.
+        :param size: Объём, занятый прочитанным файлом.
+        :param read_seconds: Время чтения файла в секундах.
+        :param process_future: Завершённая задача обработки.
+        """
+        self.release(size)
+        try:
+            result, outputs, claims = process_future.result()
+            if isinstance(result, TimedResult):
+                stages = result.record["stages"]
+                stages[STAGE_READ] = stages.get(STAGE_READ, 0.0) + read_seconds
+            self.write_executor.submit(self.write, future, file_path, result, outputs, claims)
+        except BaseException as e:  # pylint: disable=broad-exception-caught
+            future.set_exception(e)
+
+    def write(self, future: Future, file_path: str, result: object,
+              outputs: list[tuple[str, bytes]], claims: list[tuple[str, DirectoryIndex | None]]):
+        """
+        Запись результатов обработки и удаление устаревших файлов. Если результат записать не
+        удалось, файлы не удаляются, а задача завершается с ошибкой.
+        :param future: Задача, возвращённая из submit.
+        :param file_path: Путь к файлу.
+        :param result: Результат функции или результат run_timed.
+        :param outputs: Пути и содержимое результатов.
+        :param claims: Новые пути, которые должны оставаться свободными, и индексы, в которых они
+            отмечены занятыми.
+        """
+        timed = result if isinstance(result, TimedResult) else None
+        if timed is not None and timed.error is not None:
+            future.set_result(result)
+            return
+        start = time.perf_counter()
+        try:
+            self.write_outputs(outputs, claims)
+            if self.get_removals is not None:
+                self.remove_files(self.get_removals(
+                    file_path, result if timed is None else timed.result))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            if timed is None:
+                future.set_exception(e)
+                return
+            timed = timed._replace(result=None, error=e)
+        if timed is not None:
+            stages = timed.record["stages"]
+            stages[STAGE_WRITE] = stages.get(STAGE_WRITE, 0.0) + time.perf_counter() - start
+            timed.record["bytes_written"] = 0 if timed.error is not None else sum(
+                len(data) for _, data in outputs)
+            result = timed
+        future.set_result(result)
+
+    def write_outputs(self, outputs: list[tuple[str, bytes]],
+                      claims: list[tuple[str, DirectoryIndex | None]]):
+        """
+        Запись результатов на диск. Пути, отмеченные занятыми в индексе директорий, уже не может
+        занять другой файл этого процесса, поэтому повторно проверяются на диске только пути,
+        проверенные без индекса (в пуле процессов). Если записать результаты не удалось, отметки в
+        индексе с незаписанных путей снимаются.
+        :param outputs: Пути и содержимое результатов.
+        :param claims: Новые пути, которые должны оставаться свободными, и индексы, в которых они
+            отмечены занятыми.
+        """
+        disk_claims = [claim for claim, index in claims if index is None]
+        written = set()
+        try:
+            with self.claim_lock:
+                for claim in disk_claims:
+                    if claim in self.claimed or os.path.exists(claim):
+                        raise FileExistsError(errno.EEXIST, t("main.file_already_exists") % claim)
+                self.claimed.update(disk_claims)
+            try:
+                for fp, data in outputs:
+                    with open(fp, "wb") as f:
+                        f.write(data)
+                    written.add(fp)
+            finally:
+                with self.claim_lock:
+                    self.claimed.difference_update(disk_claims)
+        except BaseException:
+            for claim, index in claims:
+                if index is not None and claim not in written:
+                    index.discard(claim)
+            raise
+
+    def pop_removed(self, file_path: str) -> bool:
+        """
+        Проверка того, был ли устаревший файл удалён после записи результатов, с удалением отметки,
+        чтобы она не влияла на следующие пакеты файлов в том же пуле.
+        :param file_path: Путь к файлу.
+        :return: Был ли файл удалён.
+        """
+        with self.removed_lock:
+            if file_path not in self.removed:
+                return False
+            self.removed.remove(file_path)
+            return True
+
+    def remove_files(self, file_paths: list[str]):
+        """
+        Удаление устаревших файлов с выводом ошибок.
+        :param file_paths: Пути к файлам.
+        """
+        for file_path in file_paths:
+            try:
+                os.remove(file_path)
+            except OSError as e:
+                logging.info(t("main.exception_remove"), file_path)
+                logging.info(e)
+            else:
+                with self.removed_lock:
+                    self.removed.add(file_path)
@@ -0,0 +1,259 @@
+"""
+    Обработка больших изображений TGA полосами строк. Полоса исходного изображения читается из файла
+    и декодируется отдельно, а результат кодируется и дописывается в файл полосу за полосой, поэтому
+    пиксели всего изображения никогда не находятся в памяти одновременно. Полосы декодируются и
+    кодируются теми же кодеками Pillow, что и при обработке целиком, а кодировщик RLE сжимает каждую
+    строку отдельно, поэтому результат побайтно совпадает с сохранением изображения целиком.
+"""
+# pylint: disable=import-error, wrong-import-position
+import io
+import os
+import sys
+import errno
+import shutil
+import struct
+import argparse
+import threading
+from collections.abc import Iterator
+
+from i18n import t
+import PIL.Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+
+from staged_io import capture_bytes, is_capturing
+
+TGA_STRIP_MODES = {  # Режимы, которые обрабатываются полосами, и их формат пикселей, глубина и тип
+    # изображения в файле, как при сохранении в PIL.TgaImagePlugin.
+    "L": ("L", 8, 3), "LA": ("LA", 16, 3), "RGB": ("BGR", 24, 2), "RGBA": ("BGRA", 32, 2)
+}
+TGA_FOOTER = b"\0" * 8 + b"TRUEVISION-XFILE.\0"  # Окончание файла TGA 2.0.
+TGA_FLIP_HORIZONTALLY = 0x10  # Флаг строк, записанных справа налево.
+TGA_RLE_FLAG = 0x80  # Флаг пакета RLE из одного повторяющегося пикселя.
+TGA_RLE_MAX_PACKET = 1 + 128 * 4  # Наибольший размер пакета RLE в байтах.
+READ_SIZE = 1 << 20  # Размер порции чтения сжатых строк в байтах.
+
+
+def get_strips(height: int, strip_height: int) -> Iterator[tuple[int, int]]:
+    """
+    Получение границ полос строк изображения снизу вверх, в порядке строк в файле TGA.
+    :param height: Высота изображения.
+    :param strip_height: Высота полосы в строках.
+    :return: Итератор пар из первой строки полосы и строки после её последней строки.
+    """
+    for y1 in range(height, 0, -strip_height):
+        yield max(0, y1 - strip_height), y1
+
+
+def can_process_strips(img_object: PIL.Image.Image, ext: str) -> bool:
+    """
+    Проверка того, можно ли обработать изображение полосами: это несжатое или сжатое RLE
+    изображение TGA в поддерживаемом режиме, а результат сохраняется в TGA. Строки, сжатые RLE,
+    читаются только подряд, поэтому они должны быть записаны снизу вверх, как результат.
+    :param img_object: Открытое изображение, пиксели которого ещё не прочитаны.
+    :param ext: Расширение файла результата с точкой.
+    :return: Можно ли обработать изображение полосами.
+    """
+    if PIL.Image.registered_extensions().get(ext.lower()) != "TGA" or \
+            img_object.format != "TGA" or img_object.mode not in TGA_STRIP_MODES or \
+            getattr(img_object, "fp", None) is None:
+        return False
+    tile = getattr(img_object, "tile", [])
+    if len(tile) != 1 or tile[0][0] not in ("raw", "tga_rle"):
+        return False
+    return tile[0][0] == "raw" or img_object.info.get("orientation") != 1
+
+
+class TgaStripReader:  # pylint: disable=too-many-instance-attributes
+    """
+    Чтение пикселей открытого изображения TGA полосами строк снизу вверх. Пакеты RLE без повтора,
+    которые переходят через границу полосы, делятся на два пакета с теми же пикселями.
+    """
+
+    def __init__(self, img_object: PIL.Image.Image):
+        """
+        :param img_object: Открытое изображение, для которого can_process_strips возвращает True.
+            Файл изображения читается напрямую и закрывается вместе с изображением.
+        """
+        self.mode = img_object.mode
+        self.size = img_object.size
+        self.file = img_object.fp
+        self.filename = getattr(img_object, "filename", "")
+        self.codec, _, self.offset, self.args = img_object.tile[0]
+        self.file.seek(16)
+        depth, flags = self.file.read(2)
+        self.pixel_size = (depth + 7) // 8
+        self.top_down = img_object.info.get("orientation") == 1
+        self.flip = flags & TGA_FLIP_HORIZONTALLY != 0
+        self.opaque = self.mode == "RGBA" and self.has_no_alpha()
+        self.next_row = self.size[1]  # Строка после следующей полосы.
+        self.buffer = bytearray()  # Прочитанные, но ещё не декодированные пакеты RLE.
+        self.pos = 0
+        self.file.seek(self.offset)
+
+    def has_no_alpha(self) -> bool:
+        """
+        Проверка того, что в области расширения TGA 2.0 альфа-канал отмечен отсутствующим. Тогда
+        Pillow делает все пиксели непрозрачными.
+        :return: Отмечен ли альфа-канал отсутствующим.
+        """
+        self.file.seek(-len(TGA_FOOTER), os.SEEK_END)
+        footer = self.file.read(len(TGA_FOOTER))
+        if not footer.endswith(TGA_FOOTER[8:]):
+            return False
+        extension_offset = int.from_bytes(footer[:4], "little")
+        if extension_offset == 0:
+            return False
+        self.file.seek(extension_offset + 494)
+        return self.file.read(1) == b"\0"
+
+    def read(self, y0: int, y1: int) -> PIL.Image.Image:
+        """
+        Чтение и декодирование полосы строк. Полосы читаются подряд снизу вверх.
+        :param y0: Первая строка полосы.
+        :param y1: Строка после последней строки полосы.
+        :return: Полоса, пиксели которой совпадают с той же полосой изображения, прочитанного
+            целиком.
+        """
+        if y1 != self.next_row:
+            raise ValueError("strips must be read bottom-up")
+        self.next_row = y0
+        width, height = self.size
+        if self.codec == "raw":
+            self.file.seek(self.offset + (y0 if self.top_down else height - y1) * width *
+                           self.pixel_size)
+            data = self.file.read((y1 - y0) * width * self.pixel_size)
+        else:
+            data = self.read_packets((y1 - y0) * width)
+        try:
+            img_strip = PIL.Image.frombytes(self.mode, (width, y1 - y0), bytes(data), self.codec,
+                                            *self.args)
+        except ValueError as e:
+            raise OSError(errno.EIO, t("main.img_damaged") % self.filename) from e
+        if self.opaque:
+            img_strip.putalpha(255)
+        if self.flip:
+            img_strip = img_strip.transpose(PIL.Image.Transpose.FLIP_LEFT_RIGHT)
+        return img_strip
+
+    def read_packets(self, pixels: int) -> bytearray:
+        """
+        Чтение пакетов RLE, содержащих заданное количество пикселей. Последний пакет без повтора при
+        необходимости делится, а его остаток остаётся в буфере для следующей полосы.
+        :param pixels: Количество пикселей.
+        :return: Пакеты RLE.
+        """
+        data = bytearray()
+        start = self.pos
+        while pixels > 0:
+            if len(self.buffer) - self.pos < TGA_RLE_MAX_PACKET:
+                data += self.buffer[start:self.pos]
+                self.buffer = self.buffer[self.pos:] + self.file.read(READ_SIZE)
+                self.pos = start = 0
+            if self.pos >= len(self.buffer):
+                break  # Файл закончился, ошибку выдаст декодер.
+            header = self.buffer[self.pos]
+            count = (header & ~TGA_RLE_FLAG) + 1
+            if count > pixels:  # Пакет переходит в следующую полосу.
+                if header & TGA_RLE_FLAG:  # Как и в Pillow, повтор не переходит на другую строку.
+                    raise OSError(errno.EIO, t("main.img_damaged") % self.filename)
+                if self.pos + pixels * self.pixel_size >= len(self.buffer):
+                    break  # Файл закончился, ошибку выдаст декодер.
+                data += self.buffer[start:self.pos]
+                data.append(pixels - 1)
+                data += self.buffer[self.pos + 1:self.pos + 1 + pixels * self.pixel_size]
+                self.pos += pixels * self.pixel_size  # Заголовок остатка заменяет последний
+                # прочитанный байт.
+                self.buffer[self.pos] = count - pixels - 1
+                start = self.pos
+                break
+            self.pos += 1 + (self.pixel_size if header & TGA_RLE_FLAG else
+                             count * self.pixel_size)
+            pixels -= count
+        data += self.buffer[start:self.pos]
+        return data
+
+
+class TgaStripWriter:
+    """
+    Запись изображения TGA полосами строк снизу вверх. Заголовок, пиксели и окончание файла
+    совпадают с результатом PIL.Image.Image.save для изображения целиком. Файл записывается во
+    временный файл рядом с результатом и заменяет результат только после записи всех полос, а при
+    отложенной записи - в память.
+    """
+
+    def __init__(self, file_path: str, mode: str, size: tuple[int, int], params: dict):
+        """
+        :param file_path: Путь к файлу результата.
+        :param mode: Режим изображения из TGA_STRIP_MODES.
+        :param size: Ширина и высота изображения.
+        :param params: Параметры сохранения для PIL.Image.Image.save.
+        """
+        rawmode, bits, imagetype = TGA_STRIP_MODES[mode]
+        rle = params["rle"] if "rle" in params else params.get("compression") == "tga_rle"
+        self.codec, self.args = ("tga_rle", (rawmode, -1)) if rle else ("raw", (rawmode, 0, -1))
+        self.file_path = file_path
+        self.temp_path = None if is_capturing() else \
+            f"{file_path}.{threading.get_native_id()}.tmp"
+        self.file = io.BytesIO() if self.temp_path is None else \
+            open(self.temp_path, "wb")  # pylint: disable=consider-using-with
+        self.file.write(struct.pack("<3B2HB4H2B", 0, 0, imagetype + (8 if rle else 0), 0, 0, 0,
+                                    0, 0, size[0], size[1], bits,
+                                    8 if mode in ("LA", "RGBA") else 0))
+
+    def write(self, img_strip: PIL.Image.Image):
+        """
+        Кодирование и запись следующей полосы строк (полосы записываются снизу вверх).
+        :param img_strip: Полоса.
+        """
+        self.file.write(img_strip.tobytes(self.codec, *self.args))
+
+    def __enter__(self) -> "TgaStripWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Завершение записи: при успехе файл дописывается и заменяет результат, а при исключении
+        временный файл удаляется.
+        """
+        if exc_type is not None:
+            self.file.close()
+            if self.temp_path is not None:
+                os.remove(self.temp_path)
+            return
+        self.file.write(TGA_FOOTER)
+        if self.temp_path is None:
+            capture_bytes(self.file_path, self.file.getvalue())
+            return
+        self.file.close()
+        try:
+            if os.path.exists(self.file_path):  # Как при перезаписи файла на месте.
+                shutil.copymode(self.file_path, self.temp_path)
+            os.replace(self.temp_path, self.file_path)
+        except OSError:
+            os.remove(self.temp_path)
+            raise
+
+
+def parse_strip_height(value: str) -> int:
+    """
+    Проверка высоты полосы.
+    :param value: Высота полосы в строках.
+    :return: Высота полосы в строках.
+    """
+    try:
+        strip_height = int(value)
+    except ValueError:
+        strip_height = 0
+    if strip_height < 1:
+        raise argparse.ArgumentTypeError(t("main.strip_height_invalid") % value)
+    return strip_height
+
+
+def add_strip_argument(parser: argparse.ArgumentParser):
+    """
+    Добавление аргумента обработки изображений полосами.
+    :param parser: Парсер аргументов командной строки.
+    """
+    parser.add_argument("--strip-height", type=parse_strip_height, default=None,
+                        help=t("main.strip_height_arg"))
@@ -0,0 +1,396 @@
+"""
+    Отслеживание появления и изменения файлов в директориях опросом или через inotify (Linux) с
+    ожиданием окончания записи файлов.
+"""
+# pylint: disable=import-error, wrong-import-position
+import os
+import sys
+import math
+import time
+import errno
+import select
+import struct
+import argparse
+from collections.abc import Callable
+
+from i18n import t
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "."))
+
+from general_funcs import get_supported_extensions
+
+WATCH_AUTO = "auto"  # inotify, если доступен, иначе опрос.
+WATCH_POLL = "poll"  # Периодический обход директорий.
+WATCH_INOTIFY = "inotify"  # События файловой системы Linux.
+WATCH_BACKENDS = (WATCH_AUTO, WATCH_POLL, WATCH_INOTIFY)
+IN_CLOSE_WRITE = 0x00000008  # Файл, открытый на запись, закрыт.
+IN_MOVED_TO = 0x00000080  # Файл перемещён в директорию.
+IN_CREATE = 0x00000100  # Файл или директория созданы.
+IN_Q_OVERFLOW = 0x00004000  # Очередь событий переполнена, часть событий потеряна.
+IN_IGNORED = 0x00008000  # Наблюдение за директорией снято.
+IN_ISDIR = 0x40000000  # Событие относится к директории.
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len из struct inotify_event.
+MAX_WAIT_SECONDS = 24 * 60 * 60  # Наибольший интервал опроса и время ожидания окончания записи.
+
+
+def get_signature(file_path: str) -> tuple[int, int] | None:
+    """
+    Получение размера и времени изменения файла.
+    :param file_path: Путь к файлу.
+    :return: Размер и время изменения в наносекундах или None, если файла нет.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class PathFilter:
+    """
+    Отбор путей, относящихся к отслеживаемым файлам и директориям и имеющих поддерживаемое
+    расширение.
+    """
+
+    def __init__(self, input_paths: list[str]):
+        """
+        :param input_paths: Пути к отслеживаемым файлам и директориям.
+        """
+        self.dir_paths = [os.path.abspath(path) for path in input_paths if os.path.isdir(path)]
+        self.file_paths = {os.path.abspath(path) for path in input_paths if os.path.isfile(path)}
+        self.supported_extensions = get_supported_extensions()
+
+    def watched_dirs(self) -> list[str]:
+        """
+        Получение директорий, в которых нужно отслеживать события.
+        :return: Пути к директориям.
+        """
+        return self.dir_paths + sorted({os.path.dirname(path) for path in self.file_paths})
+
+    def __call__(self, file_path: str) -> bool:
+        """
+        Проверка пути.
+        :param file_path: Абсолютный путь к файлу.
+        :return: Относится ли файл к отслеживаемым.
+        """
+        if os.path.splitext(file_path)[1].lower() not in self.supported_extensions:
+            return False
+        return file_path in self.file_paths or any(
+            file_path.startswith(os.path.join(dir_path, "")) for dir_path in self.dir_paths)
+
+
+def scan_files(dir_path: str, path_filter: Callable[[str], bool]) -> dict[str, tuple[int, int]]:
+    """
+    Обход директории с получением размера и времени изменения подходящих файлов.
+    :param dir_path: Путь к директории.
+    :param path_filter: Функция отбора путей.
+    :return: Размер и время изменения по пути к файлу.
+    """
+    signatures = {}
+    dir_paths = [dir_path]
+    while len(dir_paths) > 0:
+        try:
+            with os.scandir(dir_paths.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            dir_paths.append(entry.path)
+                        elif entry.is_file() and path_filter(entry.path):
+                            stat = entry.stat()
+                            signatures[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return signatures
+
+
+class PollingWatcher:
+    """
+    Поиск новых и изменённых файлов сравнением размера и времени изменения при каждом обходе.
+    """
+
+    def __init__(self, input_paths: list[str], interval: float = 1.0):
+        """
+        :param input_paths: Пути к отслеживаемым файлам и директориям.
+        :param interval: Интервал между обходами в секундах.
+        """
+        self.path_filter = PathFilter(input_paths)
+        self.interval = interval
+        self.signatures = self.scan()
+
+    def scan(self) -> dict[str, tuple[int, int]]:
+        """
+        Обход всех отслеживаемых файлов и директорий.
+        :return: Размер и время изменения по пути к файлу.
+        """
+        signatures = {}
+        for dir_path in self.path_filter.dir_paths:
+            signatures.update(scan_files(dir_path, self.path_filter))
+        for file_path in self.path_filter.file_paths:
+            signature = get_signature(file_path)
+            if signature is not None:
+                signatures[file_path] = signature
+        return signatures
+
+    def wait(self, timeout: float) -> set[str]:
+        """
+        Ожидание следующего обхода и получение изменившихся файлов.
+        :param timeout: Максимальное время ожидания в секундах.
+        :return: Пути к новым и изменённым файлам.
+        """
+        time.sleep(min(timeout, self.interval))
+        signatures = self.scan()
+        changed = {file_path for file_path, signature in signatures.items() if
+                   self.signatures.get(file_path) != signature}
+        self.signatures = signatures
+        return changed
+
+    def close(self):
+        """
+        Прекращение отслеживания.
+        """
+
+
+class InotifyWatcher:
+    """
+    Получение новых и изменённых файлов из событий inotify с наблюдением за всеми вложенными
+    директориями.
+    """
+
+    def __init__(self, input_paths: list[str]):
+        """
+        :param input_paths: Пути к отслеживаемым файлам и директориям.
+        """
+        import ctypes.util  # pylint: disable=import-outside-toplevel
+        # ctypes загружается только для inotify, чтобы не замедлять запуск инструментов.
+        library_path = ctypes.util.find_library("c")
+        self.libc = ctypes.CDLL(library_path, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.path_filter = PathFilter(input_paths)
+        self.watch_dirs: dict[int, str] = {}  # Директория по номеру наблюдения.
+        for dir_path in self.path_filter.dir_paths:
+            self.add_tree(dir_path)
+        for dir_path in self.path_filter.watched_dirs()[len(self.path_filter.dir_paths):]:
+            self.add_dir(dir_path)
+
+    def add_dir(self, dir_path: str):
+        """
+        Добавление наблюдения за директорией.
+        :param dir_path: Путь к директории.
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd >= 0:
+            self.watch_dirs[wd] = dir_path
+
+    def add_tree(self, dir_path: str) -> set[str]:
+        """
+        Добавление наблюдения за директорией и всеми вложенными директориями.
+        :param dir_path: Путь к директории.
+        :return: Пути к подходящим файлам, уже находящимся в директориях.
+        """
+        file_paths = set()
+        dir_paths = [dir_path]
+        while len(dir_paths) > 0:
+            current_path = dir_paths.pop()
+            self.add_dir(current_path)  # До обхода, чтобы не пропустить новые файлы.
+            try:
+                with os.scandir(current_path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                dir_paths.append(entry.path)
+                            elif entry.is_file() and self.path_filter(entry.path):
+                                file_paths.add(entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return file_paths
+
+    def rescan(self) -> set[str]:
+        """
+        Повторный обход всех директорий после потери событий.
+        :return: Пути ко всем подходящим файлам.
+        """
+        file_paths = set()
+        for dir_path in self.path_filter.dir_paths:
+            file_paths.update(self.add_tree(dir_path))
+        file_paths.update(path for path in self.path_filter.file_paths if os.path.isfile(path))
+        return file_paths
+
+    def wait(self, timeout: float) -> set[str]:
+        """
+        Ожидание событий и получение изменившихся файлов.
+        :param timeout: Максимальное время ожидания в секундах.
+        :return: Пути к новым и изменённым файлам.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        changed = set()
+        if len(readable) < 1:
+            return changed
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size +
+                                    length].rstrip(b"\0"))
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                changed.update(self.rescan())
+                continue
+            if mask & IN_IGNORED:
+                self.watch_dirs.pop(wd, None)
+                continue
+            dir_path = self.watch_dirs.get(wd)
+            if dir_path is None or name == "":
+                continue
+            path = os.path.join(dir_path, name)
+            if mask & IN_ISDIR:
+                if any(path.startswith(os.path.join(root, "")) for root in
+                       self.path_filter.dir_paths):
+                    changed.update(self.add_tree(path))
+            elif self.path_filter(path):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        """
+        Прекращение отслеживания.
+        """
+        os.close(self.fd)
+
+
+def create_watcher(input_paths: list[str], backend: str = WATCH_AUTO,
+                   interval: float = 1.0) -> PollingWatcher | InotifyWatcher:
+    """
+    Создание средства отслеживания файлов.
+    :param input_paths: Пути к отслеживаемым файлам и директориям.
+    :param backend: Способ отслеживания.
+    :param interval: Интервал между обходами в секундах для опроса.
+    :return: Средство отслеживания.
+    """
+    if backend != WATCH_POLL and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(input_paths)
+        except OSError:
+            if backend == WATCH_INOTIFY:
+                raise
+    elif backend == WATCH_INOTIFY:
+        raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+    return PollingWatcher(input_paths, interval)
+
+
+class Debouncer:
+    """
+    Ожидание окончания записи файлов: файл считается готовым, если его размер и время изменения
+    не менялись в течение заданного времени. Файлы, записанные самой программой, пропускаются,
+    пока их не изменят.
+    """
+
+    def __init__(self, delay: float = 1.0):
+        """
+        :param delay: Время без изменений в секундах, после которого файл считается записанным.
+        """
+        self.delay = delay
+        self.pending: dict[str, tuple[tuple[int, int], float]] = {}  # Размер, время изменения и
+        # момент последнего изменения по пути к файлу.
+        self.own_files: dict[str, tuple[int, int]] = {}  # Файлы, записанные программой.
+
+    def add(self, file_paths: set[str]):
+        """
+        Добавление изменившихся файлов.
+        :param file_paths: Пути к файлам.
+        """
+        now = time.monotonic()
+        for file_path in file_paths:
+            signature = get_signature(file_path)
+            if signature is None:
+                self.pending.pop(file_path, None)
+                self.own_files.pop(file_path, None)
+            elif self.own_files.get(file_path) == signature:
+                self.pending.pop(file_path, None)
+            elif file_path not in self.pending or self.pending[file_path][0] != signature:
+                self.pending[file_path] = (signature, now)
+
+    def ignore(self, file_path: str):
+        """
+        Пропуск файла, записанного программой, пока его не изменят.
+        :param file_path: Путь к файлу.
+        """
+        signature = get_signature(file_path)
+        if signature is not None:
+            self.own_files[file_path] = signature
+        self.pending.pop(file_path, None)
+
+    def pop_ready(self) -> list[str]:
+        """
+        Получение файлов, запись которых закончена.
+        :return: Пути к файлам.
+        """
+        now = time.monotonic()
+        ready = []
+        for file_path, (signature, since) in list(self.pending.items()):
+            current = get_signature(file_path)
+            if current is None:
+                del self.pending[file_path]
+            elif current != signature:
+                self.pending[file_path] = (current, now)
+            elif now - since >= self.delay:
+                del self.pending[file_path]
+                self.own_files.pop(file_path, None)
+                ready.append(file_path)
+        return sorted(ready)
+
+    def next_timeout(self, default: float) -> float:
+        """
+        Получение времени ожидания до проверки следующего файла.
+        :param default: Время ожидания, если файлов нет.
+        :return: Время ожидания в секундах.
+        """
+        if len(self.pending) < 1:
+            return default
+        now = time.monotonic()
+        return max(0.0, min(since + self.delay - now for _, since in self.pending.values()))
+
+
+def parse_watch_interval(value: str) -> float:
+    """
+    Проверка интервала между обходами директорий.
+    :param value: Интервал в секундах.
+    :return: Интервал в секундах.
+    """
+    try:
+        interval = float(value)
+    except ValueError:
+        interval = 0.0
+    if not math.isfinite(interval) or interval <= 0 or interval > MAX_WAIT_SECONDS:
+        raise argparse.ArgumentTypeError(t("main.watch_interval_invalid") % (MAX_WAIT_SECONDS,
+                                                                              value))
+    return interval
+
+
+def parse_debounce(value: str) -> float:
+    """
+    Проверка времени без изменений, после которого файл считается записанным.
+    :param value: Время в секундах.
+    :return: Время в секундах.
+    """
+    try:
+        debounce = float(value)
+    except ValueError:
+        debounce = -1.0
+    if not math.isfinite(debounce) or debounce < 0 or debounce > MAX_WAIT_SECONDS:
+        raise argparse.ArgumentTypeError(t("main.debounce_invalid") % (MAX_WAIT_SECONDS, value))
+    return debounce